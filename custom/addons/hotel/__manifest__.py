@@ -2,7 +2,7 @@
 
 {
     'name': 'Hotel Management',
-    'version': '11.0.1.0.0',
+    'version': '11.0.1.1.0',
     'author': 'Odoo Community Association (OCA), Serpent Consulting \
                Services Pvt. Ltd., OpenERP SA',
     'category': 'Generic Modules/Hotel Management',
@@ -15,6 +15,8 @@
             'security/hotel_security.xml',
             'security/ir.model.access.csv',
             'views/hotel_sequence.xml',
+            'views/hotel_scheduler.xml',
+            'views/hotel_gateway_data.xml',
             'views/hotel_report.xml',
             'views/report_hotel_management.xml',
             'views/hotel_view.xml',
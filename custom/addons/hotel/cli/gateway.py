@@ -0,0 +1,75 @@
+# See LICENSE file for full copyright and licensing details.
+import argparse
+import logging
+import os
+import sys
+
+import odoo
+from odoo import api, SUPERUSER_ID
+from odoo.cli import Command
+from odoo.tools import config
+
+from ..gateway.service import GatewayService
+
+_logger = logging.getLogger(__name__)
+
+
+class HotelGateway(Command):
+    """Serve the room controllers and flush their status to the database"""
+
+    def run(self, args):
+        parser = argparse.ArgumentParser(
+            prog='%s hotelgateway' % sys.argv[0].split(os.path.sep)[-1],
+            description=self.__doc__)
+        parser.add_argument('--gateway-bind', default='0.0.0.0',
+                            help='address the controllers send to')
+        parser.add_argument('--gateway-port', type=int, default=80)
+        parser.add_argument('--flush-interval', type=float, default=1.0,
+                            help='seconds between two database flushes')
+        parser.add_argument('--flush-workers', type=int, default=2,
+                            help='database connections used at most')
+        parser.add_argument('--command-timeout', type=float, default=5.0,
+                            help='seconds to wait for a command ack')
+        parser.add_argument('--command-attempts', type=int, default=3,
+                            help='times a command is sent before failing')
+        parser.add_argument('--poll-interval', type=float, default=0,
+                            help='seconds between two polls sent to the '
+                                 'gateways, 0 to only answer theirs')
+        opts, odoo_args = parser.parse_known_args(args)
+        config.parse_config(odoo_args)
+        dbname = config['db_name']
+        if not dbname or ',' in dbname:
+            sys.exit('The hotelgateway command needs a single database, '
+                     'use -d/--database.')
+
+        def call(model, method, *args):
+            # One short transaction per call, on a pooled connection. The
+            # gateways and the room maps are ormcached: pick up the cache
+            # invalidations signaled by the other workers first, and
+            # signal ours, like an RPC call does.
+            registry = odoo.registry(dbname).check_signaling()
+            with registry.manage_changes(), api.Environment.manage(), \
+                    registry.cursor() as cr:
+                env = api.Environment(cr, SUPERUSER_ID, {})
+                return getattr(env[model], method)(*args)
+
+        # Commands left in flight by a previous run are sent again.
+        call('hotel.room.command', '_requeue_sent')
+        service = GatewayService(
+            lambda states, gateway_id: call(
+                'hotel.room', '_apply_gateway_status', states, gateway_id),
+            bind=(opts.gateway_bind, opts.gateway_port),
+            flush_interval=opts.flush_interval,
+            workers=opts.flush_workers,
+            gateway_source=lambda: call('hotel.gateway', '_get_gateway_links'),
+            command_source=lambda limit: call(
+                'hotel.room.command', '_take_queued', limit),
+            result_sink=lambda results: call(
+                'hotel.room.command', '_apply_results', results),
+            command_timeout=opts.command_timeout,
+            command_attempts=opts.command_attempts,
+            poll_interval=opts.poll_interval)
+        try:
+            service.run_forever()
+        except KeyboardInterrupt:
+            _logger.info('Gateway stopped')
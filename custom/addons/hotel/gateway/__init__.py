@@ -0,0 +1,12 @@
+# See LICENSE file for full copyright and licensing details.
+"""
+UDP gateway between the room controllers and the database.
+
+This package does not import odoo: it is a plain asyncio program fed
+with callables doing the database work, see hotel/cli/gateway.py.
+"""
+
+from . import codec
+from . import commands
+from . import protocol
+from . import service
@@ -0,0 +1,62 @@
+# See LICENSE file for full copyright and licensing details.
+"""
+Microbenchmark of the frame codec against the former string based
+packet building, run from the hotel module directory with::
+
+    python3 -m gateway.benchmark
+"""
+
+import binascii
+import timeit
+
+from . import codec
+
+
+def legacy_checksum(dsa):
+    a3 = dsa[3]
+    for i in range(4, len(dsa)):
+        a3 = a3 ^ dsa[i]
+    a4 = hex(int(str(a3 & 127)))[2:4]
+    if len(a4) == 1:
+        a4 = '0' + a4
+    return a4
+
+
+def legacy_card_frame(card, room, slot):
+    room = str(room)
+    if len(room) == 1:
+        room = '0' + room
+    slot = hex(slot)[2:4]
+    if len(slot) == 1:
+        slot = '0' + slot
+    dsa = binascii.unhexlify('DDDDDD0101')
+    dsa += binascii.unhexlify(room)
+    dsa += binascii.unhexlify('650000')
+    dsa += binascii.unhexlify(slot)
+    for digit in card:
+        dsa += binascii.unhexlify(str(30 + int(digit)))
+    dsa += binascii.unhexlify('00' * 32)
+    dsa += binascii.unhexlify(legacy_checksum(dsa))
+    dsa += binascii.unhexlify('BB')
+    return dsa
+
+
+def codec_card_frame(card, room, slot):
+    return codec.CardMessage(room, slot, codec.card_number(card)).encode()
+
+
+def main(number=20000):
+    assert legacy_card_frame('12345', 12, 10) == \
+        codec_card_frame('12345', 12, 10)
+    for name, func in (('legacy', legacy_card_frame),
+                       ('codec', codec_card_frame)):
+        seconds = timeit.timeit(lambda: func('12345', 12, 10), number=number)
+        print('%-8s %8.2f us per frame' % (name, seconds / number * 1e6))
+    frame = codec_card_frame('12345', 12, 10)
+    seconds = timeit.timeit(lambda: codec.Message.decode(frame),
+                            number=number)
+    print('%-8s %8.2f us per frame' % ('decode', seconds / number * 1e6))
+
+
+if __name__ == '__main__':
+    main()
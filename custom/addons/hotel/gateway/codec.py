@@ -0,0 +1,239 @@
+# See LICENSE file for full copyright and licensing details.
+"""
+Codec of the frames exchanged with the room controllers.
+
+Every full frame is 49 bytes long::
+
+    0-2   DD DD DD  header
+    3     message class, always 1 for the frames sent by the gateway
+    4     message type
+    5-46  payload, zero padded
+    47    checksum: XOR of the bytes 3 to 46, masked to 7 bits
+    48    BB  terminator
+
+Frames are built in place in a preallocated bytearray, without going
+through intermediate strings.
+"""
+
+import datetime
+import struct
+
+FRAME_SIZE = 49
+HEADER = b'\xdd\xdd\xdd'
+TERMINATOR = 0xbb
+MESSAGE_CLASS = 1
+PAYLOAD_OFFSET = 5
+CHECKSUM_OFFSET = FRAME_SIZE - 2
+
+TYPE_POLL = 0
+TYPE_CARD = 1
+TYPE_CHECK = 2
+
+# Card bytes written to a slot to erase the card programmed in it.
+NO_CARD = b'\xff' * 5
+
+# The checksummed bytes 3 to 46 are read as five 64 bits words and one
+# 32 bits word, folded together and then down to one byte.
+_CHECKSUM_WORDS = struct.Struct('>5QI')
+_FRAME_HEAD = struct.Struct('>3sBB')
+
+
+class CodecError(ValueError):
+    """Raised when a frame cannot be decoded."""
+
+
+def checksum(frame):
+    """Return the checksum of a frame, which must be at least 47 bytes."""
+    words = _CHECKSUM_WORDS.unpack_from(frame, 3)
+    value = words[0] ^ words[1] ^ words[2] ^ words[3] ^ words[4]
+    value ^= value >> 32
+    value ^= words[5]
+    value ^= value >> 16
+    value ^= value >> 8
+    return value & 0x7f
+
+
+def to_bcd(value):
+    """
+    Return the byte of a room number as the controllers expect it: the
+    two decimal digits of the number, one per nibble.
+    """
+    if not 0 <= value < 100:
+        raise CodecError('Room %s cannot be addressed, the controllers '
+                         'know the rooms 0 to 99.' % value)
+    return (value // 10) << 4 | value % 10
+
+
+def from_bcd(byte):
+    return (byte >> 4) * 10 + (byte & 0x0f)
+
+
+class Message(object):
+    """Frame sent by the gateway to a controller."""
+
+    __slots__ = ()
+    message_type = None
+    # struct layout of the payload, at the start of the payload area
+    layout = None
+    _registry = {}
+
+    def fields(self):
+        """Return the values packed with the layout."""
+        raise NotImplementedError()
+
+    @classmethod
+    def from_fields(cls, values):
+        raise NotImplementedError()
+
+    def encode(self):
+        frame = bytearray(FRAME_SIZE)
+        _FRAME_HEAD.pack_into(frame, 0, HEADER, MESSAGE_CLASS,
+                              self.message_type)
+        self.layout.pack_into(frame, PAYLOAD_OFFSET, *self.fields())
+        frame[CHECKSUM_OFFSET] = checksum(frame)
+        frame[-1] = TERMINATOR
+        return bytes(frame)
+
+    @staticmethod
+    def register(cls):
+        Message._registry[cls.message_type] = cls
+        return cls
+
+    @staticmethod
+    def decode(data):
+        """Return the message of a full frame."""
+        if len(data) != FRAME_SIZE:
+            raise CodecError('Frames are %s bytes long, got %s.'
+                             % (FRAME_SIZE, len(data)))
+        header, _message_class, message_type = _FRAME_HEAD.unpack_from(data)
+        if header != HEADER or data[-1] != TERMINATOR:
+            raise CodecError('Not a controller frame.')
+        if data[CHECKSUM_OFFSET] != checksum(data):
+            raise CodecError('Wrong frame checksum.')
+        cls = Message._registry.get(message_type)
+        if cls is None:
+            raise CodecError('Unknown message type %s.' % message_type)
+        return cls.from_fields(cls.layout.unpack_from(data, PAYLOAD_OFFSET))
+
+    def _values(self):
+        return tuple((name, getattr(self, name))
+                     for klass in reversed(type(self).__mro__)
+                     for name in getattr(klass, '__slots__', ()))
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self._values() == other._values()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((type(self), self._values()))
+
+    def __repr__(self):
+        return '%s(%s)' % (type(self).__name__, ', '.join(
+            '%s=%r' % value for value in self._values()))
+
+
+@Message.register
+class PollReply(Message):
+    """Answer to a controller poll, setting the clock of the controller.
+    """
+
+    __slots__ = ('day', 'month', 'year', 'hour', 'minute', 'second')
+    message_type = TYPE_POLL
+    layout = struct.Struct('>6B')
+
+    # The controllers are sent a fixed year and second since the first
+    # deployment; they are kept so that the frames stay the same.
+    def __init__(self, day, month, hour, minute, year=18, second=20):
+        self.day = day
+        self.month = month
+        self.year = year
+        self.hour = hour
+        self.minute = minute
+        self.second = second
+
+    @classmethod
+    def now(cls):
+        now = datetime.datetime.now()
+        return cls(now.day, now.month, now.hour, now.minute)
+
+    def fields(self):
+        return (self.day, self.month, self.year, self.hour, self.minute,
+                self.second)
+
+    @classmethod
+    def from_fields(cls, values):
+        day, month, year, hour, minute, second = values
+        return cls(day, month, hour, minute, year=year, second=second)
+
+
+@Message.register
+class CardMessage(Message):
+    """Program a card in a slot of the lock of a room."""
+
+    __slots__ = ('room', 'slot', 'card')
+    message_type = TYPE_CARD
+    layout = struct.Struct('>B3sB5s')
+    _OPCODE = b'\x65\x00\x00'
+
+    def __init__(self, room, slot, card):
+        if len(card) != 5:
+            raise CodecError('Card numbers are 5 bytes long.')
+        self.room = room
+        self.slot = slot
+        self.card = bytes(card)
+
+    def fields(self):
+        return (to_bcd(self.room), self._OPCODE, self.slot, self.card)
+
+    @classmethod
+    def from_fields(cls, values):
+        room, _opcode, slot, card = values
+        if card == NO_CARD:
+            return CardDelete(from_bcd(room), slot)
+        return cls(from_bcd(room), slot, card)
+
+
+class CardDelete(CardMessage):
+    """Erase the card programmed in a slot of the lock of a room."""
+
+    __slots__ = ()
+
+    def __init__(self, room, slot):
+        super(CardDelete, self).__init__(room, slot, NO_CARD)
+
+
+def card_number(number):
+    """Return the card bytes of a card number, as read from the reader."""
+    card = str(number)[:5].encode('ascii')
+    if len(card) != 5 or not card.isdigit():
+        raise CodecError('Card numbers are made of 5 digits.')
+    return card
+
+
+@Message.register
+class CardCheck(Message):
+    """Ask a controller for the card programmed in a slot of a room."""
+
+    __slots__ = ('room', 'slot')
+    message_type = TYPE_CHECK
+    layout = struct.Struct('>B2sB')
+    _OPCODE = b'\x02\x00'
+
+    def __init__(self, room, slot):
+        self.room = room
+        self.slot = slot
+
+    def fields(self):
+        return (to_bcd(self.room), self._OPCODE, self.slot)
+
+    @classmethod
+    def from_fields(cls, values):
+        room, _opcode, slot = values
+        return cls(from_bcd(room), slot)
+
+
+def is_ack(data):
+    """Return whether a controller acknowledged a command successfully."""
+    return bool(data) and data[0] == 1
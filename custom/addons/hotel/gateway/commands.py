@@ -0,0 +1,141 @@
+# See LICENSE file for full copyright and licensing details.
+"""
+Queue of the card commands relayed to the room controllers.
+
+The controllers pull the commands: every poll is answered with the next
+command ready to be sent, or with the poll reply. Commands to different
+rooms are in flight at the same time, the commands of one room are sent
+one after the other. An acknowledgement is matched to its command by the
+room it echoes, or else, when it echoes none, to the oldest command in
+flight on the host it comes from. A command which is not acknowledged
+in time is sent again up to the allowed number of attempts, then
+reported as failed.
+"""
+
+import collections
+import time
+
+from . import codec
+
+DONE = 'done'
+FAILED = 'failed'
+
+
+class Command(object):
+
+    __slots__ = ('id', 'room', 'frame', 'attempts', 'deadline', 'address')
+
+    def __init__(self, command_id, frame):
+        self.id = command_id
+        self.frame = bytes(frame)
+        self.room = self.frame[5]
+        self.attempts = 0
+        self.deadline = None
+        self.address = None
+
+    @property
+    def in_flight(self):
+        return self.deadline is not None
+
+
+class CommandQueue(object):
+    """
+    :param timeout: seconds to wait for the acknowledgement of a command
+    :param attempts: number of times a command is sent before failing
+    """
+
+    def __init__(self, timeout=5.0, attempts=3, clock=time.monotonic):
+        self.timeout = timeout
+        self.attempts = attempts
+        self.clock = clock
+        # room byte -> commands of the room, the first one may be in flight
+        self.rooms = collections.OrderedDict()
+        self.known = set()
+        self.results = []
+
+    def __len__(self):
+        return sum(len(commands) for commands in self.rooms.values())
+
+    def submit(self, command_id, frame):
+        """Queue a frame; the id identifies the command in the results."""
+        if command_id is not None:
+            if command_id in self.known:
+                return
+            self.known.add(command_id)
+        command = Command(command_id, frame)
+        self.rooms.setdefault(command.room, collections.deque()).append(
+            command)
+
+    def next_frame(self, address):
+        """
+        Return the frame to answer a poll from a controller with, None
+        when no command is waiting to be sent.
+        """
+        for commands in self.rooms.values():
+            command = commands[0]
+            if command.in_flight:
+                continue
+            command.attempts += 1
+            command.deadline = self.clock() + self.timeout
+            command.address = address
+            # Move the room last so that the other rooms get their turn.
+            self.rooms.move_to_end(command.room)
+            return command.frame
+        return None
+
+    def acknowledge(self, data, address):
+        """
+        Match an acknowledgement with the command it answers. The
+        controllers may reply from another source port than the one they
+        polled from, so only their host is compared.
+        """
+        candidates = [commands[0] for commands in self.rooms.values()
+                      if commands[0].in_flight and
+                      commands[0].address[0] == address[0]]
+        if len(data) > 1:
+            # A reply echoing another room does not answer these.
+            candidates = [command for command in candidates
+                          if command.room == data[1]]
+        if not candidates:
+            return None
+        command = min(candidates, key=lambda command: command.deadline)
+        if codec.is_ack(data):
+            self._finish(command, DONE)
+        else:
+            self._finish(command, FAILED, 'The controller refused the '
+                                          'command.')
+        return command
+
+    def expire(self):
+        """Send again or fail the commands whose acknowledgement is late.
+        """
+        now = self.clock()
+        for commands in list(self.rooms.values()):
+            command = commands[0]
+            if not command.in_flight or command.deadline > now:
+                continue
+            if command.attempts < self.attempts:
+                command.deadline = None
+            else:
+                self._finish(command, FAILED, 'No acknowledgement after '
+                                              '%s attempts.'
+                             % command.attempts)
+
+    def fail_all(self, message):
+        """Report every command of the queue as failed."""
+        for room_commands in list(self.rooms.values()):
+            for command in list(room_commands):
+                self._finish(command, FAILED, message)
+
+    def _finish(self, command, state, message=None):
+        commands = self.rooms[command.room]
+        commands.popleft()
+        if not commands:
+            del self.rooms[command.room]
+        if command.id is not None:
+            self.known.discard(command.id)
+            self.results.append((command.id, state, message))
+
+    def pop_results(self):
+        results, self.results = self.results, []
+        return results
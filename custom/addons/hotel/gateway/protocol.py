@@ -0,0 +1,93 @@
+# See LICENSE file for full copyright and licensing details.
+"""
+Frames exchanged with the room controllers.
+
+A controller polls the gateway with a short frame and receives either
+a pending command or the poll reply carrying the current time, see
+codec.py for the full frames. The controllers report the flags of their
+rooms with status frames.
+"""
+
+from .codec import FRAME_SIZE, TYPE_CARD, TYPE_CHECK
+
+POLL_SIZE = 7
+STATUS_MARKER = 241
+
+# A controller answers a command with a short reply: its first byte tells
+# whether the command was carried out, the second one, when sent, echoes
+# the room byte of the command.
+REPLY_ACCEPTED = 1
+REPLY_REFUSED = 0
+REPLY_MAX_SIZE = 2
+
+COMMAND_TYPES = (TYPE_CARD, TYPE_CHECK)
+
+# Bits of the status byte of a room in a status frame.
+STATUS_SOS = 0x80
+STATUS_STAFF_CALL = 0x40
+STATUS_DO_NOT_DISTURB = 0x20
+STATUS_GUEST = 0x01
+
+STATUS_MASK = (STATUS_SOS | STATUS_STAFF_CALL | STATUS_DO_NOT_DISTURB |
+               STATUS_GUEST)
+
+# The status byte of room n is the byte n * ROOM_STRIDE of the frame.
+ROOM_STRIDE = 4
+
+
+def is_poll(data):
+    return len(data) == POLL_SIZE
+
+
+def is_command(data):
+    return len(data) == FRAME_SIZE and data[4] in COMMAND_TYPES
+
+
+def is_status(data):
+    return len(data) > 3 and data[3] == STATUS_MARKER
+
+
+def is_reply(data):
+    return (0 < len(data) <= REPLY_MAX_SIZE and
+            data[0] in (REPLY_ACCEPTED, REPLY_REFUSED))
+
+
+def decode_status(data):
+    """
+    Return the status bytes of a status frame, the byte i being the
+    status of the room number i + 1, masked to the known flags.
+    """
+    statuses = bytes(memoryview(data)[ROOM_STRIDE::ROOM_STRIDE])
+    mask = STATUS_MASK.to_bytes(1, 'big') * len(statuses)
+    value = int.from_bytes(statuses, 'big') & int.from_bytes(mask, 'big')
+    return value.to_bytes(len(statuses), 'big')
+
+
+class StatusDecoder(object):
+    """
+    Decode the status frames of a controller against the previous one.
+    A frame is unpacked in one pass and XORed with the previous frame,
+    so that only the rooms whose flags changed come out of it.
+    """
+
+    def __init__(self):
+        self.previous = None
+
+    def diff(self, data):
+        """
+        Return the mapping {room number: status byte} of the rooms whose
+        flags changed since the previous frame, of every room for the
+        first frame.
+        """
+        statuses = decode_status(data)
+        previous, self.previous = self.previous, statuses
+        if previous is None or len(previous) != len(statuses):
+            return {index + 1: status
+                    for index, status in enumerate(statuses)}
+        changed = (int.from_bytes(statuses, 'big') ^
+                   int.from_bytes(previous, 'big'))
+        if not changed:
+            return {}
+        changed = changed.to_bytes(len(statuses), 'big')
+        return {index + 1: statuses[index]
+                for index, flags in enumerate(changed) if flags}
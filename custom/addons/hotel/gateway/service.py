@@ -0,0 +1,299 @@
+# See LICENSE file for full copyright and licensing details.
+"""
+asyncio service answering the room controllers.
+
+Every gateway, a controller bus with its own address, is served by a
+link with its own receive queue, status decoder and command queue, so
+that a busy gateway never delays the others. Datagrams are only routed
+to their link on the event loop; every link consumes its queue in its
+own task. The room states and the card commands are exchanged with the
+database every flush interval, all links at once, from a small thread
+pool so that the database work never blocks the socket.
+"""
+
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from . import codec
+from . import commands
+from . import protocol
+
+_logger = logging.getLogger(__name__)
+
+
+class GatewayProtocol(asyncio.DatagramProtocol):
+
+    def __init__(self, service):
+        self.service = service
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        self.service.datagram_received(data, addr)
+
+    def error_received(self, exc):
+        _logger.warning('Gateway socket error: %s', exc)
+
+
+class GatewayLink(object):
+    """
+    Traffic of one gateway. The link of a gateway id None serves the
+    controllers of no configured gateway.
+    """
+
+    def __init__(self, service, gateway_id, address=None):
+        self.service = service
+        self.id = gateway_id
+        self.address = address
+        self.inbox = asyncio.Queue()
+        self.decoder = protocol.StatusDecoder()
+        self.commands = commands.CommandQueue(
+            timeout=service.command_timeout,
+            attempts=service.command_attempts)
+        self.pending = {}
+        self.task = None
+
+    def start(self):
+        self.task = self.service.loop.create_task(self.receive())
+
+    def stop(self):
+        if self.task:
+            self.task.cancel()
+
+    async def receive(self):
+        while True:
+            data, addr = await self.inbox.get()
+            try:
+                self.handle(data, addr)
+            except Exception:
+                _logger.exception('Gateway %s could not handle a frame '
+                                  'from %s', self.id, addr)
+
+    def handle(self, data, addr):
+        if protocol.is_poll(data):
+            # The controller polls: relay a queued command, or answer
+            # with the poll reply setting its clock.
+            self.service.send(self.commands.next_frame(addr) or
+                              codec.PollReply.now().encode(), addr)
+        elif protocol.is_status(data):
+            if self.id is None and self.service.links:
+                # The rooms are served by the configured gateways, a
+                # frame from elsewhere cannot tell which rooms it covers.
+                self.service.warn_unknown(addr)
+                return
+            # Only the rooms whose flags changed are flushed.
+            self.pending.update(self.decoder.diff(data))
+        elif protocol.is_command(data):
+            # Frame sent straight to the gateway, nobody waits for its
+            # outcome.
+            self.commands.submit(None, data)
+        elif protocol.is_reply(data):
+            self.commands.acknowledge(data, addr)
+        else:
+            # Noise must not settle the commands in flight.
+            _logger.debug('Gateway %s dropped a %s bytes datagram from %s',
+                          self.id, len(data), addr)
+
+    def poll(self):
+        """Send the next command, or the poll reply, to the gateway."""
+        if self.address:
+            self.service.send(self.commands.next_frame(self.address) or
+                              codec.PollReply.now().encode(), self.address)
+
+    async def flush_states(self):
+        if not self.pending:
+            return
+        states, self.pending = self.pending, {}
+        try:
+            await self.service.run(self.service.sink, states, self.id)
+        except Exception:
+            # The frames only bring the changed rooms, keep the states
+            # which were not superseded meanwhile for the next flush.
+            _logger.exception('Gateway %s flush of %s rooms failed',
+                              self.id, len(states))
+            for number, status in states.items():
+                self.pending.setdefault(number, status)
+
+    async def flush_results(self):
+        self.commands.expire()
+        results = self.commands.pop_results()
+        if not results or not self.service.result_sink:
+            return
+        try:
+            await self.service.run(self.service.result_sink, results)
+        except Exception:
+            _logger.exception('Gateway %s flush of %s command results '
+                              'failed', self.id, len(results))
+            self.commands.results[:0] = results
+
+
+class GatewayService(object):
+    """
+    UDP gateway between the room controllers and the database.
+
+    :param sink: callable receiving {room number: status byte} and the
+                 id of the gateway which reported them, called from the
+                 thread pool with the states merged since the previous
+                 flush
+    :param bind: (host, port) the controllers send their frames to
+    :param flush_interval: seconds between two flushes to the sink
+    :param workers: size of the thread pool, hence of the number of
+                    database connections used at once
+    :param gateway_source: callable returning the gateways as
+                           (gateway id, (host, port)) tuples, called at
+                           startup and every refresh interval
+    :param command_source: callable receiving a number of commands and
+                           returning at most as many queued commands as
+                           (command id, frame, gateway id) tuples
+    :param result_sink: callable receiving the outcome of the commands
+                        as (command id, state, message) tuples
+    :param command_timeout: seconds to wait for the acknowledgement of
+                            a command before sending it again
+    :param command_attempts: number of times a command is sent
+    :param max_commands: commands held by the gateway at once
+    :param poll_interval: seconds between two polls sent to all the
+                          gateways at once, 0 to only answer theirs
+    :param refresh_interval: seconds between two reloads of the gateways
+    """
+
+    def __init__(self, sink, bind=('0.0.0.0', 80), flush_interval=1.0,
+                 workers=2, loop=None, gateway_source=None,
+                 command_source=None, result_sink=None, command_timeout=5.0,
+                 command_attempts=3, max_commands=100, poll_interval=0,
+                 refresh_interval=60.0):
+        self.sink = sink
+        self.bind = bind
+        self.flush_interval = flush_interval
+        self.loop = loop or asyncio.get_event_loop()
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.gateway_source = gateway_source
+        self.command_source = command_source
+        self.result_sink = result_sink
+        self.command_timeout = command_timeout
+        self.command_attempts = command_attempts
+        self.max_commands = max_commands
+        self.poll_interval = poll_interval
+        self.refresh_interval = refresh_interval
+        self.fallback = GatewayLink(self, None)
+        self.links = {}
+        self.links_by_host = {}
+        self.transport = None
+        self.tasks = []
+        self.unknown_hosts = set()
+
+    def datagram_received(self, data, addr):
+        link = self.links_by_host.get(addr[0], self.fallback)
+        link.inbox.put_nowait((data, addr))
+
+    def warn_unknown(self, addr):
+        if addr[0] not in self.unknown_hosts:
+            self.unknown_hosts.add(addr[0])
+            _logger.warning('Gateway ignores the room status sent by %s, '
+                            'which is not a configured gateway', addr[0])
+
+    def send(self, frame, addr):
+        self.transport.sendto(frame, addr)
+
+    def run(self, func, *args):
+        return self.loop.run_in_executor(self.executor, func, *args)
+
+    def all_links(self):
+        return [self.fallback] + list(self.links.values())
+
+    def set_gateways(self, gateways):
+        """Add, move and remove the links after the configured gateways.
+        """
+        gateways = dict(gateways)
+        for gateway_id in set(self.links) - set(gateways):
+            link = self.links.pop(gateway_id)
+            link.stop()
+            # Its commands are reported as failed rather than lost.
+            link.commands.fail_all('The gateway was removed.')
+            self.fallback.commands.results += link.commands.pop_results()
+        for gateway_id, address in gateways.items():
+            link = self.links.get(gateway_id)
+            if link is None:
+                link = self.links[gateway_id] = GatewayLink(
+                    self, gateway_id, tuple(address))
+                link.start()
+            link.address = tuple(address)
+        self.links_by_host = {link.address[0]: link
+                              for link in self.links.values()}
+
+    async def refresh(self):
+        if not self.gateway_source:
+            return
+        try:
+            gateways = await self.run(self.gateway_source)
+        except Exception:
+            _logger.exception('Gateway could not load the gateways')
+            return
+        self.set_gateways(gateways)
+
+    async def fetch_commands(self):
+        free = self.max_commands - sum(len(link.commands)
+                                       for link in self.all_links())
+        if not self.command_source or free <= 0:
+            return
+        try:
+            queued = await self.run(self.command_source, free)
+        except Exception:
+            _logger.exception('Gateway could not fetch the commands')
+            return
+        for command_id, frame, gateway_id in queued:
+            link = self.links.get(gateway_id, self.fallback)
+            link.commands.submit(command_id, frame)
+
+    async def flush(self):
+        links = self.all_links()
+        await asyncio.gather(
+            self.fetch_commands(),
+            *([link.flush_states() for link in links] +
+              [link.flush_results() for link in links]))
+
+    async def flusher(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def refresher(self):
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            await self.refresh()
+
+    async def poller(self):
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            for link in list(self.links.values()):
+                link.poll()
+
+    async def start(self):
+        self.transport, _protocol = await self.loop.create_datagram_endpoint(
+            lambda: GatewayProtocol(self), local_addr=self.bind)
+        _logger.info('Gateway listening on %s:%s', *self.bind)
+        self.fallback.start()
+        await self.refresh()
+        self.tasks = [self.loop.create_task(self.flusher())]
+        if self.gateway_source:
+            self.tasks.append(self.loop.create_task(self.refresher()))
+        if self.poll_interval:
+            self.tasks.append(self.loop.create_task(self.poller()))
+
+    def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        for link in self.all_links():
+            link.stop()
+
+    def run_forever(self):
+        self.loop.run_until_complete(self.start())
+        try:
+            self.loop.run_forever()
+        finally:
+            self.stop()
+            self.loop.run_until_complete(self.flush())
+            self.transport.close()
+            self.executor.shutdown()
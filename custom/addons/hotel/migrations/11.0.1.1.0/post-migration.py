@@ -0,0 +1,14 @@
+# See LICENSE file for full copyright and licensing details.
+
+from odoo import api, SUPERUSER_ID
+
+
+def migrate(cr, version):
+    """
+    The folio lines priced before the rate price was stored would never
+    follow their dates again: give them their rate price.
+    """
+    if not version:
+        return
+    env = api.Environment(cr, SUPERUSER_ID, {})
+    env['hotel.folio.line']._init_rate_price()
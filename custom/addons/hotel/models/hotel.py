@@ -2,17 +2,32 @@
 import time
 import logging
 import datetime
-import binascii
 import ast
 import socket
 from odoo.http import request
 from odoo.exceptions import UserError, ValidationError
 from odoo.osv import expression
-from odoo.tools import DEFAULT_SERVER_DATETIME_FORMAT
-from odoo import api, fields, models, _
+from odoo.tools import DEFAULT_SERVER_DATETIME_FORMAT, float_compare
+from odoo.tools.sql import column_exists, index_exists
+from odoo import api, fields, models, tools, _
+from odoo.addons import decimal_precision as dp
+from ..gateway import codec, protocol
 import socket
 _logger = logging.getLogger(__name__)
 
+HODNIK_SELECTION = [('a', 'A'), ('b', 'B'), ('c', 'C'), ('d', 'D')]
+
+# Slot of the locks the cards are programmed in.
+PROGRAMMING_SLOT = 0x0a
+
+# Codes of the room occupancy matrix cells, a busier state wins when
+# several lines cover the same day.
+OCCUPANCY_STATES = ['free', 'draft', 'reserved', 'folio']
+
+# Bus channel on which the room occupancy changes are published.
+OCCUPANCY_CHANNEL = 'hotel_room_summary'
+
+
 def _offset_format_timestamp1(src_tstamp_str, src_format, dst_format,
                               ignore_unparsable_time=True, context=None):
     """
@@ -70,60 +85,89 @@ class HotelFloor(models.Model):
     sequence = fields.Integer(index=True)
 
 
+class HotelCategoryMixin(models.AbstractModel):
+    """
+    Category tree kept with _parent_store and a stored complete name, so
+    that name_get is a column read and name_search a single ilike on an
+    indexed column, whatever the depth of the tree.
+    """
+
+    _name = 'hotel.category.mixin'
+    _description = 'Hotel Category Tree'
+    _parent_store = True
+    _parent_order = 'name'
+    _order = 'complete_name'
+
+    parent_left = fields.Integer('Left Parent', index=True)
+    parent_right = fields.Integer('Right Parent', index=True)
+
+    @api.model_cr
+    def init(self):
+        """
+        Add a trigram index on the complete name when pg_trgm is
+        available, so that ilike searches do not scan the table.
+        """
+        if self._abstract:
+            return
+        self._cr.execute("SELECT 1 FROM pg_extension WHERE extname = %s",
+                         ('pg_trgm',))
+        index_name = '%s_complete_name_trgm_index' % self._table
+        if self._cr.fetchone() and not index_exists(self._cr, index_name):
+            self._cr.execute('CREATE INDEX "%s" ON "%s" USING gin '
+                             '(complete_name gin_trgm_ops)'
+                             % (index_name, self._table))
+
+    @api.multi
+    def _compute_complete_name(self):
+        for cat in self:
+            parent = cat[cat._parent_name]
+            if parent:
+                cat.complete_name = '%s / %s' % (parent.complete_name,
+                                                 cat.name)
+            else:
+                cat.complete_name = cat.name
+
+    @api.multi
+    def _check_category_recursion(self):
+        if not self._check_recursion():
+            raise ValidationError(_('You cannot create recursive '
+                                    'categories.'))
+
+    @api.multi
+    def name_get(self):
+        return [(cat.id, cat.complete_name) for cat in self]
+
+    @api.model
+    def name_search(self, name, args=None, operator='ilike', limit=100):
+        domain = args or []
+        if name:
+            domain = expression.AND([[('complete_name', operator, name)],
+                                     domain])
+        return self.search(domain, limit=limit).name_get()
+
+
 class HotelRoomType(models.Model):
 
     _name = "hotel.room.type"
     _description = "Room Type"
+    _inherit = 'hotel.category.mixin'
+    _parent_name = 'categ_id'
 
     name = fields.Char(required=True)
     categ_id = fields.Many2one('hotel.room.type', 'Category')
     child_ids = fields.One2many('hotel.room.type', 'categ_id',
                                'Child Categories')
+    complete_name = fields.Char('Complete Name',
+                                compute='_compute_complete_name',
+                                store=True, index=True)
 
-    @api.multi
-    def name_get(self):
-        def get_names(cat):
-            """ Return the list [cat.name, cat.categ_id.name, ...] """
-            res = []
-            while cat:
-                res.append(cat.name)
-                cat = cat.categ_id
-            return res
-        return [(cat.id, " / ".join(reversed(get_names(cat)))) for cat in self]
+    @api.depends('name', 'categ_id.complete_name')
+    def _compute_complete_name(self):
+        return super(HotelRoomType, self)._compute_complete_name()
 
-    @api.model
-    def name_search(self, name, args=None, operator='ilike', limit=100):
-        if not args:
-            args = []
-        if name:
-            # Be sure name_search is symmetric to name_get
-            category_names = name.split(' / ')
-            parents = list(category_names)
-            child = parents.pop()
-            domain = [('name', operator, child)]
-            if parents:
-                names_ids = self.name_search(' / '.join(parents), args=args,
-                                             operator='ilike', limit=limit)
-                category_ids = [name_id[0] for name_id in names_ids]
-                if operator in expression.NEGATIVE_TERM_OPERATORS:
-                    categories = self.search([('id', 'not in', category_ids)])
-                    domain = expression.OR([[('categ_id', 'in',
-                                              categories.ids)], domain])
-                else:
-                    domain = expression.AND([[('categ_id', 'in',
-                                               category_ids)], domain])
-                for i in range(1, len(category_names)):
-                    domain = [[('name', operator,
-                                ' / '.join(category_names[-1 - i:]))], domain]
-                    if operator in expression.NEGATIVE_TERM_OPERATORS:
-                        domain = expression.AND(domain)
-                    else:
-                        domain = expression.OR(domain)
-            categories = self.search(expression.AND([domain, args]),
-                                     limit=limit)
-        else:
-            categories = self.search(args, limit=limit)
-        return categories.name_get()
+    @api.constrains('categ_id')
+    def _check_category_recursion(self):
+        return super(HotelRoomType, self)._check_category_recursion()
 
 
 class ProductProduct(models.Model):
@@ -134,60 +178,249 @@ class ProductProduct(models.Model):
     isservice = fields.Boolean('Is Service')
 
 
+class ProductPricelist(models.Model):
+
+    _inherit = "product.pricelist"
+
+    @api.model
+    def _get_hotel_prices(self, items):
+        """
+        Compute the unit prices and taxes of many lines at once. The lines
+        are grouped by pricelist and date, and every group is evaluated
+        with one pricelist call per set of distinct products. The taxes
+        are mapped with the fiscal position of the order, or else with the
+        one of the partner. The lines repeated in a call are priced once.
+        ------------------------------------------------------------------
+        @param self: object pointer
+        @param items: list of (product, qty, partner, pricelist, date,
+                      fiscal position) tuples
+        @return: list of {'price_unit', 'tax_id'}, in the order of the items
+        """
+        tax_obj = self.env['account.tax']
+        memo = {}
+        keys = [(product.id, qty, partner.id, pricelist.id, date, fpos.id)
+                for product, qty, partner, pricelist, date, fpos in items]
+        batches = {}
+        pending = {}
+        for key, item in zip(keys, items):
+            if key in pending:
+                continue
+            pending[key] = item
+            product, qty, partner, pricelist, date, fpos = item
+            # The pricelist returns one price per product id, the same
+            # product is priced again in the next batch of its group.
+            group = batches.setdefault((pricelist.id, date), [])
+            for batch in group:
+                if product.id not in batch:
+                    break
+            else:
+                batch = {}
+                group.append(batch)
+            batch[product.id] = key
+        prices = {}
+        for (pricelist_id, date), group in batches.items():
+            pricelist = self.browse(pricelist_id)
+            for batch in group:
+                if not pricelist:
+                    prices.update((key, pending[key][0].lst_price)
+                                  for key in batch.values())
+                    continue
+                rule_prices = pricelist._compute_price_rule(
+                    [pending[key][:3] for key in batch.values()],
+                    date=date)
+                prices.update((key, rule_prices[product_id][0])
+                              for product_id, key in batch.items())
+        for key, (product, qty, partner, pricelist, date, fpos) in \
+                pending.items():
+            company = pricelist.company_id or self.env.user.company_id
+            taxes = product.taxes_id.filtered(
+                lambda tax: tax.company_id == company)
+            fpos = fpos or partner.property_account_position_id
+            if fpos:
+                taxes = fpos.map_tax(taxes, product, partner)
+            price = tax_obj._fix_tax_included_price(prices[key],
+                                                    product.taxes_id, taxes)
+            memo[key] = (price, taxes.ids)
+        return [{'price_unit': memo[key][0],
+                 'tax_id': tax_obj.browse(memo[key][1])} for key in keys]
+
+
+class ProductTemplate(models.Model):
+
+    _inherit = "product.template"
+
+    @api.multi
+    def write(self, vals):
+        if 'company_id' in vals:
+            # The room number map of hotel.room is kept per company.
+            room_obj = self.env['hotel.room']
+            room_obj._get_room_number_map.clear_cache(room_obj)
+        return super(ProductTemplate, self).write(vals)
+
+
+class HotelRoomRate(models.Model):
+    """
+    Nightly rate of a room category over a period of days, optionally
+    restricted to a weekday and to a pricelist. A pricelist specific rate
+    wins over a generic one, then a weekday rate over an every day one,
+    then the rate starting last.
+    """
+
+    _name = 'hotel.room.rate'
+    _description = 'Room Rate'
+    _order = 'categ_id, date_from desc'
+
+    categ_id = fields.Many2one('hotel.room.type', 'Room Category',
+                               required=True, index=True, ondelete='cascade')
+    pricelist_id = fields.Many2one('product.pricelist', 'Pricelist',
+                                   index=True, ondelete='cascade',
+                                   help='Leave empty to apply the rate to '
+                                   'every pricelist.')
+    date_from = fields.Date('Date From', required=True)
+    date_to = fields.Date('Date To', required=True)
+    weekday = fields.Selection([('0', 'Monday'), ('1', 'Tuesday'),
+                                ('2', 'Wednesday'), ('3', 'Thursday'),
+                                ('4', 'Friday'), ('5', 'Saturday'),
+                                ('6', 'Sunday')],
+                               help='Leave empty to apply the rate to every '
+                               'day of the week.')
+    price = fields.Float('Nightly Rate', required=True,
+                         digits=dp.get_precision('Product Price'))
+
+    @api.constrains('date_from', 'date_to')
+    def check_dates(self):
+        for rate in self:
+            if rate.date_from > rate.date_to:
+                raise ValidationError(_('Rate Date From should be less '
+                                        'than the Date To!'))
+
+    @api.model
+    def create(self, vals):
+        self._clear_rate_caches()
+        return super(HotelRoomRate, self).create(vals)
+
+    @api.multi
+    def write(self, vals):
+        self._clear_rate_caches()
+        return super(HotelRoomRate, self).write(vals)
+
+    @api.multi
+    def unlink(self):
+        self._clear_rate_caches()
+        return super(HotelRoomRate, self).unlink()
+
+    @api.model
+    def _clear_rate_caches(self):
+        self._get_rate_prefix_sums.clear_cache(self)
+        self._get_stay_rate.clear_cache(self)
+
+    @api.model
+    @tools.ormcache('categ_id', 'pricelist_id')
+    def _get_rate_prefix_sums(self, categ_id, pricelist_id):
+        """
+        Return the first day covered by the rates of a category and the
+        prefix sums of its nightly rates and of its rated nights, one
+        entry per day of the span of the rates.
+        """
+        rates = self.search([('categ_id', '=', categ_id),
+                             ('pricelist_id', 'in', [pricelist_id, False])])
+        if not rates:
+            return None
+        first = fields.Date.from_string(min(rates.mapped('date_from')))
+        last = fields.Date.from_string(max(rates.mapped('date_to')))
+        best = [None] * ((last - first).days + 1)
+        for rate in rates:
+            rank = (bool(rate.pricelist_id), bool(rate.weekday),
+                    rate.date_from)
+            start = fields.Date.from_string(rate.date_from)
+            stop = fields.Date.from_string(rate.date_to)
+            for idx in range((start - first).days, (stop - first).days + 1):
+                day = first + datetime.timedelta(days=idx)
+                if rate.weekday and day.weekday() != int(rate.weekday):
+                    continue
+                if best[idx] is None or rank > best[idx][0]:
+                    best[idx] = (rank, rate.price)
+        prices = [0.0]
+        nights = [0]
+        for cell in best:
+            prices.append(prices[-1] + (cell[1] if cell else 0.0))
+            nights.append(nights[-1] + (1 if cell else 0))
+        return fields.Date.to_string(first), tuple(prices), tuple(nights)
+
+    @api.model
+    @tools.ormcache('categ_id', 'day_from', 'day_to', 'pricelist_id')
+    def _get_stay_rate(self, categ_id, day_from, day_to, pricelist_id):
+        """
+        Return the sum of the nightly rates of a stay, its number of rated
+        nights and its number of nights, read from the prefix sums.
+        """
+        start_day = fields.Date.from_string(day_from)
+        nights = max((fields.Date.from_string(day_to) - start_day).days, 1)
+        sums = self._get_rate_prefix_sums(categ_id, pricelist_id)
+        if not sums:
+            return 0.0, 0, nights
+        first, prices, counts = sums
+        offset = (start_day - fields.Date.from_string(first)).days
+        span = len(prices) - 1
+        start = min(max(offset, 0), span)
+        stop = min(max(offset + nights, 0), span)
+        return prices[stop] - prices[start], counts[stop] - counts[start], nights
+
+    @api.model
+    def get_stay_price(self, categ_id, checkin, checkout, pricelist_id=False,
+                       default_price=0.0):
+        """
+        Return the price of a stay in a room category, the nights without
+        rate being charged at the default price.
+        ------------------------------------------------------------------
+        @param self: object pointer
+        @param categ_id: room category id
+        @param checkin: check in date or datetime string
+        @param checkout: check out date or datetime string
+        @param pricelist_id: optional pricelist id
+        @param default_price: price of a night without rate
+        @return: total price of the stay
+        """
+        total, rated, nights = self._get_stay_rate(
+            categ_id, checkin[:10], checkout[:10], pricelist_id or False)
+        return total + (nights - rated) * default_price
+
+    @api.model
+    def get_nightly_price(self, categ_id, checkin, checkout,
+                          pricelist_id=False, default_price=0.0):
+        """
+        Return the average nightly price of a stay in a room category,
+        the default price when the stay has no rated night.
+        """
+        total, rated, nights = self._get_stay_rate(
+            categ_id, checkin[:10], checkout[:10], pricelist_id or False)
+        if not rated:
+            return default_price
+        return (total + (nights - rated) * default_price) / nights
+
+
 class HotelRoomAmenitiesType(models.Model):
 
     _name = 'hotel.room.amenities.type'
     _description = 'amenities Type'
+    _inherit = 'hotel.category.mixin'
+    _parent_name = 'amenity_id'
 
     name = fields.Char(required=True)
     amenity_id = fields.Many2one('hotel.room.amenities.type', 'Category')
     child_ids = fields.One2many('hotel.room.amenities.type', 'amenity_id',
                                'Child Categories')
+    complete_name = fields.Char('Complete Name',
+                                compute='_compute_complete_name',
+                                store=True, index=True)
 
-    @api.multi
-    def name_get(self):
-        def get_names(cat):
-            """ Return the list [cat.name, cat.amenity_id.name, ...] """
-            res = []
-            while cat:
-                res.append(cat.name)
-                cat = cat.amenity_id
-            return res
-        return [(cat.id, " / ".join(reversed(get_names(cat)))) for cat in self]
+    @api.depends('name', 'amenity_id.complete_name')
+    def _compute_complete_name(self):
+        return super(HotelRoomAmenitiesType, self)._compute_complete_name()
 
-    @api.model
-    def name_search(self, name, args=None, operator='ilike', limit=100):
-        if not args:
-            args = []
-        if name:
-            # Be sure name_search is symetric to name_get
-            category_names = name.split(' / ')
-            parents = list(category_names)
-            child = parents.pop()
-            domain = [('name', operator, child)]
-            if parents:
-                names_ids = self.name_search(' / '.join(parents), args=args,
-                                             operator='ilike', limit=limit)
-                category_ids = [name_id[0] for name_id in names_ids]
-                if operator in expression.NEGATIVE_TERM_OPERATORS:
-                    categories = self.search([('id', 'not in', category_ids)])
-                    domain = expression.OR([[('amenity_id', 'in',
-                                              categories.ids)], domain])
-                else:
-                    domain = expression.AND([[('amenity_id', 'in',
-                                               category_ids)], domain])
-                for i in range(1, len(category_names)):
-                    domain = [[('name', operator,
-                                ' / '.join(category_names[-1 - i:]))], domain]
-                    if operator in expression.NEGATIVE_TERM_OPERATORS:
-                        domain = expression.AND(domain)
-                    else:
-                        domain = expression.OR(domain)
-            categories = self.search(expression.AND([domain, args]),
-                                     limit=limit)
-        else:
-            categories = self.search(args, limit=limit)
-        return categories.name_get()
+    @api.constrains('amenity_id')
+    def _check_category_recursion(self):
+        return super(HotelRoomAmenitiesType, self)._check_category_recursion()
 
 
 class HotelRoomAmenities(models.Model):
@@ -203,18 +436,480 @@ class HotelRoomAmenities(models.Model):
     product_manager = fields.Many2one('res.users', string='Product Manager')
 
 
+class HotelRoomOccupancyMixin(models.AbstractModel):
+    """
+    Lines holding a room between check_in and check_out. The period is
+    kept in a stored ``occupancy`` tsrange column, filled by a trigger and
+    covered by a GiST index, so that overlap checks are one indexed query.
+    """
+
+    _name = 'hotel.room.occupancy.mixin'
+    _description = 'Room Occupancy Line'
+
+    # SQL predicate of the lines which may never overlap on the same room,
+    # enforced by an exclusion constraint when the 'hotel.occupancy_exclusion'
+    # system parameter is set. False disables the constraint for the model.
+    _occupancy_exclusion = False
+
+    @api.model_cr_context
+    def _auto_init(self):
+        res = super(HotelRoomOccupancyMixin, self)._auto_init()
+        if self._abstract:
+            return res
+        cr = self._cr
+        table = self._table
+        if not column_exists(cr, table, 'occupancy'):
+            cr.execute('ALTER TABLE "%s" ADD COLUMN occupancy tsrange' % table)
+        cr.execute("""
+            CREATE OR REPLACE FUNCTION hotel_room_occupancy_range()
+            RETURNS trigger AS $$
+            BEGIN
+                NEW.occupancy := tsrange(LEAST(NEW.check_in, NEW.check_out),
+                                         GREATEST(NEW.check_in, NEW.check_out),
+                                         '[]');
+                RETURN NEW;
+            END;
+            $$ LANGUAGE plpgsql
+        """)
+        trigger = '%s_occupancy_trigger' % table
+        cr.execute('DROP TRIGGER IF EXISTS "%s" ON "%s"' % (trigger, table))
+        cr.execute("""
+            CREATE TRIGGER "%s" BEFORE INSERT OR UPDATE OF check_in, check_out
+            ON "%s" FOR EACH ROW EXECUTE PROCEDURE hotel_room_occupancy_range()
+        """ % (trigger, table))
+        cr.execute("""
+            UPDATE "%s"
+               SET occupancy = tsrange(LEAST(check_in, check_out),
+                                       GREATEST(check_in, check_out), '[]')
+             WHERE occupancy IS NULL
+        """ % table)
+        index = '%s_occupancy_gist' % table
+        if not index_exists(cr, index):
+            cr.execute('CREATE INDEX "%s" ON "%s" USING gist (occupancy)'
+                       % (index, table))
+        self._init_occupancy_exclusion()
+        return res
+
+    @api.model
+    def create(self, vals):
+        line = super(HotelRoomOccupancyMixin, self).create(vals)
+        line._occupancy_changed(line._get_occupancy_changes())
+        return line
+
+    @api.multi
+    def write(self, vals):
+        tracked = {'room_id', 'check_in', 'check_out', 'state'}
+        if not tracked.intersection(vals):
+            return super(HotelRoomOccupancyMixin, self).write(vals)
+        changes = self._get_occupancy_changes()
+        res = super(HotelRoomOccupancyMixin, self).write(vals)
+        self._occupancy_changed(changes + self._get_occupancy_changes())
+        return res
+
+    @api.multi
+    def unlink(self):
+        changes = self._get_occupancy_changes()
+        res = super(HotelRoomOccupancyMixin, self).unlink()
+        self._occupancy_changed(changes)
+        return res
+
+    @api.model
+    def _create_occupancy_lines(self, vals_list):
+        """
+        Insert many occupancy lines with a single query, then invalidate
+        the fields depending on them and refresh their occupancy like
+        create does. The values must only hold plain stored column
+        values, the ORM create overrides and defaults are not applied.
+        ---------------------------------------------------------------
+        @param self: object pointer
+        @param vals_list: list of dictionaries with the same keys
+        @return: recordset of the new lines
+        """
+        if not vals_list:
+            return self.browse()
+        columns = sorted(vals_list[0])
+        for column in columns:
+            field = self._fields[column]
+            if not field.store or field.type in ('one2many', 'many2many'):
+                raise UserError(_('Field %s can not be inserted in bulk.')
+                                % column)
+        now = fields.Datetime.now()
+        log_values = (self._uid, now, self._uid, now)
+        rows = []
+        for vals in vals_list:
+            values = [vals.get(column) for column in columns]
+            rows.append(tuple(None if value is False else value
+                              for value in values) + log_values)
+        self.env.cr.execute("""
+            INSERT INTO "%s" (%s, create_uid, create_date, write_uid,
+                              write_date)
+            VALUES %s
+            RETURNING id
+        """ % (self._table, ', '.join('"%s"' % column for column in columns),
+               ', '.join(['%s'] * len(rows))), rows)
+        lines = self.browse([row[0] for row in self.env.cr.fetchall()])
+        # Like create: drop the cached one2many fields of the rooms and the
+        # reservations, and recompute the stored fields depending on them.
+        lines.modified(columns)
+        if self.env.recompute and self._context.get('recompute', True):
+            self.recompute()
+        lines._occupancy_changed(lines._get_occupancy_changes())
+        return lines
+
+    @api.multi
+    def _get_occupancy_changes(self):
+        """
+        Return the (room, date range) cells held by the lines.
+        """
+        changes = []
+        for line in self:
+            if line.room_id and line.check_in and line.check_out:
+                changes.append({
+                    'room_id': line.room_id.id,
+                    'date_from': min(line.check_in, line.check_out),
+                    'date_to': max(line.check_in, line.check_out),
+                })
+        return changes
+
+    @api.model
+    def _occupancy_changed(self, changes):
+        """
+        Refresh the daily occupancy of the changed cells, queue the status
+        refresh of their rooms and publish them.
+        """
+        self.env['hotel.room.occupancy.day']._sync_days(changes)
+        self.env['hotel.room.status.event']._schedule_events(changes)
+        self._notify_occupancy_changes(changes)
+
+    @api.model
+    def _notify_occupancy_changes(self, changes):
+        """
+        Publish the changed (room, date range) cells on the occupancy bus
+        channel, so that open room summaries only refresh those cells.
+        """
+        if changes:
+            self.env['bus.bus'].sendone(OCCUPANCY_CHANNEL,
+                                        {'changes': changes})
+
+    @api.model
+    def _init_occupancy_exclusion(self):
+        """
+        Add or drop the exclusion constraint forbidding two overlapping
+        lines on the same room, depending on the system parameter.
+        """
+        cr = self._cr
+        constraint = '%s_occupancy_excl' % self._table
+        cr.execute("""
+            SELECT 1 FROM pg_constraint WHERE conname = %s
+        """, (constraint,))
+        exists = bool(cr.fetchone())
+        param = self.env['ir.config_parameter'].sudo().get_param(
+            'hotel.occupancy_exclusion')
+        if not (self._occupancy_exclusion and param):
+            if exists:
+                cr.execute('ALTER TABLE "%s" DROP CONSTRAINT "%s"'
+                           % (self._table, constraint))
+            return
+        if exists:
+            return
+        try:
+            with cr.savepoint():
+                cr.execute('CREATE EXTENSION IF NOT EXISTS btree_gist')
+                cr.execute("""
+                    ALTER TABLE "%s" ADD CONSTRAINT "%s"
+                    EXCLUDE USING gist (room_id WITH =, occupancy WITH &&)
+                    WHERE (%s)
+                """ % (self._table, constraint, self._occupancy_exclusion))
+        except Exception:
+            _logger.warning('Unable to add the room occupancy exclusion '
+                            'constraint on %s', self._table, exc_info=True)
+
+
+class HotelRoomOccupancyDay(models.Model):
+    """
+    Daily room occupancy materialized from the occupancy lines: one row
+    per room and day holding the busiest state of that day, a day without
+    row is free. The days are those of the hotel, in the timezone of the
+    company of the room (UTC when it has none). The rows of the changed
+    cells are recomputed whenever an occupancy line or the state of its
+    document changes, all of them when the company settings they depend
+    on change.
+    """
+
+    _name = 'hotel.room.occupancy.day'
+    _description = 'Daily Room Occupancy'
+    _log_access = False
+    _order = 'date, room_id'
+    _rec_name = 'room_id'
+
+    room_id = fields.Many2one('hotel.room', 'Room', required=True,
+                              index=True, ondelete='cascade')
+    date = fields.Date(required=True, index=True)
+    state = fields.Selection([('draft', 'Draft'),
+                              ('reserved', 'Reserved'),
+                              ('folio', 'Folio')], required=True)
+    res_model = fields.Char('Source Model')
+    res_id = fields.Integer('Source Document')
+
+    _sql_constraints = [
+        ('room_date_uniq', 'unique(room_id, date)',
+         'The occupancy of a room is stored once per day!'),
+    ]
+
+    @api.model_cr
+    def init(self):
+        self._cr.execute('SELECT 1 FROM hotel_room_occupancy_day LIMIT 1')
+        if not self._cr.fetchone():
+            self.rebuild()
+
+    @api.model
+    def _insert_days(self, days_query, params):
+        """
+        Insert the occupancy of the (room_id, day) pairs selected by
+        days_query. A room is held on a day when one of its lines covers
+        the day at 23:59:59 local time, or when the line ends on that day
+        after covering the previous one and its remaining hours reach the
+        additional hours configured on the company of the room.
+        """
+        query = " UNION ALL ".join(
+            self.env['hotel.room']._get_occupancy_queries())
+        # Rooms of no company follow the main company, whoever syncs.
+        main_company = self.env.ref('base.main_company',
+                                    raise_if_not_found=False)
+        params = dict(params,
+                      states=OCCUPANCY_STATES,
+                      company_id=main_company and main_company.id or None)
+        self.env.cr.execute("""
+            INSERT INTO hotel_room_occupancy_day
+                   (room_id, date, state, res_model, res_id)
+            SELECT DISTINCT ON (occ.room_id, d.day)
+                   occ.room_id, d.day, occ.state, occ.res_model, occ.res_id
+              FROM (%s) AS d(room_id, day)
+              JOIN hotel_room hr ON hr.id = d.room_id
+              LEFT JOIN res_company rc
+                ON rc.id = COALESCE(hr.company_id, %%(company_id)s)
+              LEFT JOIN res_partner rp ON rp.id = rc.partner_id
+             CROSS JOIN LATERAL (
+                   SELECT ((d.day + time '23:59:59')
+                           AT TIME ZONE COALESCE(rp.tz, 'UTC'))
+                           AT TIME ZONE 'UTC' AS probe,
+                          GREATEST(COALESCE(rc.additional_hours, 0), 0)
+                              AS additional) p
+              JOIN (%s) occ
+                ON occ.room_id = d.room_id
+               AND (occ.occupancy @> p.probe
+                    OR (occ.occupancy @> (p.probe - interval '1 day')
+                        AND mod(extract(epoch FROM occ.check_out
+                                        - occ.check_in)::integer, 86400) > 0
+                        AND mod(extract(epoch FROM occ.check_out
+                                        - occ.check_in)::integer, 86400)
+                            >= p.additional * 3600))
+             ORDER BY occ.room_id, d.day,
+                      array_position(%%(states)s, occ.state::text) DESC
+            ON CONFLICT (room_id, date) DO UPDATE
+               SET state = EXCLUDED.state,
+                   res_model = EXCLUDED.res_model,
+                   res_id = EXCLUDED.res_id
+        """ % (days_query, query), params)
+
+    @api.model
+    def _sync_days(self, changes):
+        """
+        Recompute the daily occupancy of the changed cells. The cells are
+        widened by a day on both sides, as their UTC bounds may fall on
+        the next or previous local day.
+        ---------------------------------------------------
+        @param self: object pointer
+        @param changes: list of {'room_id', 'date_from', 'date_to'}
+        """
+        if not changes:
+            return
+        params = {
+            'room_ids': [change['room_id'] for change in changes],
+            'date_froms': [change['date_from'][:10] for change in changes],
+            'date_tos': [change['date_to'][:10] for change in changes],
+        }
+        cells = """
+            unnest(%(room_ids)s::integer[], %(date_froms)s::date[],
+                   %(date_tos)s::date[]) AS c(room_id, date_from, date_to)
+        """
+        self.env.cr.execute("""
+            DELETE FROM hotel_room_occupancy_day od
+             USING %s
+             WHERE od.room_id = c.room_id
+               AND od.date BETWEEN c.date_from - 1 AND c.date_to + 1
+        """ % cells, params)
+        self._insert_days("""
+            SELECT DISTINCT c.room_id,
+                   generate_series(c.date_from - 1, c.date_to + 1,
+                                   interval '1 day')::date
+              FROM %s
+        """ % cells, params)
+        self.invalidate_cache()
+
+    @api.model
+    def rebuild(self, date_from=False, date_to=False):
+        """
+        Recompute the daily occupancy from all the occupancy lines, used
+        to backfill the table. The optional bounds restrict the rebuild
+        to a range of days.
+        ------------------------------------------------------------------
+        @param self: object pointer
+        @param date_from: optional first day to rebuild
+        @param date_to: optional last day to rebuild
+        @return: True
+        """
+        date_from = date_from and date_from[:10] or '0001-01-01'
+        date_to = date_to and date_to[:10] or '9999-12-31'
+        params = {'date_from': date_from, 'date_to': date_to}
+        self.env.cr.execute("""
+            DELETE FROM hotel_room_occupancy_day
+             WHERE date BETWEEN %(date_from)s AND %(date_to)s
+        """, params)
+        query = " UNION ALL ".join(
+            self.env['hotel.room']._get_occupancy_queries())
+        self._insert_days("""
+            SELECT DISTINCT days.room_id, days.day
+              FROM (SELECT occ.room_id,
+                           generate_series(
+                               GREATEST(LEAST(occ.check_in, occ.check_out)
+                                        ::date - 1, %%(date_from)s::date),
+                               LEAST(GREATEST(occ.check_in, occ.check_out)
+                                     ::date + 1, %%(date_to)s::date),
+                               interval '1 day')::date AS day
+                      FROM (%s) occ) days
+        """ % query, params)
+        self.invalidate_cache()
+        return True
+
+    @api.model
+    def _get_room_days(self, day_from, days, room_ids):
+        """
+        Read the daily occupancy of rooms.
+        ------------------------------------------------------
+        @param self: object pointer
+        @param day_from: first day (date)
+        @param days: number of days to read
+        @param room_ids: ids of the rooms to read
+        @return: dictionary {room_id: bytearray of OCCUPANCY_STATES codes}
+        """
+        cells = {room_id: bytearray(days) for room_id in room_ids}
+        if not room_ids or days <= 0:
+            return cells
+        self.env.cr.execute("""
+            SELECT room_id, date - %s::date, state
+              FROM hotel_room_occupancy_day
+             WHERE room_id IN %s
+               AND date BETWEEN %s::date AND %s::date
+        """, (day_from, tuple(room_ids), day_from,
+              day_from + datetime.timedelta(days=days - 1)))
+        for room_id, idx, state in self.env.cr.fetchall():
+            cells[room_id][idx] = OCCUPANCY_STATES.index(state)
+        return cells
+
+
+class HotelRoomStatusEvent(models.Model):
+    """
+    Queue of the check-in and check-out times at which the status of a
+    room has to be refreshed, filled when occupancy lines change and
+    drained by a scheduler which only touches the rooms that are due.
+    """
+
+    _name = 'hotel.room.status.event'
+    _description = 'Room Status Event'
+    _log_access = False
+    _order = 'date'
+    _rec_name = 'room_id'
+
+    room_id = fields.Many2one('hotel.room', 'Room', required=True,
+                              index=True, ondelete='cascade')
+    date = fields.Datetime('Due Date', required=True, index=True)
+
+    _sql_constraints = [
+        ('room_date_uniq', 'unique(room_id, date)',
+         'A room status event is queued once per date!'),
+    ]
+
+    @api.model
+    def _schedule_events(self, changes):
+        """
+        Queue the status refresh of the changed rooms at the boundaries
+        of the changed cells, boundaries in the past are due at once.
+        ----------------------------------------------------------------
+        @param self: object pointer
+        @param changes: list of {'room_id', 'date_from', 'date_to'}
+        """
+        if not changes:
+            return
+        now = fields.Datetime.now()
+        room_ids = []
+        dates = []
+        for change in changes:
+            # A line covers its check-out time, the room is freed after.
+            date_to = fields.Datetime.to_string(
+                fields.Datetime.from_string(change['date_to']) +
+                datetime.timedelta(seconds=1))
+            for date in (change['date_from'], date_to):
+                room_ids.append(change['room_id'])
+                dates.append(max(date, now))
+        self.env.cr.execute("""
+            INSERT INTO hotel_room_status_event (room_id, date)
+            SELECT * FROM unnest(%s::integer[], %s::timestamp[])
+            ON CONFLICT DO NOTHING
+        """, (room_ids, dates))
+
+    @api.model
+    def process_due_events(self):
+        """
+        Scheduler refreshing the status of the rooms whose events are
+        due, an idle run costs a single indexed query.
+        -------------------------------------------------------------
+        @param self: object pointer
+        @return: True
+        """
+        self.env.cr.execute("""
+            DELETE FROM hotel_room_status_event
+             WHERE date <= %s
+         RETURNING room_id
+        """, (fields.Datetime.now(),))
+        room_ids = list({row[0] for row in self.env.cr.fetchall()})
+        if room_ids:
+            self.env['hotel.room']._update_room_status(
+                room_ids, check_conflict=False)
+        return True
+
+
 class FolioRoomLine(models.Model):
 
     _name = 'folio.room.line'
+    _inherit = 'hotel.room.occupancy.mixin'
     _description = 'Hotel Room Reservation'
     _rec_name = 'room_id'
 
-    room_id = fields.Many2one('hotel.room', 'Room id')
-    check_in = fields.Datetime('Check In Date', required=True)
-    check_out = fields.Datetime('Check Out Date', required=True)
+    room_id = fields.Many2one('hotel.room', 'Room id', index=True)
+    check_in = fields.Datetime('Check In Date', required=True, index=True)
+    check_out = fields.Datetime('Check Out Date', required=True, index=True)
     folio_id = fields.Many2one('hotel.folio', string='Folio Number')
     status = fields.Selection(string='state', related='folio_id.state')
 
+    @api.multi
+    def _unlink_free_rooms(self):
+        """
+        Delete the lines and make their rooms available again, unless
+        another line still holds them over the same dates.
+        """
+        freed = {}
+        for line in self.filtered('room_id'):
+            freed.setdefault((line.check_in, line.check_out),
+                             set()).add(line.room_id.id)
+        self.unlink()
+        room_obj = self.env['hotel.room']
+        free_ids = set()
+        for (check_in, check_out), room_ids in freed.items():
+            free_ids |= room_ids - set(room_obj._get_busy_room_ids(
+                check_in, check_out))
+        room_obj.browse(list(free_ids)).write({'isroom': True})
+
 #model za istoriju promene statusa
 
 
@@ -230,6 +925,30 @@ class HotelRoomStatusChangeHistory(models.Model):
 
     ime_statusa = fields.Char('Promenjeni status')
 
+    @api.model
+    def _create_history(self, rows):
+        """
+        Insert status history lines with a single query.
+        ------------------------------------------------------------
+        @param self: object pointer
+        @param rows: list of (room id, time of change, broj_sobe,
+                     ime_statusa) tuples
+        """
+        if not rows:
+            return
+        log = (self.env.uid, fields.Datetime.now())
+        self.env.cr.execute("""
+            INSERT INTO hotel_room_status_change
+                   (room_status_change_id, time_of_change, broj_sobe,
+                    ime_statusa, create_uid, create_date, write_uid,
+                    write_date)
+            VALUES %s
+        """ % ', '.join(['%s'] * len(rows)),
+            [tuple(row) + log + log for row in rows])
+        self.invalidate_cache()
+        self.env['hotel.room'].invalidate_cache(
+            ['hotel_room_status_change_id'])
+
 
 
 #TODO NAPRAVI MODEL PODATAKA ZA ZAPOSLENE,GOSTE
@@ -295,24 +1014,6 @@ class HotelRoomCard(models.Model):
 
 
 
-    def chksum(self, dsa):
-        a1 = bytearray(dsa)
-        a3 = a1[3]
-        for i in range(4, len(a1)):
-            a3 = a3 ^ a1[i]
-        a2 = bytes(a1)
-
-        a3 = int(a3) & 127
-        a4 = str(a3)
-        if len(str(a3)) == 1:
-            a4 = '0' + str(a3)
-        a4 = int(a4)
-        a4 = hex(a4)
-        a4 = str(a4)
-        a4 = a4[2:4]
-        print('a4 ====' + a4)
-        return a4
-
     def open_wizard_delete(self, ids, context=None):
         # context = {'search_default_internal_loc': 1, 'search_default_locationgroup':1}
         res_id = self
@@ -397,111 +1098,246 @@ class HotelRoomCard(models.Model):
 
     def programiranje_kartic(self):
         buffer = self.broj_kartice_usb()
-        print('nastavi')
-
-        b0 = hex(buffer[0])
-        b0 = b0[2:4]
-        b1 = hex(buffer[1])
-        b1 = b1[2:4]
-        b2 = hex(buffer[2])
-        b2 = b2[2:4]
-        b3 = hex(buffer[3])
-        b3 = b3[2:4]
-        b4 = hex(buffer[4])
-        b4 = b4[2:4]
-
-        dsa = binascii.unhexlify('DDDDDD01010165000001')
-        dsa += binascii.unhexlify(b0)
-        dsa += binascii.unhexlify(b1)
-        dsa += binascii.unhexlify(b2)
-        dsa += binascii.unhexlify(b3)
-        dsa += binascii.unhexlify(b4)
-        dsa += binascii.unhexlify('0000000000000000000000000000000000000000000000000000000000000000')
-        print('stigo1')
-        dsa += binascii.unhexlify(self.chksum(dsa))
-        print('stigo2')
-        dsa += binascii.unhexlify('BB')
-
-        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        print('stigo')
-        #na serverskoj strani salje se na .171
-
-        server_address = ('192.168.1.116', 80)
-        sent = sock.sendto(dsa, server_address)
-        print('proso')
-
-        # serverside
-        # sad = 1
-        # while sad > 0:
-        #     data, address = sock.recvfrom(512)
-        #     print('primljen paket ' + str(data))
-        #     print(address)
-        #
-        #     if (len(data) == 7):
-        #         self.provera_kartice()
-        #         sad = 0
+        self.env['hotel.room.command'].queue_command(
+            codec.CardMessage(1, 1, buffer[:5]),
+            _('Program card %s') % buffer[:5].decode('ascii', 'replace'),
+            card=self)
 
     def provera_kartice(self):
-        dsa = binascii.unhexlify('DDDDDD0102')
-        dsa += binascii.unhexlify('01')
-        dsa += binascii.unhexlify('0200')
-        dsa += binascii.unhexlify('01')
-
         #Todo dodaj broj sobe i lokaciju kartice dinamicki
-        asd = bytes(dsa)
-        dsa += binascii.unhexlify('0000000000000000000000000000000000000000000000000000000000000000000000000000')
+        self.env['hotel.room.command'].queue_command(
+            codec.CardCheck(1, 1), _('Check card'), card=self)
 
+    def brisanje_kartice(self):
+        command_obj = self.env['hotel.room.command']
+        for relation in self.hotel_room_card_relation:
+            command_obj.queue_command(
+                codec.CardDelete(relation.soba_id.id,
+                                 relation.lokacija_kartice),
+                _('Delete card %s') % self.broj_kartice,
+                room=relation.soba_id, card=self)
 
-        dsa += binascii.unhexlify(self.chksum(dsa))
-        dsa += binascii.unhexlify('BB')
-        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    def odazivanje(self):
+        self.env['hotel.gateway'].search([]).send_frame(
+            codec.PollReply.now().encode())
 
-        # na serverskoj strani salje se na .171
-        server_address = ('192.168.1.116', 80)
-        sent = sock.sendto(dsa, server_address)
 
+class HotelGateway(models.Model):
+    """
+    Controller bus reached at its own address. A room is served by its
+    own gateway, else by the gateway of its corridor, else by the first
+    gateway; its card commands then go to the first card gateway, if any.
+    """
 
-    def brisanje_kartice(self):
-        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        sock.bind(('0.0.0.0', 80))
-        while True:
-            buffer = self.broj_kartice_usb()
-            data, address = sock.recvfrom(512)
-            print('primljen paket ' + str(data))
-            print(address)
-            print('duzina' + str(len(data)))
-            if (len(data) == 7):
-                dsa = binascii.unhexlify('DDDDDD0101')
-                dsa += binascii.unhexlify(self.sobe)    #==============================================>                  Todo ovde treba da vrati samo jedan broj sobe koja je izbacena
-                dsa += binascii.unhexlify('650000')
-                dsa += binascii.unhexlify(self.lokacija_kartice)
-                asd = bytes(dsa)
-                dsa += binascii.unhexlify('FFFFFFFFFF')
-                dsa += binascii.unhexlify('0000000000000000000000000000000000000000000000000000000000000000')
-                dsa += binascii.unhexlify(self.chksum(dsa))
-                dsa += binascii.unhexlify('BB')
-                print(dsa)
-
-                # na serverskoj strani salje se na .171
-                server_address = ('192.168.1.116', 80)
-                sent = sock.sendto(dsa, server_address)
+    _name = 'hotel.gateway'
+    _description = 'Room Controller Gateway'
+    _order = 'sequence, id'
 
-    def odazivanje(self):
-        dsa = binascii.unhexlify('DDDDDD0100')
-        asd = bytes(dsa)
+    name = fields.Char(required=True)
+    sequence = fields.Integer(default=10)
+    active = fields.Boolean(default=True)
+    address = fields.Char(required=True, help='IP address of the gateway.')
+    port = fields.Integer(required=True, default=80)
+    hodnik = fields.Selection(HODNIK_SELECTION, 'Corridor',
+                              help='Corridor whose rooms are served by this '
+                              'gateway, unless they have their own.')
+    card_commands = fields.Boolean('Card Commands',
+                                   help='Send the card commands of the rooms '
+                                   'which have neither their own gateway nor '
+                                   'a corridor gateway to this gateway.')
+    room_ids = fields.One2many('hotel.room', 'gateway_id', 'Rooms')
+
+    # The gateway process tells the gateways apart by the host their
+    # datagrams come from, whatever their source port.
+    _sql_constraints = [
+        ('address_uniq', 'unique(address)',
+         'A gateway with this address already exists!'),
+    ]
 
-        time_now = datetime.datetime.now()
-        timee = time_now.timetuple()
-        dsa += bytes([timee.tm_mday]) + bytes([timee.tm_mon]) + bytes([18]) + bytes([timee.tm_hour]) + bytes(
-            [timee.tm_min]) + bytes([20])
+    @api.model
+    def create(self, vals):
+        self._get_routes.clear_cache(self)
+        return super(HotelGateway, self).create(vals)
+
+    @api.multi
+    def write(self, vals):
+        self._get_routes.clear_cache(self)
+        return super(HotelGateway, self).write(vals)
 
-        dsa += binascii.unhexlify('000000000000000000000000000000000000000000000000000000000000000000000000')
-        dsa += binascii.unhexlify(self.chksum(dsa))
-        dsa += binascii.unhexlify('BB')
+    @api.multi
+    def unlink(self):
+        self._get_routes.clear_cache(self)
+        return super(HotelGateway, self).unlink()
+
+    @api.model
+    @tools.ormcache()
+    def _get_routes(self):
+        """
+        Return the gateways as {'gateways': [(gateway id, (address,
+        port))], 'rooms': {room id: gateway id}, 'commands': {room id:
+        gateway id}, 'default': gateway id, 'cards': gateway id}. 'rooms'
+        gives the gateway reporting the status of a room, 'commands' the
+        one its card commands are sent to. The routes are cached for the
+        whole registry and cleared when a gateway changes or a room
+        changes gateway or corridor.
+        """
+        self._cr.execute("""
+            SELECT id, address, port, hodnik, card_commands
+              FROM hotel_gateway
+             WHERE active
+             ORDER BY sequence, id
+        """)
+        rows = self._cr.fetchall()
+        by_hodnik = {}
+        for gateway_id, _address, _port, hodnik, _cards in rows:
+            if hodnik:
+                by_hodnik.setdefault(hodnik, gateway_id)
+        default = rows and rows[0][0] or False
+        cards = next((row[0] for row in rows if row[4]), default)
+        active_ids = {row[0] for row in rows}
+        self._cr.execute("SELECT id, gateway_id, hodnik FROM hotel_room")
+        rooms = {}
+        commands = {}
+        for room_id, gateway_id, hodnik in self._cr.fetchall():
+            if gateway_id not in active_ids:
+                gateway_id = by_hodnik.get(hodnik)
+            rooms[room_id] = gateway_id or default
+            commands[room_id] = gateway_id or cards
+        return {'gateways': [(row[0], (row[1], row[2])) for row in rows],
+                'rooms': rooms,
+                'commands': commands,
+                'default': default,
+                'cards': cards}
 
+    @api.model
+    def _get_gateway_links(self):
+        """Return the gateways served by the hotelgateway command."""
+        return self._get_routes()['gateways']
+
+    @api.multi
+    def send_frame(self, frame):
+        """
+        Send a frame to the gateways, without waiting for any answer;
+        UDP sends do not block, so the gateways are reached at once.
+        """
         sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        server_address = ('192.168.1.171', 80)
-        sent = sock.sendto(dsa, server_address)
+        try:
+            for gateway in self:
+                sock.sendto(frame, (gateway.address, gateway.port))
+        finally:
+            sock.close()
+
+
+class HotelRoomCommand(models.Model):
+    """
+    Card command waiting to be relayed to the room controllers. The UI
+    only queues the command; the hotelgateway command sends it, waits for
+    its acknowledgement and reports the outcome on the bus.
+    """
+
+    _name = 'hotel.room.command'
+    _description = 'Room Controller Command'
+    _order = 'id desc'
+
+    name = fields.Char('Command', required=True)
+    room_id = fields.Many2one('hotel.room', 'Room', index=True,
+                              ondelete='cascade')
+    card_id = fields.Many2one('hotel.room.card', 'Card', ondelete='set null')
+    gateway_id = fields.Many2one('hotel.gateway', 'Gateway', index=True,
+                                 ondelete='set null')
+    frame = fields.Char('Frame', required=True, readonly=True,
+                        help='Hexadecimal frame relayed to the controller.')
+    state = fields.Selection([('queued', 'Queued'), ('sent', 'Sent'),
+                              ('done', 'Done'), ('failed', 'Failed')],
+                             default='queued', required=True, index=True)
+    message = fields.Char('Message', readonly=True)
+    date_done = fields.Datetime('Done On', readonly=True)
+    user_id = fields.Many2one('res.users', 'Requested By',
+                              default=lambda self: self.env.user)
+
+    @api.model
+    def queue_command(self, message, name, room=False, card=False):
+        """
+        Queue a controller message and return at once.
+        ------------------------------------------------------------
+        @param self: object pointer
+        @param message: codec message to send
+        @param name: label of the command
+        @param room: hotel.room addressed by the command
+        @param card: hotel.room.card concerned by the command
+        @return: the queued hotel.room.command
+        """
+        try:
+            frame = message.encode()
+        except codec.CodecError as error:
+            raise UserError(str(error))
+        routes = self.env['hotel.gateway']._get_routes()
+        return self.create({'name': name,
+                            'room_id': room and room.id,
+                            'card_id': card and card.id,
+                            'gateway_id': routes['commands'].get(
+                                room and room.id, routes['cards']),
+                            'frame': frame.hex()})
+
+    @api.model
+    def _take_queued(self, limit):
+        """
+        Mark at most limit queued commands as sent and return them as
+        (command id, frame, gateway id) tuples, oldest first. Locked rows
+        are skipped so that two gateways never take the same command.
+        """
+        self.env.cr.execute("""
+            UPDATE hotel_room_command
+               SET state = 'sent', write_uid = %s,
+                   write_date = now() at time zone 'UTC'
+             WHERE id IN (SELECT id FROM hotel_room_command
+                           WHERE state = 'queued'
+                           ORDER BY id
+                           LIMIT %s
+                             FOR UPDATE SKIP LOCKED)
+         RETURNING id, frame, gateway_id
+        """, (self.env.uid, limit))
+        rows = sorted(self.env.cr.fetchall())
+        self.invalidate_cache(['state'], [row[0] for row in rows])
+        return [(command_id, bytes.fromhex(frame), gateway_id)
+                for command_id, frame, gateway_id in rows]
+
+    @api.model
+    def _requeue_sent(self):
+        """Queue again the commands left in flight by a stopped gateway.
+        """
+        self.search([('state', '=', 'sent')]).write({'state': 'queued'})
+
+    @api.model
+    def _apply_results(self, results):
+        """
+        Store the outcome of commands reported by the gateway and notify
+        the users who queued them.
+        ------------------------------------------------------------
+        @param self: object pointer
+        @param results: list of (command id, state, message) tuples
+        """
+        groups = {}
+        for command_id, state, message in results:
+            groups.setdefault((state, message or False), []).append(
+                command_id)
+        now = fields.Datetime.now()
+        for (state, message), command_ids in groups.items():
+            self.browse(command_ids).write({'state': state,
+                                            'message': message,
+                                            'date_done': now})
+        commands = self.browse([result[0] for result in results]).exists()
+        notifications = [
+            [(self._cr.dbname, 'res.partner', command.user_id.partner_id.id),
+             {'type': 'hotel_room_command', 'id': command.id,
+              'name': command.name, 'room': command.room_id.name,
+              'state': command.state, 'message': command.message}]
+            for command in commands if command.user_id]
+        if notifications:
+            self.env['bus.bus'].sendmany(notifications)
+        self.env['bus.bus'].sendone('auto_refresh', self._name)
+
+
 class HotelRoomPrikaz(models.Model):
     _name = 'hotel.room.prikaz'
     name = fields.Char()
@@ -572,14 +1408,20 @@ class HotelRoom(models.Model):
     sos_status = fields.Boolean('Sos status', default = False)
     poziv_osoblju = fields.Boolean('Poziv osoblju', default=False )
     gost_status = fields.Boolean('Gost', default=False)
-    broj_sobe = fields.Integer('Broj Sobe')
+    broj_sobe = fields.Integer('Broj Sobe', index=True)
+    company_id = fields.Many2one(related='product_id.company_id', store=True,
+                                 index=True)
     kartice = fields.Many2many('hotel.room.card', 'hotel_room_card_relation', 'soba_id', 'kartica_id', store=True)
 
     datum_od = fields.Datetime('Vazi od')
     datum_do = fields.Datetime('Vazi do')
     mapa_soba = fields.Many2one('hotel.room.prikaz','hotel_room')
 
-    hodnik = fields.Selection([('a', 'A'), ('b', 'B'), ('c', 'C'), ('d', 'D')])
+    hodnik = fields.Selection(HODNIK_SELECTION)
+    gateway_id = fields.Many2one('hotel.gateway', 'Gateway', index=True,
+                                 help='Gateway of the room controller. '
+                                 'When empty, the gateway serving the '
+                                 'corridor of the room is used.')
 
     last_status_change = fields.Datetime(default=False,compute="last_status_change_compute", store=True)
 
@@ -615,7 +1457,7 @@ class HotelRoom(models.Model):
         sobe = self.env['hotel.room'].search([])
         res_id = self.id
         prikaz = self.env['hotel.room.prikaz'].search([('id', '=', 1)])
-        sobica = self.env['hotel.room'].search([('broj_sobe', '=', 11)])
+        sobica = self.browse(self.id_by_broj_sobe(11))
         prikaz.sos_status1 = sobica.sos_status
         for rec in sobe:
             lista.append(rec)
@@ -674,9 +1516,63 @@ class HotelRoom(models.Model):
             'context': context,
         }
 
+    @api.model_cr
+    def init(self):
+        """
+        Room numbers are unique per company. The index is partial since
+        rooms without a number store 0, and it is skipped with a warning
+        while the database still holds duplicated numbers.
+        """
+        if index_exists(self._cr, 'hotel_room_broj_sobe_company_uniq'):
+            return
+        self._cr.execute("""
+            SELECT broj_sobe FROM hotel_room
+             WHERE broj_sobe != 0
+             GROUP BY COALESCE(company_id, 0), broj_sobe
+            HAVING count(*) > 1
+        """)
+        duplicates = [row[0] for row in self._cr.fetchall()]
+        if duplicates:
+            _logger.warning('Duplicated room numbers %s, the unique index '
+                            'on hotel_room.broj_sobe is not created.',
+                            duplicates)
+            return
+        self._cr.execute("""
+            CREATE UNIQUE INDEX hotel_room_broj_sobe_company_uniq
+                ON hotel_room (COALESCE(company_id, 0), broj_sobe)
+             WHERE broj_sobe != 0
+        """)
+
+    @api.constrains('broj_sobe', 'company_id')
+    def check_broj_sobe(self):
+        for room in self.filtered('broj_sobe'):
+            if self.search_count([('id', '!=', room.id),
+                                  ('broj_sobe', '=', room.broj_sobe),
+                                  ('company_id', '=', room.company_id.id)]):
+                raise ValidationError(_('Room number %s is already used.')
+                                      % room.broj_sobe)
+
+    @api.model
+    @tools.ormcache('company_id')
+    def _get_room_number_map(self, company_id):
+        """
+        Return the mapping {broj_sobe: room_id} of the rooms of a company
+        and of the rooms without company. The mapping is cached for the
+        whole registry and cleared when a room is created, deleted or
+        renumbered.
+        """
+        self._cr.execute("""
+            SELECT broj_sobe, id FROM hotel_room
+             WHERE broj_sobe != 0
+               AND (company_id = %s OR company_id IS NULL)
+             ORDER BY company_id NULLS FIRST
+        """, (company_id or 0,))
+        return dict(self._cr.fetchall())
+
+    @api.model
     def id_by_broj_sobe(self, broj_sobee):
-        asd = self.env['hotel.room'].search([("broj_sobe",'=',broj_sobee)])
-        return asd.id
+        number_map = self._get_room_number_map(self.env.user.company_id.id)
+        return number_map.get(broj_sobee, False)
 
     def do_not_disturb_change(self, on_off):
             self.env['hotel.room.status.change'].create({
@@ -710,6 +1606,63 @@ class HotelRoom(models.Model):
                 'ime_statusa': 'Gost u sobi' + on_off
             })
 
+    # Room flags reported by the controllers: field, status bit, label
+    # of the status history and its suffixes when switched on and off.
+    _gateway_status_flags = [
+        ('sos_status', protocol.STATUS_SOS, 'Sos ',
+         ('Ukljucen', 'Iskljucen')),
+        ('poziv_osoblju', protocol.STATUS_STAFF_CALL, 'Poziv osoblju ',
+         ('Ukljucen', 'Iskljucen')),
+        ('do_not_disturb', protocol.STATUS_DO_NOT_DISTURB, 'do_not_disturb ',
+         ('Ukljucen', 'Iskljucen')),
+        ('gost_status', protocol.STATUS_GUEST, 'Gost u sobi',
+         ('gost je uso u sobu', 'gost je izaso iz sobe')),
+    ]
+
+    @api.model
+    def _apply_gateway_status(self, states, gateway_id=None):
+        """
+        Write the room flags reported by the controllers. Called by the
+        hotelgateway command with the rooms whose flags changed since its
+        previous flush: the rooms sharing the same new flags are written
+        together and the status history is inserted in one batch.
+        ------------------------------------------------------------
+        @param self: object pointer
+        @param states: dictionary {broj_sobe: status byte}
+        @param gateway_id: id of the reporting gateway, whose frames only
+                           tell the state of the rooms it serves
+        @return: True when a room changed
+        """
+        number_map = self._get_room_number_map(self.env.user.company_id.id)
+        room_ids = [number_map[number] for number in states
+                    if number in number_map]
+        if gateway_id:
+            routes = self.env['hotel.gateway']._get_routes()['rooms']
+            room_ids = [room_id for room_id in room_ids
+                        if routes.get(room_id) == gateway_id]
+        rooms = self.browse(room_ids)
+        now = fields.Datetime.now()
+        writes = {}
+        history = []
+        for room in rooms:
+            status = states[room.broj_sobe]
+            vals = {}
+            for field, bit, label, suffixes in self._gateway_status_flags:
+                value = bool(status & bit)
+                if room[field] != value:
+                    vals[field] = value
+                    history.append((room.id, now, room.broj_sobe,
+                                    label + suffixes[not value]))
+            if vals:
+                key = tuple(sorted(vals.items()))
+                writes[key] = writes.get(key, self.browse()) | room
+        for key, changed_rooms in writes.items():
+            changed_rooms.write(dict(key))
+        if history:
+            self.env['hotel.room.status.change']._create_history(history)
+            self.env['bus.bus'].sendone('auto_refresh', self._name)
+        return bool(history)
+
     @api.one
     def add_many2many_relation(self):
         if self.datum_do == False:
@@ -839,235 +1792,50 @@ class HotelRoom(models.Model):
 
     @api.multi
     def status_soba(self):
+        """
+        The controllers used to be served from here, blocking a worker
+        and a cursor forever. They are now served by the hotelgateway
+        command, see hotel/cli/gateway.py.
+        """
+        raise UserError(_('The room controllers are served by the '
+                          'hotelgateway command, run it next to the '
+                          'server instead.'))
 
-        i = 0
-        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        sock.bind(('0.0.0.0', 80))
-        paket_za_slanje = self.paket_za_odazivanje()
-        while True:
-            data, address = sock.recvfrom(512)
-
-
-            rooms = self.env['hotel.room'].search([])
-            print(data)
-            if len(data) == 7:
-
-                #odazivanje
-                if len(paket_za_slanje1) == 49:
-                    server_address = ('192.168.1.171', 80)
-                    sent = sock.sendto(paket_za_slanje1, server_address)
-                    paket_za_slanje1 = 0
-                else:
-                    server_address = ('192.168.1.171', 80)
-                    sent = sock.sendto(paket_za_slanje, server_address)
-
-
-            #proverava da li mu je stigo paket sa naredbom od pc-ja
-            if len(data)==49:
-                if(data[4] == 1):
-                    paket_za_slanje1 = data
-
-
-                elif(data[4] == 2):
-
-                    paket_za_slanje1 = data
-            # Todo dodaj proveru kad primi bytearray za proveru kartice
-            #if len(data)== 12
-
-            if data[3] == 241:
-                data[2:]
-                for room in rooms:
-                    a = room.broj_sobe
-                    self.bin = bin(data[a * 4])
-                    databits = self.bin
-                    s = databits[2:].zfill(8)
-                    print(s)
-                    if s[0] == '1':
-                        if room.sos_status =='false':
-                            room.sos_status_change
-
-                            room.sos_status = 'true'
-
-                    else:
-                        if room.sos_status == 'true':
-                            room.sos_status_change
-                            room.sos_status = 'false'
-
-                    if s[1] == '1':
-                        if room.poziv_osoblju == 'false':
-                            room.poziv_osoblju_change('Ukljucen')
-                            room.poziv_osoblju = 'true'
-                    else:
-                        if room.poziv_osoblju == 'true':
-                            room.poziv_osoblju_change('Iskljucen')
-                            room.poziv_osoblju = 'false'
-                    if s[2] == '1':
-                        if room.do_not_disturb is  False:
-                            room.do_not_disturb_change('Ukljucen')
-                            room.do_not_disturb = True
-                            time.sleep(20)
-
-                    else:
-                        if room.do_not_disturb:
-                            room.do_not_disturb_change('Iskljucen')
-                            room.write({'do_not_disturb':False})
-                            time.sleep(20)
-                    if s[7] == '1':
-                        if room.gost_status == 'false':
-                            room.gost_status_change('gost je uso u sobu')
-                            room.gost_status = 'true'
-                    else:
-                        if room.gost_status == 'true':
-                            room.gost_status_change('gost je izaso iz sobe')
-                            room.gost_status = 'false'
-
-            i += 1
-
-    def chksum(self, dsa):
-        a1 = bytearray(dsa)
-        a3 = a1[3]
-        for i in range(4, len(a1)):
-            a3 = a3 ^ a1[i]
-        a2 = bytes(a1)
-
-        a3 = int(a3) & 127
-        a4 = str(a3)
-        if len(str(a3)) == 1:
-            a4 = '0' + str(a3)
-        a4 = int(a4)
-        a4 = hex(a4)
-        a4 = str(a4)
-        a4 = a4[2:4]
-        if len(str(a4))== 1:
-            a4 = '0' + str(a4)
-        return a4
-
-    def programiranje_kartice(self,id_kartice,id_sobe, lokacija_kartice):
-        print('stigo')
-        #buffer = self.broj_kartice_usb()
-        buffer = self.env['hotel.room.card'].browse(id_kartice)
-        buffer = buffer.broj_kartice
-        buffer = str(buffer)
-        print('nastavi')
-
-        b0 = str(30 + int(buffer[0]))
-        b1 = str(30 + int(buffer[1]))
-        b2 = str(30 + int(buffer[2]))
-        b3 = str(30 + int(buffer[3]))
-        b4 = str(30 + int(buffer[4]))
-
-        lokacija_kartice = str(lokacija_kartice)
-        lokacija_kartice = int(lokacija_kartice)
-        lokacija_kartice = hex(lokacija_kartice)
-        lokacija_kartice = str(lokacija_kartice)
-        lokacija_kartice = lokacija_kartice[2:4]
-        #
-        id_sobe = str(id_sobe)
-
-        if (len(id_sobe)) == 1:
-            id_sobe = '0' + id_sobe
-
-        if(len(lokacija_kartice))==1:
-            lokacija_kartice = '0' + lokacija_kartice
-
-        dsa = binascii.unhexlify('DDDDDD0101')
-        print(str(id_sobe))
-
-        dsa += binascii.unhexlify(id_sobe)
-        dsa += binascii.unhexlify('650000')
-        print(lokacija_kartice)
-        #dsa += binascii.unhexlify(id_kartice)
-        dsa += binascii.unhexlify('0a')
-        dsa += binascii.unhexlify(b0)
-        dsa += binascii.unhexlify(b1)
-        dsa += binascii.unhexlify(b2)
-        dsa += binascii.unhexlify(b3)
-        dsa += binascii.unhexlify(b4)
-        dsa += binascii.unhexlify('0000000000000000000000000000000000000000000000000000000000000000')
-        dsa += binascii.unhexlify(self.chksum(dsa))
-        print('stigo2')
-        dsa += binascii.unhexlify('BB')
-
-        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        print('stigo')
-        print(dsa)
-        print(len(dsa))
-        #na serverskoj strani salje se na .171
-
-        server_address = ('192.168.1.116', 80)
-        sent = sock.sendto(dsa, server_address)
-        print('proso')
-        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-
-        sock.bind(('0.0.0.0', 80))
-        data, address = sock.recvfrom(512)
-        if data[0] == 1:
-            print('proso uspesno')
-        else:
-            print('neuspesno')
-        sock.close()
-
-    def brisanje_kartice(self,id_kartice,id_sobe):
-        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        id_kartice = str(id_kartice)
-        id_kartice = int(id_kartice)
-        id_kartice = hex(id_kartice)
-        id_kartice = str(id_kartice)
-        id_kartice = id_kartice[2:4]
-        id_sobe = str(id_sobe)
-
-
-
-        if (len(id_sobe)) == 1:
-            id_sobe = '0' + id_sobe
-
-        if (len(id_kartice)) == 1:
-            id_kartice = '0' + id_kartice
-        dsa = binascii.unhexlify('DDDDDD0101')
-        dsa += binascii.unhexlify(id_sobe)    #==============================================>                  Todo ovde treba da vrati samo jedan broj sobe koja je izbacena
-        dsa += binascii.unhexlify('650000')
-        dsa += binascii.unhexlify(id_kartice)
-        #dsa += binascii.unhexlify('01')
-        asd = bytes(dsa)
-        dsa += binascii.unhexlify('ff')
-        dsa += binascii.unhexlify('ff')
-        dsa += binascii.unhexlify('ff')
-        dsa += binascii.unhexlify('ff')
-        dsa += binascii.unhexlify('ff')
-
-        dsa += binascii.unhexlify('0000000000000000000000000000000000000000000000000000000000000000')
-        dsa += binascii.unhexlify(self.chksum(dsa))
-        dsa += binascii.unhexlify('BB')
-        print(dsa)
-
-        # na serverskoj strani salje se na .171
-        server_address = ('192.168.1.116', 80)
-        sent = sock.sendto(dsa, server_address)
-        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-
-        sock.bind(('0.0.0.0', 80))
-        data, address = sock.recvfrom(512)
-        if data[0] == 1:
-            print('proso uspesno')
-        else:
-            print('neuspesno')
-        sock.close()
-
-
+    def programiranje_kartice(self, id_kartice, id_sobe, lokacija_kartice):
+        """
+        Queue the programming of a card in a slot of the lock of a room;
+        the outcome is notified on the bus once the controller answers.
+        ------------------------------------------------------------
+        @param self: object pointer
+        @param id_kartice: hotel.room.card id
+        @param id_sobe: hotel.room id
+        @param lokacija_kartice: slot computed for the card, not sent:
+                                 the cards are programmed in the
+                                 PROGRAMMING_SLOT as they always were
+        @return: the queued hotel.room.command
+        """
+        card = self.env['hotel.room.card'].browse(id_kartice)
+        try:
+            message = codec.CardMessage(int(id_sobe), PROGRAMMING_SLOT,
+                                        codec.card_number(card.broj_kartice))
+        except codec.CodecError as error:
+            raise UserError(str(error))
+        return self.env['hotel.room.command'].queue_command(
+            message, _('Program card %s') % card.broj_kartice,
+            room=self.browse(int(id_sobe)), card=card)
+
+    def brisanje_kartice(self, id_kartice, id_sobe):
+        """
+        Queue the removal of the card programmed in a slot of the lock
+        of a room, id_kartice being the slot.
+        """
+        return self.env['hotel.room.command'].queue_command(
+            codec.CardDelete(int(id_sobe), int(id_kartice)),
+            _('Delete card in slot %s') % id_kartice,
+            room=self.browse(int(id_sobe)))
 
     def paket_za_odazivanje(self):
-        dsa = binascii.unhexlify('DDDDDD0100')
-        asd = bytes(dsa)
-
-        time_now = datetime.datetime.now()
-        timee = time_now.timetuple()
-        dsa += bytes([timee.tm_mday]) + bytes([timee.tm_mon]) + bytes([18]) + bytes([timee.tm_hour]) + bytes(
-            [timee.tm_min]) + bytes([20])
-
-        dsa += binascii.unhexlify('000000000000000000000000000000000000000000000000000000000000000000000000')
-        dsa += binascii.unhexlify(self.chksum(dsa))
-        dsa += binascii.unhexlify('BB')
-        return dsa
+        return codec.PollReply.now().encode()
 
 
     @api.one
@@ -1087,6 +1855,201 @@ class HotelRoom(models.Model):
 
 
 
+    @api.model
+    def _get_occupancy_queries(self):
+        """
+        Return the SQL queries selecting the lines which hold a room.
+        Every query must select the room_id, check_in, check_out,
+        occupancy, state (one of OCCUPANCY_STATES), res_model and res_id
+        (source document) columns of lines that are not cancelled, other
+        modules extend the list with their own occupancy lines.
+        """
+        return ["""
+            SELECT fl.room_id, fl.check_in, fl.check_out, fl.occupancy,
+                   CASE WHEN so.state = 'draft' THEN 'draft'
+                        ELSE 'folio' END AS state,
+                   'hotel.folio'::varchar AS res_model,
+                   fl.folio_id AS res_id
+              FROM folio_room_line fl
+              LEFT JOIN hotel_folio hf ON hf.id = fl.folio_id
+              LEFT JOIN sale_order so ON so.id = hf.order_id
+             WHERE fl.room_id IS NOT NULL
+               AND COALESCE(so.state, '') != 'cancel'
+        """]
+
+    @api.model
+    @tools.ormcache()
+    def _get_room_product_map(self):
+        """
+        Return the mapping {product_id: room_id} of all the rooms. The
+        mapping is cached for the whole registry and cleared when a room
+        is created, deleted or given another product.
+        """
+        self._cr.execute("SELECT product_id, id FROM hotel_room")
+        return dict(self._cr.fetchall())
+
+    @api.model
+    def _get_room_ids_by_product(self, product_ids):
+        """
+        Map product ids to the ids of the rooms delegating to them.
+        --------------------------------------------------------------
+        @param self: object pointer
+        @param product_ids: list of product ids
+        @return: dictionary {product_id: room_id}
+        """
+        room_map = self._get_room_product_map()
+        return {product_id: room_map[product_id]
+                for product_id in product_ids if product_id in room_map}
+
+    @api.model
+    def _clear_room_product_cache(self):
+        self._get_room_product_map.clear_cache(self)
+
+    @api.model
+    def _get_busy_room_ids(self, date_from, date_to):
+        """
+        Return the ids of the rooms with at least one occupancy line
+        overlapping the [date_from, date_to] window.
+        """
+        if date_from > date_to:
+            date_from, date_to = date_to, date_from
+        query = " UNION ALL ".join(self._get_occupancy_queries())
+        self.env.cr.execute("""
+            SELECT DISTINCT occ.room_id
+              FROM (%s) occ
+             WHERE occ.occupancy && tsrange(%%s, %%s, '[]')
+        """ % query, (date_from, date_to))
+        return [row[0] for row in self.env.cr.fetchall()]
+
+    @api.model
+    def get_available_rooms(self, date_from, date_to, categ_id=False):
+        """
+        Return the rooms which are free for the whole date window.
+        ----------------------------------------------------------
+        @param self: object pointer
+        @param date_from: start of the window (server datetime string)
+        @param date_to: end of the window (server datetime string)
+        @param categ_id: optional room category id to restrict the result
+        @return: recordset of available hotel rooms
+        """
+        domain = []
+        if categ_id:
+            domain.append(('categ_id', '=', categ_id))
+        if date_from and date_to:
+            busy_ids = self._get_busy_room_ids(date_from, date_to)
+            if busy_ids:
+                domain.append(('id', 'not in', busy_ids))
+        return self.search(domain)
+
+    @api.model
+    def _update_room_status(self, room_ids=None, check_conflict=True):
+        """
+        Set the status of the rooms from the occupancy lines covering the
+        current time. The status of all the rooms is derived with one
+        query and only the rooms whose status changes are written.
+        ----------------------------------------------------------------
+        @param self: object pointer
+        @param room_ids: optional ids of the rooms to refresh
+        @param check_conflict: raise when a room is held by lines of
+                               several kinds of documents, log otherwise
+        @return: True
+        """
+        query = " UNION ALL ".join(self._get_occupancy_queries())
+        where = 'pp.active'
+        params = [fields.Datetime.now()]
+        if room_ids is not None:
+            if not room_ids:
+                return True
+            where += ' AND r.id IN %s'
+            params.append(tuple(room_ids))
+        # Only the rooms whose status has to change are returned.
+        self.env.cr.execute("""
+            SELECT room.id, room.busy, room.sources
+              FROM (SELECT r.id, r.status, pp.isroom, pt.color,
+                           bool_or(occ.room_id IS NOT NULL) AS busy,
+                           count(DISTINCT occ.res_model) AS sources
+                      FROM hotel_room r
+                      JOIN product_product pp ON pp.id = r.product_id
+                      JOIN product_template pt ON pt.id = pp.product_tmpl_id
+                      LEFT JOIN (%s) occ
+                        ON occ.room_id = r.id
+                       AND occ.occupancy @> %%s::timestamp
+                     WHERE %s
+                     GROUP BY r.id, r.status, pp.isroom, pt.color) room
+             WHERE room.sources > 1
+                OR (room.busy
+                    AND (room.isroom IS NOT False
+                         OR room.color IS DISTINCT FROM 2
+                         OR room.status IS DISTINCT FROM 'occupied'))
+                OR (NOT room.busy
+                    AND (room.isroom IS NOT True
+                         OR room.color IS DISTINCT FROM 5
+                         OR room.status IS DISTINCT FROM 'available'))
+        """ % (query, where), params)
+        occupied_ids = []
+        available_ids = []
+        for room_id, busy, sources in self.env.cr.fetchall():
+            if sources > 1:
+                room = self.browse(room_id)
+                if check_conflict:
+                    raise ValidationError(_('Please Check Rooms Status \
+                                             for %s.' % (room.name)))
+                _logger.warning('Room %s is held by several documents',
+                                room.name)
+            if busy:
+                occupied_ids.append(room_id)
+            else:
+                available_ids.append(room_id)
+        if occupied_ids:
+            self.browse(occupied_ids).write({'isroom': False, 'color': 2})
+        if available_ids:
+            self.browse(available_ids).write({'isroom': True, 'color': 5})
+        return True
+
+    @api.model
+    def availability_matrix(self, date_from, date_to, categ_ids=None,
+                            warehouse_id=None):
+        """
+        Return the room x day occupancy grid of a date range, read from
+        the daily occupancy table whatever the number of rooms.
+        Every room row is a string holding one digit per day, the digit
+        being the index of the day state in OCCUPANCY_STATES.
+        ------------------------------------------------------------------
+        @param self: object pointer
+        @param date_from: first day of the range (date or datetime string)
+        @param date_to: last day of the range (date or datetime string)
+        @param categ_ids: optional list of room category ids
+        @param warehouse_id: optional hotel, restricts to its company rooms
+        @return: dictionary with the dates, state names and room rows
+        """
+        day_from = fields.Date.from_string(date_from[:10])
+        day_to = fields.Date.from_string(date_to[:10])
+        if day_from > day_to:
+            raise UserError(_('Date From can\'t be greater than Date To!'))
+        days = (day_to - day_from).days + 1
+        domain = []
+        if categ_ids:
+            domain.append(('categ_id', 'in', categ_ids))
+        if warehouse_id:
+            company = self.env['stock.warehouse'].browse(
+                warehouse_id).company_id
+            domain.append(('company_id', 'in', [company.id, False]))
+        rooms = self.search(domain)
+        cells = self.env['hotel.room.occupancy.day']._get_room_days(
+            day_from, days, rooms.ids)
+        return {
+            'dates': [fields.Date.to_string(day_from +
+                                            datetime.timedelta(days=i))
+                      for i in range(days)],
+            'states': OCCUPANCY_STATES,
+            'rooms': [{'id': room.id,
+                       'name': room.name or '',
+                       'categ_id': room.categ_id.id,
+                       'row': ''.join(str(code) for code in
+                                      cells[room.id])}
+                      for room in rooms],
+        }
+
     @api.constrains('capacity')
     def check_capacity(self):
         for room in self:
@@ -1118,8 +2081,46 @@ class HotelRoom(models.Model):
         if 'isroom'in vals and vals['isroom'] is True:
             vals.update({'color': 5, 'status': 'available'})
         ret_val = super(HotelRoom, self).write(vals)
+        if 'product_id' in vals:
+            self._clear_room_product_cache()
+        if {'broj_sobe', 'company_id', 'product_id'}.intersection(vals):
+            self._get_room_number_map.clear_cache(self)
+        if {'gateway_id', 'hodnik'}.intersection(vals):
+            self._clear_routes()
         return ret_val
 
+    @api.model
+    def create(self, vals):
+        room = super(HotelRoom, self).create(vals)
+        self._clear_room_product_cache()
+        self._get_room_number_map.clear_cache(self)
+        self._clear_routes()
+        return room
+
+    @api.multi
+    def unlink(self):
+        res = super(HotelRoom, self).unlink()
+        self._clear_room_product_cache()
+        self._get_room_number_map.clear_cache(self)
+        self._clear_routes()
+        return res
+
+    @api.multi
+    def _get_hotel_tz(self):
+        """
+        Return the timezone the daily occupancy of the first room is kept
+        in: the one of its company, else of the main company, else UTC.
+        """
+        company = (self[:1].company_id or
+                   self.env.ref('base.main_company',
+                                raise_if_not_found=False))
+        return company and company.sudo().partner_id.tz or 'UTC'
+
+    @api.model
+    def _clear_routes(self):
+        gateway_obj = self.env['hotel.gateway']
+        gateway_obj._get_routes.clear_cache(gateway_obj)
+
     @api.multi
     def set_room_status_occupied(self):
         """
@@ -1326,13 +2327,14 @@ class HotelFolio(models.Model):
             folio_id = super(HotelFolio, self).create(vals)
             folio_room_line_obj = self.env['folio.room.line']
             h_room_obj = self.env['hotel.room']
+            room_ids = h_room_obj._get_room_ids_by_product(
+                folio_id.mapped('room_lines.product_id').ids)
             try:
                 for rec in folio_id:
                     if not rec.reservation_id:
                         for room_rec in rec.room_lines:
-                            prod = room_rec.product_id.name
-                            room_obj = h_room_obj.search([('name', '=',
-                                                           prod)])
+                            room_obj = h_room_obj.browse(
+                                room_ids.get(room_rec.product_id.id))
                             room_obj.write({'isroom': False})
                             vals = {'room_id': room_obj.id,
                                     'check_in': rec.checkin_date,
@@ -1343,8 +2345,8 @@ class HotelFolio(models.Model):
             except:
                 for rec in folio_id:
                     for room_rec in rec.room_lines:
-                        prod = room_rec.product_id.name
-                        room_obj = h_room_obj.search([('name', '=', prod)])
+                        room_obj = h_room_obj.browse(
+                            room_ids.get(room_rec.product_id.id))
                         room_obj.write({'isroom': False})
                         vals = {'room_id': room_obj.id,
                                 'check_in': rec.checkin_date,
@@ -1361,46 +2363,110 @@ class HotelFolio(models.Model):
         @param self: The object pointer
         @param vals: dictionary of fields value.
         """
-        product_obj = self.env['product.product']
+        if vals and vals.get('duration_dummy', False):
+            vals['duration'] = vals.get('duration_dummy', 0.0)
+        res = super(HotelFolio, self).write(vals)
+        if {'room_lines', 'checkin_date', 'checkout_date'}.intersection(vals):
+            self._sync_room_lines()
+        return res
+
+    @api.multi
+    def action_update_prices(self):
+        """
+        Reprice the room and service lines of the folios with one pricing
+        pass for all of them.
+        -------------------------------------------------------------
+        @param self: object pointer
+        @return: True
+        """
+        lines = [line for line in (list(self.mapped('room_lines')) +
+                                   list(self.mapped('service_lines')))
+                 if line.product_id]
+        prices = self.env['product.pricelist']._get_hotel_prices([
+            (line.product_id, line.product_uom_qty or 1.0,
+             line.folio_id.partner_id, line.folio_id.pricelist_id,
+             line.folio_id.date_order and line.folio_id.date_order[:10],
+             line.folio_id.fiscal_position_id)
+            for line in lines])
+        room_lines = [line for line in lines
+                      if line._name == 'hotel.folio.line']
+        room_prices = self.env['hotel.folio.line']._get_room_rate_prices([
+            (line.product_id, line.checkin_date, line.checkout_date,
+             line.folio_id.pricelist_id, price['price_unit'])
+            for line, price in zip(lines, prices)
+            if line._name == 'hotel.folio.line'])
+        room_prices = dict(zip(room_lines, room_prices))
+        # The lines getting the same price and taxes are written together.
+        writes = {}
+        for line, price in zip(lines, prices):
+            key = (line._name, room_prices.get(line, price['price_unit']),
+                   tuple(price['tax_id'].ids))
+            writes.setdefault(key, []).append(line.id)
+        for (model, price_unit, tax_ids), line_ids in writes.items():
+            vals = {'price_unit': price_unit,
+                    'tax_id': [(6, 0, list(tax_ids))]}
+            if model == 'hotel.folio.line':
+                vals['rate_price'] = price_unit
+            self.env[model].browse(line_ids).write(vals)
+        return True
+
+    @api.multi
+    def _get_room_line_folios(self):
+        """
+        Return the folios whose rooms are held by folio room lines.
+        """
+        return self
+
+    @api.multi
+    def _sync_room_lines(self):
+        """
+        Bring the folio room lines in line with the rooms and dates of
+        the folios: the difference between the existing lines and the
+        folio rooms is applied with bulk unlink, write and create.
+        ------------------------------------------------------------
+        @param self: object pointer
+        """
+        folios = self._get_room_line_folios()
+        if not folios:
+            return
         h_room_obj = self.env['hotel.room']
         folio_room_line_obj = self.env['folio.room.line']
-        room_lst = []
-        room_lst1 = []
-        for rec in self:
-            for res in rec.room_lines:
-                room_lst1.append(res.product_id.id)
-            if vals and vals.get('duration_dummy', False):
-                vals['duration'] = vals.get('duration_dummy', 0.0)
-            else:
-                vals['duration'] = rec.duration
-            for folio_rec in rec.room_lines:
-                room_lst.append(folio_rec.product_id.id)
-            new_rooms = set(room_lst).difference(set(room_lst1))
-            if len(list(new_rooms)) != 0:
-                room_list = product_obj.browse(list(new_rooms))
-                for rm in room_list:
-                    room_obj = h_room_obj.search([('name', '=', rm.name)])
-                    room_obj.write({'isroom': False})
-                    vals = {'room_id': room_obj.id,
-                            'check_in': rec.checkin_date,
-                            'check_out': rec.checkout_date,
-                            'folio_id': rec.id,
-                            }
-                    folio_room_line_obj.create(vals)
-            if len(list(new_rooms)) == 0:
-                room_list_obj = product_obj.browse(room_lst1)
-                for rom in room_list_obj:
-                    room_obj = h_room_obj.search([('name', '=', rom.name)])
-                    room_obj.write({'isroom': False})
-                    room_vals = {'room_id': room_obj.id,
-                                 'check_in': rec.checkin_date,
-                                 'check_out': rec.checkout_date,
-                                 'folio_id': rec.id,
-                                 }
-                    folio_romline_rec = (folio_room_line_obj.search
-                                         ([('folio_id', '=', rec.id)]))
-                    folio_romline_rec.write(room_vals)
-        return super(HotelFolio, self).write(vals)
+        room_ids = h_room_obj._get_room_ids_by_product(
+            folios.mapped('room_lines.product_id').ids)
+        existing = folio_room_line_obj.search([('folio_id', 'in',
+                                                folios.ids)])
+        lines_by_key = {(line.folio_id.id, line.room_id.id): line
+                        for line in existing}
+        to_unlink = existing
+        to_write = {}
+        to_create = []
+        for folio in folios:
+            folio_room_ids = {room_ids[line.product_id.id]
+                              for line in folio.room_lines
+                              if line.product_id.id in room_ids}
+            for room_id in folio_room_ids:
+                line = lines_by_key.get((folio.id, room_id))
+                if not line:
+                    to_create.append({'room_id': room_id,
+                                      'check_in': folio.checkin_date,
+                                      'check_out': folio.checkout_date,
+                                      'folio_id': folio.id})
+                    continue
+                to_unlink -= line
+                dates = (folio.checkin_date, folio.checkout_date)
+                if (line.check_in, line.check_out) != dates:
+                    to_write.setdefault(dates, folio_room_line_obj)
+                    to_write[dates] |= line
+        if to_unlink:
+            to_unlink._unlink_free_rooms()
+        for (check_in, check_out), lines in to_write.items():
+            lines.write({'check_in': check_in, 'check_out': check_out})
+        # folio.room.line has no multi-record create in this version.
+        for line_vals in to_create:
+            folio_room_line_obj.create(line_vals)
+        if to_create:
+            h_room_obj.browse([line_vals['room_id'] for line_vals in
+                               to_create]).write({'isroom': False})
 
     @api.onchange('warehouse_id')
     def onchange_warehouse_id(self):
@@ -1442,7 +2508,7 @@ class HotelFolio(models.Model):
         '''
         @param self: object pointer
         '''
-        room_lst = []
+        h_room_obj = self.env['hotel.room']
         invoice_id = (self.order_id.action_invoice_create(grouped=False,
                                                           final=False))
         for line in self:
@@ -1450,12 +2516,10 @@ class HotelFolio(models.Model):
                       'hotel_invoice_id': invoice_id
                       }
             line.write(values)
-            for rec in line.room_lines:
-                room_lst.append(rec.product_id)
-            for room in room_lst:
-                room_rec = self.env['hotel.room'].\
-                    search([('name', '=', room.name)])
-                room_rec.write({'isroom': True})
+        room_ids = h_room_obj._get_room_ids_by_product(
+            self.mapped('room_lines.product_id').ids)
+        h_room_obj.browse(list(set(room_ids.values()))).write(
+            {'isroom': True})
         return invoice_id
 
     @api.multi
@@ -1567,6 +2631,12 @@ class HotelFolioLine(models.Model):
     is_reserved = fields.Boolean('Is Reserved',
                                  help='True when folio line created from \
                                  Reservation')
+    rate_price = fields.Float('Rate Price',
+                              digits=dp.get_precision('Product Price'),
+                              help='Rent last set from the pricelist and the '
+                              'room rates. A rent differing from it was '
+                              'edited by hand and is kept when the dates '
+                              'change.')
 
     @api.model
     def create(self, vals, check=True):
@@ -1604,24 +2674,20 @@ class HotelFolioLine(models.Model):
         @param self: The object pointer
         @return: True/False.
         """
-        sale_line_obj = self.env['sale.order.line']
         fr_obj = self.env['folio.room.line']
-        for line in self:
-            if line.order_line_id:
-                sale_unlink_obj = (sale_line_obj.browse
-                                   ([line.order_line_id.id]))
-                for rec in sale_unlink_obj:
-                    room_obj = self.env['hotel.room'
-                                        ].search([('name', '=', rec.name)])
-                    if room_obj.id:
-                        folio_arg = [('folio_id', '=', line.folio_id.id),
-                                     ('room_id', '=', room_obj.id)]
-                        folio_room_line_myobj = fr_obj.search(folio_arg)
-                        if folio_room_line_myobj.id:
-                            folio_room_line_myobj.unlink()
-                            room_obj.write({'isroom': True,
-                                            'status': 'available'})
-                sale_unlink_obj.unlink()
+        h_room_obj = self.env['hotel.room']
+        sale_lines = self.mapped('order_line_id')
+        room_ids = h_room_obj._get_room_ids_by_product(
+            sale_lines.mapped('product_id').ids)
+        keys = {(line.folio_id.id, room_ids[line.order_line_id.product_id.id])
+                for line in self
+                if line.order_line_id.product_id.id in room_ids}
+        folio_arg = [('folio_id', 'in', [key[0] for key in keys]),
+                     ('room_id', 'in', [key[1] for key in keys])]
+        folio_room_lines = fr_obj.search(folio_arg).filtered(
+            lambda line: (line.folio_id.id, line.room_id.id) in keys)
+        folio_room_lines._unlink_free_rooms()
+        sale_lines.unlink()
         return super(HotelFolioLine, self).unlink()
 
     @api.onchange('product_id')
@@ -1629,37 +2695,84 @@ class HotelFolioLine(models.Model):
         '''
  -        @param self: object pointer
  -        '''
-        context = dict(self._context)
-        if not context:
-            context = {}
-        if context.get('folio', False):
-            if self.product_id and self.folio_id.partner_id:
-                self.name = self.product_id.name
-                self.price_unit = self.product_id.list_price
-                self.product_uom = self.product_id.uom_id
-                tax_obj = self.env['account.tax']
-                pr = self.product_id
-                self.price_unit = tax_obj._fix_tax_included_price(pr.price,
-                                                                  pr.taxes_id,
-                                                                  self.tax_id)
-        else:
-            if not self.product_id:
-                return {'domain': {'product_uom': []}}
-            val = {}
-            pr = self.product_id.with_context(
-                lang=self.folio_id.partner_id.lang,
-                partner=self.folio_id.partner_id.id,
-                quantity=val.get('product_uom_qty') or self.product_uom_qty,
-                date=self.folio_id.date_order,
-                pricelist=self.folio_id.pricelist_id.id,
-                uom=self.product_uom.id
-            )
-            p = pr.with_context(pricelist=self.order_id.pricelist_id.id).price
-            if self.folio_id.pricelist_id and self.folio_id.partner_id:
-                obj = self.env['account.tax']
-                val['price_unit'] = obj._fix_tax_included_price(p,
-                                                                pr.taxes_id,
-                                                                self.tax_id)
+        if not self.product_id:
+            return {'domain': {'product_uom': []}}
+        if self._context.get('folio', False):
+            self.name = self.product_id.name
+            self.product_uom = self.product_id.uom_id
+        if self.folio_id.partner_id:
+            price = self._get_folio_price()
+            self.price_unit = self.rate_price = self._get_room_rate_prices([(
+                self.product_id, self.checkin_date, self.checkout_date,
+                self.folio_id.pricelist_id, price['price_unit'])])[0]
+            self.tax_id = price['tax_id']
+
+    @api.multi
+    def _get_folio_price(self):
+        """
+        Return the pricelist price and the taxes of the line product.
+        """
+        self.ensure_one()
+        folio = self.folio_id
+        return self.env['product.pricelist']._get_hotel_prices([(
+            self.product_id, self.product_uom_qty or 1.0, folio.partner_id,
+            folio.pricelist_id, folio.date_order and folio.date_order[:10],
+            folio.fiscal_position_id)])[0]
+
+    @api.model
+    def _init_rate_price(self):
+        """
+        Set the rate price of the lines priced before it was stored to
+        the rent the pricelist and the rates give for their dates, so that
+        their rent follows the dates unless it was edited by hand.
+        """
+        lines = self.search(['|', ('rate_price', '=', False),
+                             ('rate_price', '=', 0)])
+        lines = lines.filtered(lambda line: line.product_id and
+                               line.folio_id.partner_id)
+        prices = self.env['product.pricelist']._get_hotel_prices([
+            (line.product_id, line.product_uom_qty or 1.0,
+             line.folio_id.partner_id, line.folio_id.pricelist_id,
+             line.folio_id.date_order and line.folio_id.date_order[:10],
+             line.folio_id.fiscal_position_id)
+            for line in lines])
+        rate_prices = self._get_room_rate_prices([
+            (line.product_id, line.checkin_date, line.checkout_date,
+             line.folio_id.pricelist_id, price['price_unit'])
+            for line, price in zip(lines, prices)])
+        writes = {}
+        for line, rate_price in zip(lines, rate_prices):
+            writes.setdefault(rate_price, []).append(line.id)
+        for rate_price, line_ids in writes.items():
+            self.browse(line_ids).write({'rate_price': rate_price})
+
+    @api.model
+    def _get_room_rate_prices(self, items):
+        """
+        Apply the nightly rates of the room categories to room prices.
+        Every item is a (product, checkin, checkout, pricelist, price)
+        tuple; the price is kept for the nights without rate and for the
+        products which are not rooms.
+        --------------------------------------------------------------
+        @param self: object pointer
+        @param items: list of (product, checkin, checkout, pricelist,
+                      price) tuples
+        @return: list of nightly prices, in the order of the items
+        """
+        room_obj = self.env['hotel.room']
+        rate_obj = self.env['hotel.room.rate']
+        room_ids = room_obj._get_room_ids_by_product(
+            [item[0].id for item in items])
+        res = []
+        for product, checkin, checkout, pricelist, price in items:
+            room = room_obj.browse(room_ids.get(product.id))
+            if not (room.categ_id and checkin and checkout):
+                res.append(price)
+                continue
+            res.append(rate_obj.get_nightly_price(
+                room.categ_id.id, checkin, checkout, pricelist.id,
+                default_price=price))
+        return res
 
     @api.onchange('checkin_date', 'checkout_date')
     def on_change_checkout(self):
@@ -1697,25 +2810,19 @@ class HotelFolioLine(models.Model):
                 if additional_hours >= configured_addition_hours:
                     myduration += 1
         self.product_uom_qty = myduration
-        hotel_room_obj = self.env['hotel.room']
-        hotel_room_ids = hotel_room_obj.search([])
-        avail_prod_ids = []
-        for room in hotel_room_ids:
-            assigned = False
-            for rm_line in room.room_line_ids:
-                if rm_line.status != 'cancel':
-                    if(self.checkin_date <= rm_line.check_in <=
-                       self.checkout_date) or (self.checkin_date <=
-                                               rm_line.check_out <=
-                                               self.checkout_date):
-                        assigned = True
-                    elif (rm_line.check_in <= self.checkin_date <=
-                          rm_line.check_out) or (rm_line.check_in <=
-                                                 self.checkout_date <=
-                                                 rm_line.check_out):
-                        assigned = True
-            if not assigned:
-                avail_prod_ids.append(room.product_id.id)
+        precision = self.env['decimal.precision'].precision_get(
+            'Product Price')
+        if self.product_id and self.folio_id.partner_id and not float_compare(
+                self.price_unit, self.rate_price, precision_digits=precision):
+            # The nightly rates depend on the dates of the stay; a rent
+            # edited by hand, and the taxes, are kept.
+            self.price_unit = self.rate_price = self._get_room_rate_prices([(
+                self.product_id, self.checkin_date, self.checkout_date,
+                self.folio_id.pricelist_id,
+                self._get_folio_price()['price_unit'])])[0]
+        rooms = self.env['hotel.room'].get_available_rooms(self.checkin_date,
+                                                           self.checkout_date)
+        avail_prod_ids = rooms.mapped('product_id').ids
         domain = {'product_id': [('id', 'in', avail_prod_ids)]}
         return {'domain': domain}
 
@@ -1817,14 +2924,16 @@ class HotelServiceLine(models.Model):
         @param self: object pointer
         '''
         if self.product_id and self.folio_id.partner_id:
+            folio = self.folio_id
             self.name = self.product_id.name
-            self.price_unit = self.product_id.list_price
             self.product_uom = self.product_id.uom_id
-            tax_obj = self.env['account.tax']
-            prod = self.product_id
-            self.price_unit = tax_obj._fix_tax_included_price(prod.price,
-                                                              prod.taxes_id,
-                                                              self.tax_id)
+            price = self.env['product.pricelist']._get_hotel_prices([(
+                self.product_id, self.product_uom_qty or 1.0,
+                folio.partner_id, folio.pricelist_id,
+                folio.date_order and folio.date_order[:10],
+                folio.fiscal_position_id)])[0]
+            self.price_unit = price['price_unit']
+            self.tax_id = price['tax_id']
 
     @api.onchange('ser_checkin_date', 'ser_checkout_date')
     def on_change_checkout(self):
@@ -1885,56 +2994,24 @@ class HotelServiceType(models.Model):
 
     _name = "hotel.service.type"
     _description = "Service Type"
+    _inherit = 'hotel.category.mixin'
+    _parent_name = 'service_id'
 
     name = fields.Char('Service Name', size=64, required=True)
     service_id = fields.Many2one('hotel.service.type', 'Service Category')
     child_ids = fields.One2many('hotel.service.type', 'service_id',
                                'Child Categories')
+    complete_name = fields.Char('Complete Name',
+                                compute='_compute_complete_name',
+                                store=True, index=True)
 
-    @api.multi
-    def name_get(self):
-        def get_names(cat):
-            """ Return the list [cat.name, cat.service_id.name, ...] """
-            res = []
-            while cat:
-                res.append(cat.name)
-                cat = cat.service_id
-            return res
-        return [(cat.id, " / ".join(reversed(get_names(cat)))) for cat in self]
+    @api.depends('name', 'service_id.complete_name')
+    def _compute_complete_name(self):
+        return super(HotelServiceType, self)._compute_complete_name()
 
-    @api.model
-    def name_search(self, name, args=None, operator='ilike', limit=100):
-        if not args:
-            args = []
-        if name:
-            # Be sure name_search is symetric to name_get
-            category_names = name.split(' / ')
-            parents = list(category_names)
-            child = parents.pop()
-            domain = [('name', operator, child)]
-            if parents:
-                names_ids = self.name_search(' / '.join(parents), args=args,
-                                             operator='ilike', limit=limit)
-                category_ids = [name_id[0] for name_id in names_ids]
-                if operator in expression.NEGATIVE_TERM_OPERATORS:
-                    categories = self.search([('id', 'not in', category_ids)])
-                    domain = expression.OR([[('service_id', 'in',
-                                              categories.ids)], domain])
-                else:
-                    domain = expression.AND([[('service_id', 'in',
-                                               category_ids)], domain])
-                for i in range(1, len(category_names)):
-                    domain = [[('name', operator,
-                                ' / '.join(category_names[-1 - i:]))], domain]
-                    if operator in expression.NEGATIVE_TERM_OPERATORS:
-                        domain = expression.AND(domain)
-                    else:
-                        domain = expression.OR(domain)
-            categories = self.search(expression.AND([domain, args]),
-                                     limit=limit)
-        else:
-            categories = self.search(args, limit=limit)
-        return categories.name_get()
+    @api.constrains('service_id')
+    def _check_category_recursion(self):
+        return super(HotelServiceType, self)._check_category_recursion()
 
 
 class HotelServices(models.Model):
@@ -1960,6 +3037,28 @@ class ResCompany(models.Model):
                                       hours will be provided here based on \
                                       that extra days will be calculated.")
 
+    @api.multi
+    def write(self, vals):
+        res = super(ResCompany, self).write(vals)
+        if {'additional_hours', 'partner_id'}.intersection(vals):
+            # The hotel days of the rooms depend on both.
+            self.env['hotel.room.occupancy.day'].rebuild()
+        return res
+
+
+class ResPartner(models.Model):
+
+    _inherit = 'res.partner'
+
+    @api.multi
+    def write(self, vals):
+        res = super(ResPartner, self).write(vals)
+        if 'tz' in vals and self.env['res.company'].sudo().search_count(
+                [('partner_id', 'in', self.ids)]):
+            # The hotel days of the rooms are those of their company.
+            self.env['hotel.room.occupancy.day'].rebuild()
+        return res
+
 
 class AccountInvoice(models.Model):
 
@@ -1972,4 +3071,17 @@ class AccountInvoice(models.Model):
             folio = self.env['hotel.folio'].browse(self._context['folio_id'])
             folio.write({'hotel_invoice_id': res.id,
                          'invoice_status': 'invoiced'})
-        return res
\ No newline at end of file
+        return res
+
+class SaleOrder(models.Model):
+
+    _inherit = 'sale.order'
+
+    @api.multi
+    def write(self, vals):
+        res = super(SaleOrder, self).write(vals)
+        if 'state' in vals:
+            lines = self.env['folio.room.line'].search(
+                [('folio_id.order_id', 'in', self.ids)])
+            lines._occupancy_changed(lines._get_occupancy_changes())
+        return res
@@ -0,0 +1,43 @@
+odoo.define('hotel.room_command_notification', function (require) {
+'use strict';
+
+var bus = require('bus.bus').bus;
+var core = require('web.core');
+var WebClient = require('web.WebClient');
+
+var _t = core._t;
+
+WebClient.include({
+    /**
+     * Listen to the outcome of the card commands queued by the user,
+     * published on the partner channel by the hotelgateway command.
+     */
+    show_application: function () {
+        bus.on('notification', this, this._onRoomCommandNotification);
+        return this._super.apply(this, arguments);
+    },
+
+    /**
+     * @private
+     * @param {Array} notifications
+     */
+    _onRoomCommandNotification: function (notifications) {
+        var self = this;
+        _.each(notifications, function (notification) {
+            var command = notification[1];
+            if (!command || command.type !== 'hotel_room_command') {
+                return;
+            }
+            var title = command.room ?
+                _.str.sprintf('%s (%s)', command.name, command.room) :
+                command.name;
+            if (command.state === 'failed') {
+                self.do_warn(title, command.message || _t('The command failed.'), true);
+            } else if (command.state === 'done') {
+                self.do_notify(title, _t('The command was carried out.'));
+            }
+        });
+    },
+});
+
+});
@@ -0,0 +1,6 @@
+# See LICENSE file for full copyright and licensing details.
+
+from . import test_hotel
+from . import test_gateway_codec
+from . import test_gateway_commands
+from . import test_gateway_service
@@ -0,0 +1,70 @@
+# See LICENSE file for full copyright and licensing details.
+import unittest
+
+from ..gateway import codec, protocol
+
+
+class TestGatewayCodec(unittest.TestCase):
+
+    # Frames built by the former string based packet functions.
+    card_frame = bytes.fromhex(
+        'dddddd0101126500000a3132333435' + '00' * 32 + '4cbb')
+    delete_frame = bytes.fromhex(
+        'dddddd01011265000003ffffffffff' + '00' * 32 + '0bbb')
+    check_frame = bytes.fromhex('dddddd0102010200010000' + '00' * 36 + '01bb')
+    poll_frame = bytes.fromhex(
+        'dddddd01000e0312091a14' + '00' * 36 + '19bb')
+
+    def test_encode_legacy_frames(self):
+        card = codec.card_number('12345')
+        self.assertEqual(codec.CardMessage(12, 10, card).encode(),
+                         self.card_frame)
+        self.assertEqual(codec.CardDelete(12, 3).encode(), self.delete_frame)
+        self.assertEqual(codec.CardCheck(1, 1).encode(), self.check_frame)
+        self.assertEqual(codec.PollReply(14, 3, 9, 26).encode(),
+                         self.poll_frame)
+
+    def test_round_trip(self):
+        messages = [codec.CardMessage(99, 11, b'54321'),
+                    codec.CardDelete(7, 4),
+                    codec.CardCheck(42, 2),
+                    codec.PollReply(31, 12, 23, 59)]
+        for message in messages:
+            frame = message.encode()
+            self.assertEqual(len(frame), codec.FRAME_SIZE)
+            self.assertEqual(codec.Message.decode(frame), message)
+
+    def test_checksum(self):
+        for frame in (self.card_frame, self.delete_frame, self.check_frame,
+                      self.poll_frame):
+            value = 0
+            for byte in frame[3:-2]:
+                value ^= byte
+            self.assertEqual(codec.checksum(frame), value & 0x7f)
+
+    def test_decode_errors(self):
+        frame = bytearray(self.card_frame)
+        frame[20] ^= 1
+        with self.assertRaises(codec.CodecError):
+            codec.Message.decode(bytes(frame))
+        with self.assertRaises(codec.CodecError):
+            codec.Message.decode(self.card_frame[:-1])
+        with self.assertRaises(codec.CodecError):
+            codec.CardCheck(100, 1).encode()
+        with self.assertRaises(codec.CodecError):
+            codec.card_number('12a45')
+
+    def test_status_decoder(self):
+        decoder = protocol.StatusDecoder()
+        frame = bytearray(codec.FRAME_SIZE)
+        frame[3] = protocol.STATUS_MARKER
+        frame[8] = protocol.STATUS_SOS | protocol.STATUS_GUEST
+        self.assertEqual(len(decoder.diff(bytes(frame))), 12)
+        self.assertEqual(decoder.diff(bytes(frame)), {})
+        # Unknown bits are ignored.
+        frame[12] = 0x02
+        self.assertEqual(decoder.diff(bytes(frame)), {})
+        frame[8] = 0
+        frame[40] = protocol.STATUS_DO_NOT_DISTURB
+        self.assertEqual(decoder.diff(bytes(frame)),
+                         {2: 0, 10: protocol.STATUS_DO_NOT_DISTURB})
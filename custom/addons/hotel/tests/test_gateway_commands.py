@@ -0,0 +1,67 @@
+# See LICENSE file for full copyright and licensing details.
+import unittest
+
+from ..gateway import codec, commands
+
+
+class TestGatewayCommands(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 0.0
+        self.queue = commands.CommandQueue(timeout=5.0, attempts=2,
+                                           clock=lambda: self.now)
+        self.controller = ('10.0.0.2', 80)
+
+    def test_rooms_in_flight(self):
+        frames = [codec.CardMessage(room, 1, b'12345').encode()
+                  for room in (11, 12, 11)]
+        for command_id, frame in enumerate(frames, 1):
+            self.queue.submit(command_id, frame)
+        # Both rooms are sent at once, the second command of room 11
+        # waits for the first one.
+        self.assertEqual(self.queue.next_frame(self.controller), frames[0])
+        self.assertEqual(self.queue.next_frame(self.controller), frames[1])
+        self.assertIsNone(self.queue.next_frame(self.controller))
+        # The ack of room 12 is matched by the room it echoes.
+        self.queue.acknowledge(b'\x01\x12', self.controller)
+        self.assertEqual(self.queue.pop_results(), [(2, commands.DONE, None)])
+        self.queue.acknowledge(b'\x01', self.controller)
+        self.assertEqual(self.queue.pop_results(), [(1, commands.DONE, None)])
+        self.assertEqual(self.queue.next_frame(self.controller), frames[2])
+
+    def test_timeout_and_retry(self):
+        frame = codec.CardDelete(7, 3).encode()
+        self.queue.submit(1, frame)
+        self.assertEqual(self.queue.next_frame(self.controller), frame)
+        self.now = 6.0
+        self.queue.expire()
+        self.assertEqual(self.queue.pop_results(), [])
+        self.assertEqual(self.queue.next_frame(self.controller), frame)
+        self.now = 12.0
+        self.queue.expire()
+        results = self.queue.pop_results()
+        self.assertEqual([result[:2] for result in results],
+                         [(1, commands.FAILED)])
+        self.assertEqual(len(self.queue), 0)
+
+    def test_refused_and_unknown_ack(self):
+        self.assertIsNone(self.queue.acknowledge(b'\x01', self.controller))
+        self.queue.submit(1, codec.CardCheck(1, 1).encode())
+        self.queue.next_frame(self.controller)
+        self.assertIsNone(self.queue.acknowledge(b'\x01', ('10.0.0.3', 80)))
+        self.queue.acknowledge(b'\x00', self.controller)
+        self.assertEqual([result[:2] for result in self.queue.pop_results()],
+                         [(1, commands.FAILED)])
+
+    def test_ack_of_other_room(self):
+        self.queue.submit(1, codec.CardCheck(11, 1).encode())
+        self.queue.next_frame(self.controller)
+        self.assertIsNone(self.queue.acknowledge(b'\x00\x12',
+                                                 self.controller))
+        self.assertEqual(self.queue.pop_results(), [])
+
+    def test_ack_from_other_port(self):
+        self.queue.submit(1, codec.CardCheck(11, 1).encode())
+        self.queue.next_frame(self.controller)
+        self.queue.acknowledge(b'\x01', ('10.0.0.2', 4321))
+        self.assertEqual(self.queue.pop_results(), [(1, commands.DONE, None)])
@@ -0,0 +1,99 @@
+# See LICENSE file for full copyright and licensing details.
+import asyncio
+import unittest
+
+from ..gateway import codec, commands
+from ..gateway.service import GatewayService
+
+
+class FakeTransport(object):
+
+    def __init__(self):
+        self.sent = []
+
+    def sendto(self, frame, addr):
+        self.sent.append((frame, addr))
+
+
+class TestGatewayService(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.flushed = []
+        self.results = []
+        self.service = GatewayService(
+            lambda states, gateway_id: self.flushed.append(
+                (gateway_id, states)),
+            loop=self.loop,
+            result_sink=self.results.extend,
+            command_source=lambda limit: [
+                (1, codec.CardDelete(11, 1).encode(), 1),
+                (2, codec.CardDelete(12, 1).encode(), 2)])
+        self.service.transport = FakeTransport()
+        self.service.fallback.start()
+        self.service.set_gateways([(1, ('10.0.0.1', 80)),
+                                   (2, ('10.0.0.2', 80))])
+
+    def tearDown(self):
+        self.service.stop()
+        self.service.executor.shutdown()
+        self.loop.run_until_complete(asyncio.sleep(0))
+        self.loop.close()
+
+    def receive(self, data, addr):
+        self.service.datagram_received(data, addr)
+        # Let the links consume their queue.
+        self.loop.run_until_complete(asyncio.sleep(0))
+
+    def test_routing_by_gateway(self):
+        self.loop.run_until_complete(self.service.flush())
+        # Every gateway is only sent its own commands.
+        self.receive(b'\x01' * 7, ('10.0.0.2', 80))
+        self.assertEqual(self.service.transport.sent[-1][0][5], 0x12)
+        self.receive(b'\x01' * 7, ('10.0.0.1', 80))
+        self.assertEqual(self.service.transport.sent[-1][0][5], 0x11)
+        status = bytearray(49)
+        status[3] = 241
+        status[4] = 0x80
+        self.receive(bytes(status), ('10.0.0.1', 80))
+        self.receive(b'\x01', ('10.0.0.2', 80))
+        self.service.command_source = None
+        self.loop.run_until_complete(self.service.flush())
+        # Only the gateway which sent the frame reports the rooms.
+        self.assertEqual([gateway_id for gateway_id, _s in self.flushed], [1])
+        self.assertEqual(self.flushed[0][1][1], 0x80)
+        self.assertEqual(self.results, [(2, commands.DONE, None)])
+
+    def test_removed_gateway(self):
+        self.loop.run_until_complete(self.service.flush())
+        self.service.set_gateways([(1, ('10.0.0.1', 80))])
+        self.assertEqual(sorted(self.service.links), [1])
+        # The commands of the removed gateway fail, its controllers are
+        # served by the fallback link.
+        self.assertEqual(self.service.links_by_host,
+                         {'10.0.0.1': self.service.links[1]})
+        self.service.command_source = None
+        self.loop.run_until_complete(self.service.flush())
+        self.assertEqual([result[:2] for result in self.results],
+                         [(2, commands.FAILED)])
+
+    def test_unknown_host_status(self):
+        status = bytearray(49)
+        status[3] = 241
+        self.receive(bytes(status), ('10.0.0.9', 80))
+        self.loop.run_until_complete(self.service.flush())
+        self.assertEqual(self.flushed, [])
+        self.assertEqual(self.service.unknown_hosts, {'10.0.0.9'})
+
+    def test_noise_is_no_ack(self):
+        self.loop.run_until_complete(self.service.flush())
+        self.receive(b'\x01' * 7, ('10.0.0.1', 80))
+        # Truncated frames and stray bytes leave the command in flight.
+        for data in (b'\x00\x11\x00', b'\x07', b'\xdd\xdd\xdd\x01'):
+            self.receive(data, ('10.0.0.1', 80))
+        self.service.command_source = None
+        self.loop.run_until_complete(self.service.flush())
+        self.assertEqual(self.results, [])
+        self.receive(b'\x01\x11', ('10.0.0.1', 80))
+        self.loop.run_until_complete(self.service.flush())
+        self.assertEqual(self.results, [(1, commands.DONE, None)])
@@ -0,0 +1,321 @@
+# See LICENSE file for full copyright and licensing details.
+
+from psycopg2 import IntegrityError
+
+from odoo.tests import common
+from odoo.tools import mute_logger
+from odoo.exceptions import ValidationError
+
+
+class TestHotel(common.TransactionCase):
+
+    def setUp(self):
+        super(TestHotel, self).setUp()
+        self.hotel_room_obj = self.env['hotel.room']
+        self.room_type = self.env.ref('hotel.hotel_room_type_1')
+        self.warehouse = self.env.ref('stock.warehouse0')
+        self.partner = self.env.ref('base.res_partner_2')
+        self.pricelist = self.env.ref('product.list0')
+        self.room = self.hotel_room_obj.create({
+            'name': 'Room 101',
+            'categ_id': self.room_type.id,
+            'floor_id': self.env.ref('hotel.hotel_floor_ground0').id,
+            'capacity': 4,
+        })
+
+    def test_get_room_ids_by_product(self):
+        product = self.room.product_id
+        self.assertEqual(
+            self.hotel_room_obj._get_room_ids_by_product([product.id]),
+            {product.id: self.room.id})
+        self.assertEqual(
+            self.hotel_room_obj._get_room_ids_by_product([product.id, False]),
+            {product.id: self.room.id})
+        # The mapping follows the rooms created and deleted.
+        room = self.hotel_room_obj.create({'name': 'Room 102',
+                                           'categ_id': self.room_type.id,
+                                           'capacity': 1})
+        other = room.product_id
+        self.assertEqual(
+            self.hotel_room_obj._get_room_ids_by_product([other.id]),
+            {other.id: room.id})
+        room.unlink()
+        self.assertFalse(
+            self.hotel_room_obj._get_room_ids_by_product([other.id]))
+
+    def test_folio_room_line_sync(self):
+        room_line_obj = self.env['folio.room.line']
+        folio = self.env['hotel.folio'].create({
+            'partner_id': self.partner.id,
+            'partner_invoice_id': self.partner.id,
+            'partner_shipping_id': self.partner.id,
+            'pricelist_id': self.pricelist.id,
+            'warehouse_id': self.warehouse.id,
+            'checkin_date': '2099-02-01 12:00:00',
+            'checkout_date': '2099-02-03 10:00:00',
+            'room_lines': [(0, 0, {
+                'checkin_date': '2099-02-01 12:00:00',
+                'checkout_date': '2099-02-03 10:00:00',
+                'product_id': self.room.product_id.id,
+                'product_uom': self.room.uom_id.id,
+                'name': self.room.name,
+                'price_unit': 10.0,
+                'product_uom_qty': 2})],
+        })
+        domain = [('folio_id', '=', folio.id)]
+        self.assertEqual(room_line_obj.search(domain).room_id, self.room)
+        folio.write({'checkout_date': '2099-02-04 10:00:00'})
+        lines = room_line_obj.search(domain)
+        self.assertEqual(len(lines), 1)
+        self.assertEqual(lines.check_out, '2099-02-04 10:00:00')
+        # A room still held over the dates by another line stays occupied
+        # when the folio lets it go.
+        room_line_obj.create({'room_id': self.room.id,
+                              'check_in': '2099-02-02 12:00:00',
+                              'check_out': '2099-02-05 10:00:00'})
+        folio.write({'room_lines': [(2, folio.room_lines.id)]})
+        self.assertFalse(room_line_obj.search(domain))
+        self.assertFalse(self.room.isroom)
+
+    def test_get_hotel_prices(self):
+        product = self.room.product_id
+        no_fpos = self.env['account.fiscal.position']
+        prices = self.env['product.pricelist']._get_hotel_prices([
+            (product, 1, self.partner, self.pricelist, '2099-01-01', no_fpos),
+            (product, 3, self.partner, self.pricelist, '2099-01-01', no_fpos),
+            (product, 1, self.partner, self.env['product.pricelist'],
+             '2099-01-01', no_fpos),
+        ])
+        self.assertEqual(len(prices), 3)
+        self.assertEqual(set(prices[0]), {'price_unit', 'tax_id'})
+        self.assertEqual(prices[0]['tax_id'], prices[1]['tax_id'])
+
+    def test_get_hotel_prices_fiscal_position(self):
+        tax_obj = self.env['account.tax']
+        tax = tax_obj.create({'name': 'Hotel Tax', 'amount': 10.0,
+                              'type_tax_use': 'sale'})
+        export_tax = tax_obj.create({'name': 'Hotel Export Tax',
+                                     'amount': 0.0, 'type_tax_use': 'sale'})
+        fpos = self.env['account.fiscal.position'].create({
+            'name': 'Hotel Export',
+            'tax_ids': [(0, 0, {'tax_src_id': tax.id,
+                                'tax_dest_id': export_tax.id})],
+        })
+        product = self.room.product_id
+        product.write({'taxes_id': [(6, 0, tax.ids)]})
+        prices = self.env['product.pricelist']._get_hotel_prices([
+            (product, 1, self.partner, self.pricelist, '2099-01-01',
+             self.env['account.fiscal.position']),
+            (product, 1, self.partner, self.pricelist, '2099-01-01', fpos),
+        ])
+        # The fiscal position of the order wins over the partner's.
+        self.assertEqual(prices[0]['tax_id'], tax)
+        self.assertEqual(prices[1]['tax_id'], export_tax)
+
+    def test_get_hotel_prices_memo(self):
+        pricelist_obj = self.env['product.pricelist']
+        product = self.room.product_id
+        no_fpos = self.env['account.fiscal.position']
+        item = (product, 1, self.partner, self.pricelist, '2099-01-01',
+                no_fpos)
+        prices = pricelist_obj._get_hotel_prices([item, item])
+        self.assertEqual(prices[0]['price_unit'], prices[1]['price_unit'])
+        # Nothing outlives the call: the next one sees the new price.
+        product.write({'list_price': product.list_price + 10.0})
+        self.assertNotEqual(
+            pricelist_obj._get_hotel_prices([item])[0]['price_unit'],
+            prices[0]['price_unit'])
+
+    def test_room_rate_stay_price(self):
+        rate_obj = self.env['hotel.room.rate']
+        rate = rate_obj.create({'categ_id': self.room_type.id,
+                                'date_from': '2099-01-01',
+                                'date_to': '2099-01-31',
+                                'price': 100.0})
+        # 2099-01-03 is a Saturday.
+        rate_obj.create({'categ_id': self.room_type.id,
+                         'date_from': '2099-01-01',
+                         'date_to': '2099-01-31',
+                         'weekday': '5',
+                         'price': 150.0})
+        self.assertEqual(rate_obj.get_stay_price(
+            self.room_type.id, '2099-01-01 12:00:00', '2099-01-05 12:00:00'),
+            450.0)
+        # Nights outside of the rates are charged at the default price.
+        self.assertEqual(rate_obj.get_stay_price(
+            self.room_type.id, '2099-01-30', '2099-02-02',
+            default_price=10.0), 260.0)
+        self.assertEqual(rate_obj.get_nightly_price(
+            self.room_type.id, '2099-03-01', '2099-03-03',
+            default_price=10.0), 10.0)
+        rate.write({'price': 80.0})
+        self.assertEqual(rate_obj.get_stay_price(
+            self.room_type.id, '2099-01-01', '2099-01-05'), 390.0)
+
+    def test_category_complete_name(self):
+        type_obj = self.env['hotel.room.type']
+        child = type_obj.create({'name': 'Sea View',
+                                 'categ_id': self.room_type.id})
+        grandchild = type_obj.create({'name': 'Balcony',
+                                      'categ_id': child.id})
+        self.assertEqual(grandchild.name_get()[0][1], '%s / Sea View / '
+                         'Balcony' % self.room_type.complete_name)
+        found = [res[0] for res in type_obj.name_search('Sea View / Balc')]
+        self.assertEqual(found, grandchild.ids)
+        child.write({'name': 'Garden View'})
+        self.assertTrue(grandchild.complete_name.endswith(
+            'Garden View / Balcony'))
+        self.assertTrue(type_obj.search([('id', 'child_of',
+                                          self.room_type.id),
+                                         ('id', '=', grandchild.id)]))
+        with self.assertRaises(ValidationError):
+            self.room_type.write({'categ_id': grandchild.id})
+
+    def test_id_by_broj_sobe(self):
+        room_obj = self.env['hotel.room']
+        self.room.write({'broj_sobe': 9876})
+        self.assertEqual(room_obj.id_by_broj_sobe(9876), self.room.id)
+        self.room.write({'broj_sobe': 9877})
+        self.assertFalse(room_obj.id_by_broj_sobe(9876))
+        self.assertEqual(room_obj.id_by_broj_sobe(9877), self.room.id)
+        other = room_obj.create({'name': 'Room 9877',
+                                 'categ_id': self.room_type.id,
+                                 'capacity': 1})
+        # The unique index on the room number rejects the duplicate.
+        with self.assertRaises(IntegrityError), \
+                mute_logger('odoo.sql_db'), self.cr.savepoint():
+            other.write({'broj_sobe': 9877})
+        # The index is not created while the database holds duplicated
+        # numbers: the constraint still rejects new ones.
+        self.cr.execute('DROP INDEX IF EXISTS '
+                        'hotel_room_broj_sobe_company_uniq')
+        with self.assertRaises(ValidationError), self.cr.savepoint():
+            other.write({'broj_sobe': 9877})
+        other.write({'broj_sobe': 9878})
+        self.assertEqual(room_obj.id_by_broj_sobe(9878), other.id)
+
+    def test_apply_gateway_status(self):
+        self.room.write({'broj_sobe': 9870, 'sos_status': False,
+                         'gost_status': False, 'poziv_osoblju': False,
+                         'do_not_disturb': False})
+        history_obj = self.env['hotel.room.status.change']
+        count = history_obj.search_count([])
+        self.assertTrue(self.hotel_room_obj._apply_gateway_status(
+            {9870: 0x81, 9999: 0xff}))
+        self.assertTrue(self.room.sos_status)
+        self.assertTrue(self.room.gost_status)
+        self.assertFalse(self.room.do_not_disturb)
+        self.assertEqual(history_obj.search_count([]), count + 2)
+        self.assertFalse(self.hotel_room_obj._apply_gateway_status(
+            {9870: 0x81}))
+        self.assertEqual(history_obj.search_count([]), count + 2)
+
+    def test_room_command_queue(self):
+        command_obj = self.env['hotel.room.command']
+        command = self.hotel_room_obj.brisanje_kartice(3, self.room.id)
+        self.assertEqual(command.state, 'queued')
+        taken = {row[0]: row[1:] for row in command_obj._take_queued(100)}
+        self.assertIn(command.id, taken)
+        self.assertEqual(taken[command.id][0][4], 1)
+        self.assertEqual(taken[command.id][1], command.gateway_id.id)
+        self.assertEqual(command.state, 'sent')
+        self.assertNotIn(command.id,
+                         [row[0] for row in command_obj._take_queued(100)])
+        command_obj._apply_results([(command.id, 'done', None)])
+        self.assertEqual(command.state, 'done')
+        self.assertTrue(command.date_done)
+
+    def test_gateway_routes(self):
+        gateway_obj = self.env['hotel.gateway']
+        gateway_a = gateway_obj.create({'name': 'Corridor A',
+                                        'address': '10.0.0.11',
+                                        'hodnik': 'a', 'sequence': 1})
+        gateway_b = gateway_obj.create({'name': 'Corridor B',
+                                        'address': '10.0.0.12',
+                                        'hodnik': 'b', 'sequence': 2})
+        self.room.write({'hodnik': 'b', 'gateway_id': False})
+        routes = gateway_obj._get_routes()
+        self.assertEqual(routes['default'], gateway_a.id)
+        self.assertEqual(routes['rooms'][self.room.id], gateway_b.id)
+        self.assertIn((gateway_b.id, ('10.0.0.12', 80)),
+                      gateway_obj._get_gateway_links())
+        # A room served by the first gateway has its card commands sent
+        # to the card gateway.
+        gateway_cards = gateway_obj.create({'name': 'Cards',
+                                            'address': '10.0.0.13',
+                                            'card_commands': True,
+                                            'sequence': 3})
+        self.room.write({'hodnik': False})
+        routes = gateway_obj._get_routes()
+        self.assertEqual(routes['rooms'][self.room.id], gateway_a.id)
+        self.assertEqual(routes['commands'][self.room.id], gateway_cards.id)
+        command = self.hotel_room_obj.brisanje_kartice(3, self.room.id)
+        self.assertEqual(command.gateway_id, gateway_cards)
+        # The room's own gateway wins over its corridor.
+        self.room.write({'gateway_id': gateway_a.id})
+        self.assertEqual(gateway_obj._get_routes()['rooms'][self.room.id],
+                         gateway_a.id)
+        command = self.hotel_room_obj.brisanje_kartice(3, self.room.id)
+        self.assertEqual(command.gateway_id, gateway_a)
+        # Only the gateway serving the room reports its state.
+        self.room.write({'broj_sobe': 9871, 'sos_status': False})
+        self.assertFalse(self.hotel_room_obj._apply_gateway_status(
+            {9871: 0x80}, gateway_b.id))
+        self.assertTrue(self.hotel_room_obj._apply_gateway_status(
+            {9871: 0x80}, gateway_a.id))
+        self.assertTrue(self.room.sos_status)
+
+    def test_folio_line_keeps_manual_rent(self):
+        self.env['hotel.room.rate'].create({'categ_id': self.room_type.id,
+                                            'date_from': '2099-01-01',
+                                            'date_to': '2099-01-31',
+                                            'price': 100.0})
+        folio = self.env['hotel.folio'].create({
+            'partner_id': self.partner.id,
+            'partner_invoice_id': self.partner.id,
+            'partner_shipping_id': self.partner.id,
+            'pricelist_id': self.pricelist.id,
+            'warehouse_id': self.warehouse.id,
+            'checkin_date': '2099-01-10 12:00:00',
+            'checkout_date': '2099-01-12 10:00:00',
+        })
+        line = self.env['hotel.folio.line'].new({
+            'folio_id': folio.id,
+            'product_id': self.room.product_id.id,
+            'checkin_date': '2099-01-10 12:00:00',
+            'checkout_date': '2099-01-12 10:00:00',
+        })
+        line.product_id_change()
+        self.assertEqual(line.price_unit, 100.0)
+        # A rent set by the rates follows the dates.
+        line.checkout_date = '2099-02-04 10:00:00'
+        line.on_change_checkout()
+        self.assertNotEqual(line.price_unit, 100.0)
+        self.assertEqual(line.price_unit, line.rate_price)
+        # A rent edited by hand is kept.
+        line.price_unit = 55.0
+        line.checkout_date = '2099-01-11 10:00:00'
+        line.on_change_checkout()
+        self.assertEqual(line.price_unit, 55.0)
+        # A line priced before the rate price was stored gets the rent of
+        # the rates for its dates, whatever its own rent.
+        folio.write({'room_lines': [(0, 0, {
+            'checkin_date': '2099-01-10 12:00:00',
+            'checkout_date': '2099-01-12 10:00:00',
+            'product_id': self.room.product_id.id,
+            'product_uom': self.room.uom_id.id,
+            'name': self.room.name,
+            'price_unit': 55.0,
+            'product_uom_qty': 2})]})
+        self.assertFalse(folio.room_lines.rate_price)
+        self.env['hotel.folio.line']._init_rate_price()
+        self.assertEqual(folio.room_lines.rate_price, 100.0)
+        self.assertEqual(folio.room_lines.price_unit, 55.0)
+
+    def test_program_card_slot(self):
+        card = self.env['hotel.room.card'].create({'broj_kartice': '12345'})
+        command = self.hotel_room_obj.programiranje_kartice(
+            card.id, self.room.id, 3)
+        # The cards are programmed in the same slot whatever the slot
+        # computed for them.
+        self.assertEqual(bytes.fromhex(command.frame)[9], 0x0a)
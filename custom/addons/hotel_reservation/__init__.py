@@ -1,5 +1,13 @@
 # See LICENSE file for full copyright and licensing details.
 
+from odoo import api, SUPERUSER_ID
+
 from . import models
 from . import wizards
 from . import report
+
+
+def post_init_hook(cr, registry):
+    """Add the reservation lines to the daily room occupancy."""
+    env = api.Environment(cr, SUPERUSER_ID, {})
+    env['hotel.room.occupancy.day'].rebuild()
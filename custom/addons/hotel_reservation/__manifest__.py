@@ -2,7 +2,7 @@
 
 {
     'name': 'Hotel Reservation Management',
-    'version': '11.0.1.0.0',
+    'version': '11.0.1.1.0',
     'author': 'Odoo Community Association (OCA), Serpent Consulting \
                 Services Pvt. Ltd., Odoo S.A.',
     'category': 'Generic Modules/Hotel Reservation',
@@ -25,6 +25,7 @@
         'report/hotel_reservation_report.xml',
     ],
     'qweb': ['static/src/xml/hotel_room_summary.xml'],
+    'post_init_hook': 'post_init_hook',
     'installable': True,
     'auto_install': False,
 }
@@ -0,0 +1,14 @@
+# See LICENSE file for full copyright and licensing details.
+
+from odoo import api, SUPERUSER_ID
+
+
+def migrate(cr, version):
+    """
+    The daily room occupancy was filled before the reservation lines
+    were part of it, and keyed by UTC days: rebuild it.
+    """
+    if not version:
+        return
+    env = api.Environment(cr, SUPERUSER_ID, {})
+    env['hotel.room.occupancy.day'].rebuild()
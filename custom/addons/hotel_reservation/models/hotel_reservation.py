@@ -1,13 +1,20 @@
 # See LICENSE file for full copyright and licensing details.
 
+import json
 import time
 from datetime import datetime, timedelta
 from dateutil.relativedelta import relativedelta
 from odoo import api, fields, models, _
 from odoo.tools import DEFAULT_SERVER_DATETIME_FORMAT as dt
 from odoo.exceptions import ValidationError, UserError
+from odoo.osv import expression
+from odoo.addons.hotel.models.hotel import OCCUPANCY_STATES
 import pytz
 
+# Page sizes of the room reservation summary widget.
+SUMMARY_ROOM_LIMIT = 50
+SUMMARY_DAY_LIMIT = 31
+
 
 class HotelFolio(models.Model):
 
@@ -24,6 +31,9 @@ class HotelFolio(models.Model):
             context = {}
         context.update({'from_reservation': True})
         res = super(HotelFolio, self).write(vals)
+        if not {'room_lines', 'checkin_date',
+                'checkout_date'}.intersection(vals):
+            return res
         reservation_line_obj = self.env['hotel.room.reservation.line']
         for folio_obj in self:
             if folio_obj.reservation_id:
@@ -44,35 +54,17 @@ class HotelFolio(models.Model):
                                 reservation_obj.write(vals)
         return res
 
+    @api.multi
+    def _get_room_line_folios(self):
+        # The rooms of reservation folios are held by the reservation lines.
+        folios = super(HotelFolio, self)._get_room_line_folios()
+        return folios.filtered(lambda folio: not folio.reservation_id)
+
 
 class HotelFolioLineExt(models.Model):
 
     _inherit = 'hotel.folio.line'
 
-    @api.onchange('checkin_date', 'checkout_date')
-    def on_change_checkout(self):
-        res = super(HotelFolioLineExt, self).on_change_checkout()
-        hotel_room_obj = self.env['hotel.room']
-        avail_prod_ids = []
-        hotel_room_ids = hotel_room_obj.search([])
-        for room in hotel_room_ids:
-            assigned = False
-            for line in room.room_reservation_line_ids:
-                if line.status != 'cancel':
-                    if(self.checkin_date <= line.check_in <=
-                        self.checkout_date) or (self.checkin_date <=
-                                                line.check_out <=
-                                                self.checkout_date):
-                        assigned = True
-                    elif(line.check_in <= self.checkin_date <=
-                         line.check_out) or (line.check_in <=
-                                             self.checkout_date <=
-                                             line.check_out):
-                        assigned = True
-            if not assigned:
-                avail_prod_ids.append(room.product_id.id)
-        return res
-
     @api.multi
     def write(self, vals):
         """
@@ -172,6 +164,8 @@ class HotelReservation(models.Model):
                               ('cancel', 'Cancel'), ('done', 'Done')],
                              'State', readonly=True,
                              default=lambda *a: 'draft')
+    reminder_sent = fields.Boolean('Reminder Sent', readonly=True,
+                                   copy=False)
     folio_id = fields.Many2many('hotel.folio', 'hotel_folio_reservation_rel',
                                 'order_id', 'invoice_id', string='Folio')
     no_of_folio = fields.Integer('Folio', compute="_compute_folio_id")
@@ -303,6 +297,17 @@ class HotelReservation(models.Model):
             next_by_code('hotel.reservation') or 'New'
         return super(HotelReservation, self).create(vals)
 
+    @api.multi
+    def write(self, vals):
+        if 'checkin' in vals and 'reminder_sent' not in vals:
+            vals = dict(vals, reminder_sent=False)
+        res = super(HotelReservation, self).write(vals)
+        if 'state' in vals:
+            lines = self.env['hotel.room.reservation.line'].search(
+                [('reservation_id', 'in', self.ids)])
+            lines._occupancy_changed(lines._get_occupancy_changes())
+        return res
+
     @api.multi
     def check_overlap(self, date1, date2):
         date2 = datetime.strptime(date2, '%Y-%m-%d')
@@ -310,6 +315,61 @@ class HotelReservation(models.Model):
         delta = date2 - date1
         return set([date1 + timedelta(days=i) for i in range(delta.days + 1)])
 
+    @api.multi
+    def _get_overlap_dates(self, room_ids):
+        """
+        Return the days on which the given rooms are already held by
+        confirmed reservations during this reservation period. The days
+        come from the intersection of the occupancy ranges.
+        ------------------------------------------------------------------
+        @param self: The object pointer
+        @param room_ids: ids of the rooms to check
+        @return: sorted list of overlapping dates
+        """
+        self.ensure_one()
+        if not room_ids:
+            return []
+        self._cr.execute("""
+            SELECT lower(rl.occupancy * w.period),
+                   upper(rl.occupancy * w.period)
+              FROM hotel_room_reservation_line rl
+              JOIN hotel_reservation hr ON hr.id = rl.reservation_id,
+                   (SELECT tsrange(%s, %s, '[]') AS period) w
+             WHERE rl.room_id IN %s
+               AND hr.state IN ('confirm', 'done')
+               AND rl.occupancy && w.period
+        """, (self.checkin, self.checkout, tuple(room_ids)))
+        overlap_dates = set()
+        for start, stop in self._cr.fetchall():
+            start, stop = start.date(), stop.date()
+            for day in range((stop - start).days + 1):
+                overlap_dates.add(start + timedelta(days=day))
+        return sorted(overlap_dates)
+
+    @api.model
+    def _lock_rooms(self, room_ids):
+        """
+        Lock the hotel_room rows of the rooms being reserved, in id order
+        so that concurrent confirmations can not deadlock. A confirmation
+        waiting on a room updated by a concurrent one fails with a
+        serialization error once the other commits, so a room is never
+        reserved twice. The RPC layer, which server actions and wizards
+        go through, retries the call against the committed reservation
+        lines. The other callers get the error and their transaction is
+        rolled back: a cron job confirms again on its next run, a script
+        (odoo-bin shell, a custom command) must retry the call itself.
+        ------------------------------------------------------------------
+        @param self: The object pointer
+        @param room_ids: ids of the rooms to lock
+        """
+        if room_ids:
+            self._cr.execute("""
+                SELECT id FROM hotel_room
+                 WHERE id IN %s
+                 ORDER BY id
+                   FOR UPDATE
+            """, (tuple(room_ids),))
+
     @api.multi
     def confirmed_reservation(self):
         """
@@ -319,87 +379,70 @@ class HotelReservation(models.Model):
         @return: new record set for hotel room reservation line.
         """
         reservation_line_obj = self.env['hotel.room.reservation.line']
-        vals = {}
+        reserved_rooms = self.env['hotel.room']
+        self._lock_rooms(self.mapped('reservation_line.reserve').ids)
         for reservation in self:
-            reserv_checkin = datetime.strptime(reservation.checkin, dt)
-            reserv_checkout = datetime.strptime(reservation.checkout, dt)
-            room_bool = False
-            for line_id in reservation.reservation_line:
-                for room_id in line_id.reserve:
-                    if room_id.room_reservation_line_ids:
-                        for reserv in room_id.room_reservation_line_ids.\
-                                search([('status', 'in', ('confirm', 'done')),
-                                        ('room_id', '=', room_id.id)]):
-                            check_in = datetime.strptime(reserv.check_in, dt)
-                            check_out = datetime.strptime(reserv.check_out, dt)
-                            if check_in <= reserv_checkin <= check_out:
-                                room_bool = True
-                            if check_in <= reserv_checkout <= check_out:
-                                room_bool = True
-                            if reserv_checkin <= check_in and \
-                                    reserv_checkout >= check_out:
-                                room_bool = True
-                            mytime = "%Y-%m-%d"
-                            r_checkin = datetime.strptime(reservation.checkin,
-                                                          dt).date()
-                            r_checkin = r_checkin.strftime(mytime)
-                            r_checkout = datetime.\
-                                strptime(reservation.checkout, dt).date()
-                            r_checkout = r_checkout.strftime(mytime)
-                            check_intm = datetime.strptime(reserv.check_in,
-                                                           dt).date()
-                            check_outtm = datetime.strptime(reserv.check_out,
-                                                            dt).date()
-                            check_intm = check_intm.strftime(mytime)
-                            check_outtm = check_outtm.strftime(mytime)
-                            range1 = [r_checkin, r_checkout]
-                            range2 = [check_intm, check_outtm]
-                            overlap_dates = self.check_overlap(*range1) \
-                                & self.check_overlap(*range2)
-                            overlap_dates = [datetime.strftime(dates,
-                                                               '%d/%m/%Y') for
-                                             dates in overlap_dates]
-                            if room_bool:
-                                raise ValidationError(_('You tried to Confirm '
-                                                        'Reservation with room'
-                                                        ' those already '
-                                                        'reserved in this '
-                                                        'Reservation Period. '
-                                                        'Overlap Dates are '
-                                                        '%s') % overlap_dates)
-                            else:
-                                self.state = 'confirm'
-                                vals = {'room_id': room_id.id,
-                                        'check_in': reservation.checkin,
-                                        'check_out': reservation.checkout,
-                                        'state': 'assigned',
-                                        'reservation_id': reservation.id,
-                                        }
-                                room_id.write({'isroom': False,
-                                               'status': 'occupied'})
-                        else:
-                            self.state = 'confirm'
-                            vals = {'room_id': room_id.id,
-                                    'check_in': reservation.checkin,
-                                    'check_out': reservation.checkout,
-                                    'state': 'assigned',
-                                    'reservation_id': reservation.id,
-                                    }
-                            room_id.write({'isroom': False,
-                                           'status': 'occupied'})
-                    else:
-                        self.state = 'confirm'
-                        vals = {'room_id': room_id.id,
-                                'check_in': reservation.checkin,
-                                'check_out': reservation.checkout,
-                                'state': 'assigned',
-                                'reservation_id': reservation.id,
-                                }
-                        room_id.write({'isroom': False,
-                                       'status': 'occupied'})
-                    reservation_line_obj.create(vals)
+            rooms = reservation.reservation_line.mapped('reserve')
+            overlap_dates = reservation._get_overlap_dates(rooms.ids)
+            if overlap_dates:
+                overlap_dates = [datetime.strftime(dates, '%d/%m/%Y') for
+                                 dates in overlap_dates]
+                raise ValidationError(_('You tried to Confirm '
+                                        'Reservation with room'
+                                        ' those already '
+                                        'reserved in this '
+                                        'Reservation Period. '
+                                        'Overlap Dates are '
+                                        '%s') % overlap_dates)
+            reservation.state = 'confirm'
+            reservation_line_obj._create_occupancy_lines([{
+                'room_id': room.id,
+                'check_in': reservation.checkin,
+                'check_out': reservation.checkout,
+                'state': 'assigned',
+                'reservation_id': reservation.id,
+            } for room in rooms])
+            reserved_rooms |= rooms
+        reserved_rooms.write({'isroom': False, 'status': 'occupied'})
         return True
 
+    @api.model
+    def create_block_reservation(self, vals, room_counts):
+        """
+        Create and confirm a block reservation of many rooms. The free
+        rooms are taken from one availability snapshot of the period and
+        the reservation is confirmed in a single pass.
+        -----------------------------------------------------------------
+        @param self: The object pointer
+        @param vals: values of the reservation, checkin and checkout
+                     included
+        @param room_counts: dictionary {room category id: number of rooms}
+        @return: the confirmed reservation
+        """
+        room_obj = self.env['hotel.room']
+        busy_ids = room_obj._get_busy_room_ids(vals['checkin'],
+                                               vals['checkout'])
+        free_rooms = room_obj.search([('categ_id', 'in', list(room_counts)),
+                                      ('id', 'not in', busy_ids)],
+                                     order='id')
+        reservation_lines = []
+        for categ in self.env['hotel.room.type'].browse(list(room_counts)):
+            rooms = free_rooms.filtered(
+                lambda room: room.categ_id == categ)[:room_counts[categ.id]]
+            if len(rooms) < room_counts[categ.id]:
+                raise ValidationError(_('Only %s rooms of type %s are '
+                                        'available in this Reservation '
+                                        'Period.') % (len(rooms),
+                                                      categ.name))
+            if rooms:
+                reservation_lines.append((0, 0, {
+                    'categ_id': categ.id,
+                    'reserve': [(6, 0, rooms.ids)]}))
+        reservation = self.create(dict(vals,
+                                       reservation_line=reservation_lines))
+        reservation.confirmed_reservation()
+        return reservation
+
     @api.multi
     def cancel_reservation(self):
         """
@@ -409,19 +452,28 @@ class HotelReservation(models.Model):
         @return: cancel record set for hotel room reservation line.
         """
         room_res_line_obj = self.env['hotel.room.reservation.line']
-        hotel_res_line_obj = self.env['hotel_reservation.line']
-        self.state = 'cancel'
+        self.write({'state': 'cancel'})
         room_reservation_line = room_res_line_obj.search([('reservation_id',
                                                            'in', self.ids)])
-        room_reservation_line.write({'state': 'unassigned'})
         room_reservation_line.unlink()
-        reservation_lines = hotel_res_line_obj.search([('line_id',
-                                                        'in', self.ids)])
-        for reservation_line in reservation_lines:
-            reservation_line.reserve.write({'isroom': True,
-                                            'status': 'available'})
+        self.mapped('reservation_line.reserve').write({'isroom': True,
+                                                       'status': 'available'})
         return True
 
+    @api.model
+    def cancel_reservations(self, domain):
+        """
+        Cancel all the open reservations matching a domain at once.
+        ----------------------------------------------------------
+        @param self: The object pointer
+        @param domain: search domain of the reservations to cancel
+        @return: number of cancelled reservations
+        """
+        reservations = self.search(expression.AND([
+            domain, [('state', 'in', ('draft', 'confirm'))]]))
+        reservations.cancel_reservation()
+        return len(reservations)
+
     @api.multi
     def set_to_draft_reservation(self):
         self.state = 'draft'
@@ -478,21 +530,47 @@ class HotelReservation(models.Model):
         find all tomorrow's reservations.
         ----------------------------------------------
         @param self: The object pointer
-        @return: send a mail
+        @return: queue the reminder mails
         """
-        now_str = time.strftime(dt)
-        now_date = datetime.strptime(now_str, dt)
-        ir_model_data = self.env['ir.model.data']
-        template_id = (ir_model_data.get_object_reference
-                       ('hotel_reservation',
-                        'mail_template_reservation_reminder_24hrs')[1])
-        template_rec = self.env['mail.template'].browse(template_id)
-        for reserv_rec in self.search([]):
-            checkin_date = (datetime.strptime(reserv_rec.checkin, dt))
-            difference = relativedelta(now_date, checkin_date)
-            if(difference.days == -1 and reserv_rec.partner_id.email and
-               reserv_rec.state == 'confirm'):
-                template_rec.send_mail(reserv_rec.id, force_send=True)
+        now = datetime.now()
+        template = self.env.ref('hotel_reservation.'
+                                'mail_template_reservation_reminder_24hrs')
+        reservations = self.search([
+            ('state', '=', 'confirm'),
+            ('reminder_sent', '=', False),
+            ('checkin', '>=', (now + timedelta(days=1)).strftime(dt)),
+            ('checkin', '<', (now + timedelta(days=2)).strftime(dt)),
+            ('partner_id.email', '!=', False),
+        ])
+        if not reservations:
+            return True
+        # Render all the reminders at once and queue them for the mail
+        # scheduler instead of sending them inline.
+        values = template.generate_email(reservations.ids)
+        mail_obj = self.env['mail.mail']
+        attachment_obj = self.env['ir.attachment']
+        for reservation in reservations:
+            mail_vals = values[reservation.id]
+            mail_vals['recipient_ids'] = [(4, pid) for pid in
+                                          mail_vals.pop('partner_ids', [])]
+            attachment_ids = mail_vals.pop('attachment_ids', [])
+            attachments = mail_vals.pop('attachments', [])
+            if not mail_vals.get('email_from'):
+                mail_vals.pop('email_from', None)
+            mail = mail_obj.create(mail_vals)
+            # The rendered reports are attached like send_mail does.
+            for name, datas in attachments:
+                attachment_ids.append(attachment_obj.create({
+                    'name': name,
+                    'datas_fname': name,
+                    'datas': datas,
+                    'type': 'binary',
+                    'res_model': 'mail.message',
+                    'res_id': mail.mail_message_id.id,
+                }).id)
+            if attachment_ids:
+                mail.write({'attachment_ids': [(6, 0, attachment_ids)]})
+        reservations.write({'reminder_sent': True})
         return True
 
     @api.multi
@@ -505,22 +583,33 @@ class HotelReservation(models.Model):
         """
         hotel_folio_obj = self.env['hotel.folio']
         room_obj = self.env['hotel.room']
+        reserved_rooms = room_obj
+        items = []
+        stays = []
+        folios_vals = []
         for reservation in self:
-            folio_lines = []
-            checkin_date = reservation['checkin']
-            checkout_date = reservation['checkout']
-            if not self.checkin < self.checkout:
+            if not reservation.checkin < reservation.checkout:
                 raise ValidationError(_('Checkout date should be greater \
                                          than the Check-in date.'))
-            duration_vals = (self.onchange_check_dates
-                             (checkin_date=checkin_date,
-                              checkout_date=checkout_date, duration=False))
+            duration_vals = (reservation.onchange_check_dates
+                             (checkin_date=reservation.checkin,
+                              checkout_date=reservation.checkout,
+                              duration=False))
             duration = duration_vals.get('duration') or 0.0
-            folio_vals = {
+            rooms = reservation.reservation_line.mapped('reserve')
+            reserved_rooms |= rooms
+            fpos = reservation.partner_id.property_account_position_id
+            items += [(room.product_id, duration, reservation.partner_id,
+                       reservation.pricelist_id,
+                       reservation.date_order[:10], fpos)
+                      for room in rooms]
+            stays += [(reservation.checkin, reservation.checkout)] * len(rooms)
+            folios_vals.append((reservation, duration, rooms, {
                 'date_order': reservation.date_order,
                 'warehouse_id': reservation.warehouse_id.id,
                 'partner_id': reservation.partner_id.id,
                 'pricelist_id': reservation.pricelist_id.id,
+                'fiscal_position_id': fpos.id,
                 'partner_invoice_id': reservation.partner_invoice_id.id,
                 'partner_shipping_id': reservation.partner_shipping_id.id,
                 'checkin_date': reservation.checkin,
@@ -528,28 +617,41 @@ class HotelReservation(models.Model):
                 'duration': duration,
                 'reservation_id': reservation.id,
                 'service_lines': reservation['folio_id']
-            }
-            for line in reservation.reservation_line:
-                for r in line.reserve:
-                    folio_lines.append((0, 0, {
-                        'checkin_date': checkin_date,
-                        'checkout_date': checkout_date,
-                        'product_id': r.product_id and r.product_id.id,
-                        'name': reservation['reservation_no'],
-                        'price_unit': r.list_price,
-                        'product_uom_qty': duration,
-                        'is_reserved': True}))
-                    res_obj = room_obj.browse([r.id])
-                    res_obj.write({'status': 'occupied', 'isroom': False})
-            folio_vals.update({'room_lines': folio_lines})
+            }))
+        # All the room lines are priced at once, per pricelist.
+        prices = self.env['product.pricelist']._get_hotel_prices(items)
+        # The nightly rates of the room categories apply on top of them.
+        rate_prices = iter(self.env['hotel.folio.line']._get_room_rate_prices(
+            [(item[0], stay[0], stay[1], item[3], price['price_unit'])
+             for item, stay, price in zip(items, stays, prices)]))
+        prices = iter(prices)
+        folio_rel = []
+        for reservation, duration, rooms, folio_vals in folios_vals:
+            folio_vals['room_lines'] = []
+            for room in rooms:
+                price = next(prices)
+                rate_price = next(rate_prices)
+                folio_vals['room_lines'].append((0, 0, {
+                    'checkin_date': reservation.checkin,
+                    'checkout_date': reservation.checkout,
+                    'product_id': room.product_id.id,
+                    'name': reservation['reservation_no'],
+                    'price_unit': rate_price,
+                    'rate_price': rate_price,
+                    'tax_id': [(6, 0, price['tax_id'].ids)],
+                    'product_uom_qty': duration,
+                    'is_reserved': True}))
+            # hotel.folio has no multi-record create in this version.
             folio = hotel_folio_obj.create(folio_vals)
-            if folio:
-                for rm_line in folio.room_lines:
-                    rm_line.product_id_change()
+            folio_rel.append((reservation.id, folio.id))
+        if folio_rel:
             self._cr.execute('insert into hotel_folio_reservation_rel'
-                             '(order_id, invoice_id) values (%s,%s)',
-                             (reservation.id, folio.id))
-            self.state = 'done'
+                             '(order_id, invoice_id) values %s' %
+                             ', '.join(['%s'] * len(folio_rel)),
+                             folio_rel)
+            self.invalidate_cache(['folio_id'])
+        reserved_rooms.write({'status': 'occupied', 'isroom': False})
+        self.write({'state': 'done'})
         return True
 
     @api.multi
@@ -607,42 +709,13 @@ class HotelReservationLine(models.Model):
         -----------------------------------------------------------
         @param self: object pointer
         '''
-        hotel_room_obj = self.env['hotel.room']
-        hotel_room_ids = hotel_room_obj.search([('categ_id', '=',
-                                                 self.categ_id.id)])
-        room_ids = []
         if not self.line_id.checkin:
             raise ValidationError(_('Before choosing a room,\n You have to \
                                      select a Check in date or a Check out \
                                      date in the reservation form.'))
-        for room in hotel_room_ids:
-            assigned = False
-            for line in room.room_reservation_line_ids:
-                if line.status != 'cancel':
-                    if(self.line_id.checkin <= line.check_in <=
-                        self.line_id.checkout) or (self.line_id.checkin <=
-                                                   line.check_out <=
-                                                   self.line_id.checkout):
-                        assigned = True
-                    elif(line.check_in <= self.line_id.checkin <=
-                         line.check_out) or (line.check_in <=
-                                             self.line_id.checkout <=
-                                             line.check_out):
-                        assigned = True
-            for rm_line in room.room_line_ids:
-                if rm_line.status != 'cancel':
-                    if(self.line_id.checkin <= rm_line.check_in <=
-                       self.line_id.checkout) or (self.line_id.checkin <=
-                                                  rm_line.check_out <=
-                                                  self.line_id.checkout):
-                        assigned = True
-                    elif(rm_line.check_in <= self.line_id.checkin <=
-                         rm_line.check_out) or (rm_line.check_in <=
-                                                self.line_id.checkout <=
-                                                rm_line.check_out):
-                        assigned = True
-            if not assigned:
-                room_ids.append(room.id)
+        rooms = self.env['hotel.room'].get_available_rooms(
+            self.line_id.checkin, self.line_id.checkout, self.categ_id.id)
+        room_ids = rooms.ids
         domain = {'reserve': [('id', 'in', room_ids)]}
         return {'domain': domain}
 
@@ -654,26 +727,29 @@ class HotelReservationLine(models.Model):
         @return: True/False.
         """
         hotel_room_reserv_line_obj = self.env['hotel.room.reservation.line']
-        for reserv_rec in self:
-            for rec in reserv_rec.reserve:
-                hres_arg = [('room_id', '=', rec.id),
-                            ('reservation_id', '=', reserv_rec.line_id.id)]
-                myobj = hotel_room_reserv_line_obj.search(hres_arg)
-                if myobj.ids:
-                    rec.write({'isroom': True, 'status': 'available'})
-                    myobj.unlink()
+        keys = {(room.id, reserv_rec.line_id.id) for reserv_rec in self
+                for room in reserv_rec.reserve}
+        hres_arg = [('room_id', 'in', self.mapped('reserve').ids),
+                    ('reservation_id', 'in', self.mapped('line_id').ids)]
+        room_lines = hotel_room_reserv_line_obj.search(hres_arg).filtered(
+            lambda line: (line.room_id.id, line.reservation_id.id) in keys)
+        rooms = room_lines.mapped('room_id')
+        room_lines.unlink()
+        rooms.write({'isroom': True, 'status': 'available'})
         return super(HotelReservationLine, self).unlink()
 
 
 class HotelRoomReservationLine(models.Model):
 
     _name = 'hotel.room.reservation.line'
+    _inherit = 'hotel.room.occupancy.mixin'
     _description = 'Hotel Room Reservation'
     _rec_name = 'room_id'
+    _occupancy_exclusion = "state = 'assigned'"
 
-    room_id = fields.Many2one('hotel.room', string='Room id')
-    check_in = fields.Datetime('Check In Date', required=True)
-    check_out = fields.Datetime('Check Out Date', required=True)
+    room_id = fields.Many2one('hotel.room', string='Room id', index=True)
+    check_in = fields.Datetime('Check In Date', required=True, index=True)
+    check_out = fields.Datetime('Check Out Date', required=True, index=True)
     state = fields.Selection([('assigned', 'Assigned'),
                               ('unassigned', 'Unassigned')], 'Room Status')
     reservation_id = fields.Many2one('hotel.reservation',
@@ -697,53 +773,45 @@ class HotelRoom(models.Model):
         @param self: The object pointer
         @return: True/False.
         """
-        for room in self:
-            for reserv_line in room.room_reservation_line_ids:
-                if reserv_line.status == 'confirm':
-                    raise ValidationError(_('User is not able to delete the \
-                                            room after the room in %s state \
-                                            in reservation')
-                                          % (reserv_line.status))
+        reserv_line = self.env['hotel.room.reservation.line'].search(
+            [('room_id', 'in', self.ids),
+             ('reservation_id.state', '=', 'confirm')], limit=1)
+        if reserv_line:
+            raise ValidationError(_('User is not able to delete the \
+                                    room after the room in %s state \
+                                    in reservation')
+                                  % (reserv_line.status))
         return super(HotelRoom, self).unlink()
 
+    @api.model
+    def _get_occupancy_queries(self):
+        queries = super(HotelRoom, self)._get_occupancy_queries()
+        queries.append("""
+            SELECT rl.room_id, rl.check_in, rl.check_out, rl.occupancy,
+                   CASE WHEN rl.state = 'assigned'
+                         AND COALESCE(hr.state, '') != 'draft'
+                        THEN 'reserved' ELSE 'draft' END AS state,
+                   'hotel.reservation'::varchar AS res_model,
+                   rl.reservation_id AS res_id
+              FROM hotel_room_reservation_line rl
+              LEFT JOIN hotel_reservation hr ON hr.id = rl.reservation_id
+             WHERE rl.room_id IS NOT NULL
+               AND COALESCE(hr.state, '') != 'cancel'
+        """)
+        return queries
+
     @api.model
     def cron_room_line(self):
         """
         This method is for scheduler
-        every 1min scheduler will call this method and check Status of
-        room is occupied or available
+        every day scheduler will call this method and check Status of
+        room is occupied or available, the status changes in between are
+        applied by the room status events
         --------------------------------------------------------------
         @param self: The object pointer
         @return: update status of hotel room reservation line
         """
-        reservation_line_obj = self.env['hotel.room.reservation.line']
-        folio_room_line_obj = self.env['folio.room.line']
-        now = datetime.now()
-        curr_date = now.strftime(dt)
-        for room in self.search([]):
-            reserv_line_ids = [reservation_line.ids for
-                               reservation_line in
-                               room.room_reservation_line_ids]
-            reserv_args = [('id', 'in', reserv_line_ids),
-                           ('check_in', '<=', curr_date),
-                           ('check_out', '>=', curr_date)]
-            reservation_line_ids = reservation_line_obj.search(reserv_args)
-            rooms_ids = [room_line.ids for room_line in room.room_line_ids]
-            rom_args = [('id', 'in', rooms_ids),
-                        ('check_in', '<=', curr_date),
-                        ('check_out', '>=', curr_date)]
-            room_line_ids = folio_room_line_obj.search(rom_args)
-            status = {'isroom': True, 'color': 5}
-            if reservation_line_ids.ids:
-                status = {'isroom': False, 'color': 2}
-            room.write(status)
-            if room_line_ids.ids:
-                status = {'isroom': False, 'color': 2}
-            room.write(status)
-            if reservation_line_ids.ids and room_line_ids.ids:
-                raise ValidationError(_('Please Check Rooms Status \
-                                         for %s.' % (room.name)))
-        return True
+        return self._update_room_status()
 
 
 class RoomReservationSummary(models.Model):
@@ -755,6 +823,8 @@ class RoomReservationSummary(models.Model):
                        invisible=True)
     date_from = fields.Datetime('Date From')
     date_to = fields.Datetime('Date To')
+    floor_id = fields.Many2one('hotel.floor', 'Floor')
+    categ_id = fields.Many2one('hotel.room.type', 'Room Category')
     summary_header = fields.Text('Summary Header')
     room_summary = fields.Text('Room Summary')
 
@@ -812,152 +882,127 @@ class RoomReservationSummary(models.Model):
                 'target': 'new',
                 }
 
-    @api.onchange('date_from', 'date_to')
+    @api.model
+    def _get_summary_days(self, date_from, date_to, tz='UTC'):
+        '''
+        Return the days of the summary period in the hotel timezone, the
+        one the daily occupancy is stored in.
+        @param self: object pointer
+        @param date_from: start of the period (server datetime string)
+        @param date_to: end of the period (server datetime string)
+        @param tz: timezone of the hotel days
+        @return: list of (header label, date) tuples
+        '''
+        timezone = pytz.timezone(tz)
+        d_frm_obj = datetime.strptime(date_from, dt)\
+            .replace(tzinfo=pytz.timezone('UTC')).astimezone(timezone)
+        d_to_obj = datetime.strptime(date_to, dt)\
+            .replace(tzinfo=pytz.timezone('UTC')).astimezone(timezone)
+        days = []
+        temp_date = d_frm_obj
+        while(temp_date <= d_to_obj):
+            val = (str(temp_date.strftime("%a")) + ' ' +
+                   str(temp_date.strftime("%b")) + ' ' +
+                   str(temp_date.strftime("%d")))
+            days.append((val, temp_date.strftime(dt)))
+            temp_date = temp_date + timedelta(days=1)
+        return days
+
+    @api.model
+    def get_summary_page(self, date_from, date_to, offset=0,
+                         limit=SUMMARY_ROOM_LIMIT, day_offset=0,
+                         day_limit=SUMMARY_DAY_LIMIT, floor_id=False,
+                         categ_id=False, room_ids=None):
+        '''
+        Return one page of the room summary: a slice of the rooms matching
+        the floor and category filters, for a slice of the period days.
+        The page costs the same few queries whatever its position.
+        @param self: object pointer
+        @param date_from: start of the period (server datetime string)
+        @param date_to: end of the period (server datetime string)
+        @param offset: index of the first room of the page
+        @param limit: number of rooms of the page
+        @param day_offset: index of the first day of the page
+        @param day_limit: number of days of the page
+        @param floor_id: optional floor of the rooms
+        @param categ_id: optional category of the rooms
+        @param room_ids: optional ids of the rooms, used to refresh the
+                         rows of rooms whose occupancy changed
+        @return: dictionary with the header labels, the room rows and the
+                 total number of rooms and days
+        '''
+        room_obj = self.env['hotel.room']
+        domain = []
+        if floor_id:
+            domain.append(('floor_id', '=', floor_id))
+        if categ_id:
+            domain.append(('categ_id', '=', categ_id))
+        if room_ids is not None:
+            domain.append(('id', 'in', room_ids))
+        # Every page is headed with the days of the first room, so that
+        # the pages line up.
+        tz = room_obj.search(domain, limit=1)._get_hotel_tz()
+        days = self._get_summary_days(date_from, date_to, tz)
+        page_days = days[day_offset:day_offset + day_limit]
+        rooms = room_obj.search(domain, offset=offset, limit=limit)
+        cells = {}
+        if page_days:
+            # The days are read from the daily occupancy table, keyed by
+            # the local days of the hotel like the summary days.
+            day_from = datetime.strptime(page_days[0][1][:10],
+                                         '%Y-%m-%d').date()
+            cells = self.env['hotel.room.occupancy.day']._get_room_days(
+                day_from, len(page_days), rooms.ids)
+        reserved_codes = (OCCUPANCY_STATES.index('reserved'),
+                          OCCUPANCY_STATES.index('folio'))
+        all_room_detail = []
+        for room in rooms:
+            room_list_stats = []
+            row = cells.get(room.id, [])
+            for idx, (label, chk_date) in enumerate(page_days):
+                if row[idx] in reserved_codes:
+                    room_list_stats.append({'state': 'Reserved',
+                                            'date': chk_date,
+                                            'room_id': room.id,
+                                            'is_draft': 'No',
+                                            'data_model': '',
+                                            'data_id': 0})
+                else:
+                    room_list_stats.append({'state': 'Free',
+                                            'date': chk_date,
+                                            'room_id': room.id})
+            all_room_detail.append({'id': room.id,
+                                    'name': room.name or '',
+                                    'value': room_list_stats})
+        return {'header': [label for label, chk_date in page_days],
+                'rooms': all_room_detail,
+                'total': room_obj.search_count(domain),
+                'total_days': len(days)}
+
+    @api.onchange('date_from', 'date_to', 'floor_id', 'categ_id')
     def get_room_summary(self):
         '''
+        Store the first page of the summary as JSON, the widget loads the
+        next rooms and days on demand through get_summary_page.
         @param self: object pointer
          '''
         res = {}
-        all_detail = []
-        room_obj = self.env['hotel.room']
-        reservation_line_obj = self.env['hotel.room.reservation.line']
-        folio_room_line_obj = self.env['folio.room.line']
-        user_obj = self.env['res.users']
-        date_range_list = []
-        main_header = []
-        summary_header_list = ['Rooms']
         if self.date_from and self.date_to:
             if self.date_from > self.date_to:
                 raise UserError(_('Please Check Time period Date From can\'t \
                                    be greater than Date To !'))
-            if self._context.get('tz', False):
-                timezone = pytz.timezone(self._context.get('tz', False))
-            else:
-                timezone = pytz.timezone('UTC')
-            d_frm_obj = datetime.strptime(self.date_from, dt)\
-                .replace(tzinfo=pytz.timezone('UTC')).astimezone(timezone)
-            d_to_obj = datetime.strptime(self.date_to, dt)\
-                .replace(tzinfo=pytz.timezone('UTC')).astimezone(timezone)
-            temp_date = d_frm_obj
-            while(temp_date <= d_to_obj):
-                val = ''
-                val = (str(temp_date.strftime("%a")) + ' ' +
-                       str(temp_date.strftime("%b")) + ' ' +
-                       str(temp_date.strftime("%d")))
-                summary_header_list.append(val)
-                date_range_list.append(temp_date.strftime
-                                       (dt))
-                temp_date = temp_date + timedelta(days=1)
-            all_detail.append(summary_header_list)
-            room_ids = room_obj.search([])
-            all_room_detail = []
-            for room in room_ids:
-                room_detail = {}
-                room_list_stats = []
-                room_detail.update({'name': room.name or ''})
-                if not room.room_reservation_line_ids and \
-                   not room.room_line_ids:
-                    for chk_date in date_range_list:
-                        room_list_stats.append({'state': 'Free',
-                                                'date': chk_date,
-                                                'room_id': room.id})
-                else:
-                    for chk_date in date_range_list:
-                        ch_dt = chk_date[:10] + ' 23:59:59'
-                        ttime = datetime.strptime(ch_dt, dt)
-                        c = ttime.replace(tzinfo=timezone).\
-                            astimezone(pytz.timezone('UTC'))
-                        chk_date = c.strftime(dt)
-                        reserline_ids = room.room_reservation_line_ids.ids
-                        reservline_ids = (reservation_line_obj.search
-                                          ([('id', 'in', reserline_ids),
-                                            ('check_in', '<=', chk_date),
-                                            ('check_out', '>=', chk_date),
-                                            ('state', '=', 'assigned')
-                                            ]))
-                        if not reservline_ids:
-                            sdt = dt
-                            chk_date = datetime.strptime(chk_date, sdt)
-                            chk_date = datetime.\
-                                strftime(chk_date - timedelta(days=1), sdt)
-                            reservline_ids = (reservation_line_obj.search
-                                              ([('id', 'in', reserline_ids),
-                                                ('check_in', '<=', chk_date),
-                                                ('check_out', '>=', chk_date),
-                                                ('state', '=', 'assigned')]))
-                            for res_room in reservline_ids:
-                                rrci = res_room.check_in
-                                rrco = res_room.check_out
-                                cid = datetime.strptime(rrci, dt)
-                                cod = datetime.strptime(rrco, dt)
-                                dur = cod - cid
-                                if room_list_stats:
-                                    count = 0
-                                    for rlist in room_list_stats:
-                                        cidst = datetime.strftime(cid, dt)
-                                        codst = datetime.strftime(cod, dt)
-                                        rm_id = res_room.room_id.id
-                                        ci = rlist.get('date') >= cidst
-                                        co = rlist.get('date') <= codst
-                                        rm = rlist.get('room_id') == rm_id
-                                        st = rlist.get('state') == 'Reserved'
-                                        if ci and co and rm and st:
-                                            count += 1
-                                    if count - dur.days == 0:
-                                        c_id1 = user_obj.browse(self._uid)
-                                        c_id = c_id1.company_id
-                                        con_add = 0
-                                        amin = 0.0
-                                        if c_id:
-                                            con_add = c_id.additional_hours
-#                                        When configured_addition_hours is
-#                                        greater than zero then we calculate
-#                                        additional minutes
-                                        if con_add > 0:
-                                            amin = abs(con_add * 60)
-                                        hr_dur = abs((dur.seconds / 60))
-#                                        When additional minutes is greater
-#                                        than zero then check duration with
-#                                        extra minutes and give the room
-#                                        reservation status is reserved or
-#                                        free
-                                        if amin > 0:
-                                            if hr_dur >= amin:
-                                                reservline_ids = True
-                                            else:
-                                                reservline_ids = False
-                                        else:
-                                            if hr_dur > 0:
-                                                reservline_ids = True
-                                            else:
-                                                reservline_ids = False
-                                    else:
-                                        reservline_ids = False
-                        fol_room_line_ids = room.room_line_ids.ids
-                        chk_state = ['draft', 'cancel']
-                        folio_resrv_ids = (folio_room_line_obj.search
-                                           ([('id', 'in', fol_room_line_ids),
-                                             ('check_in', '<=', chk_date),
-                                             ('check_out', '>=', chk_date),
-                                             ('status', 'not in', chk_state)
-                                             ]))
-                        if reservline_ids or folio_resrv_ids:
-                            room_list_stats.append({'state': 'Reserved',
-                                                    'date': chk_date,
-                                                    'room_id': room.id,
-                                                    'is_draft': 'No',
-                                                    'data_model': '',
-                                                    'data_id': 0})
-                        else:
-                            room_list_stats.append({'state': 'Free',
-                                                    'date': chk_date,
-                                                    'room_id': room.id})
-
-                room_detail.update({'value': room_list_stats})
-                all_room_detail.append(room_detail)
-            main_header.append({'header': summary_header_list})
-            self.summary_header = str(main_header)
-            self.room_summary = str(all_room_detail)
+            page = self.get_summary_page(self.date_from, self.date_to,
+                                         floor_id=self.floor_id.id,
+                                         categ_id=self.categ_id.id)
+            main_header = [{'header': ['Rooms'] + page['header'],
+                            'total': page['total'],
+                            'total_days': page['total_days'],
+                            'params': {'date_from': self.date_from,
+                                       'date_to': self.date_to,
+                                       'floor_id': self.floor_id.id,
+                                       'categ_id': self.categ_id.id}}]
+            self.summary_header = json.dumps(main_header)
+            self.room_summary = json.dumps(page['rooms'])
         return res
 
 
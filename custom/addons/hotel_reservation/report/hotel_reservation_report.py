@@ -131,20 +131,16 @@ class ReportTestMaxroom(models.AbstractModel):
 
     def _get_room_used_detail(self, date_start, date_end):
         room_used_details = []
-        hotel_room_obj = self.env['hotel.room']
-        room_ids = hotel_room_obj.search([])
-        for room in hotel_room_obj.browse(room_ids.ids):
-            counter = 0
-            details = {}
-            if room.room_reservation_line_ids:
-                for room_resv_line in room.room_reservation_line_ids:
-                    if(room_resv_line.check_in >= date_start and
-                       room_resv_line.check_in <= date_end):
-                        counter += 1
-            if counter >= 1:
-                details.update({'name': room.name or '',
-                                'no_of_times_used': counter})
-                room_used_details.append(details)
+        line_obj = self.env['hotel.room.reservation.line']
+        groups = line_obj.read_group([('check_in', '>=', date_start),
+                                      ('check_in', '<=', date_end),
+                                      ('room_id', '!=', False)],
+                                     ['room_id'], ['room_id'])
+        for group in groups:
+            room_used_details.append({
+                'name': group['room_id'][1] or '',
+                'no_of_times_used': group['room_id_count'],
+            })
         return room_used_details
 
     @api.model
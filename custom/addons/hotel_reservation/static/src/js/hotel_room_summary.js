@@ -1,7 +1,9 @@
 odoo.define('hotel_reservation.hotel_room_summary', function (require) {
 'use strict';
 
+var bus = require('bus.bus').bus;
 var core = require('web.core');
+var session = require('web.session');
 var basicFields = require('web.basic_fields');
 var FieldText = basicFields.FieldText;
 var registry = require('web.field_registry');
@@ -9,8 +11,23 @@ var registry = require('web.field_registry');
 var QWeb = core.qweb;
 var _t = core._t;
 
+// Page sizes, kept in line with SUMMARY_ROOM_LIMIT and SUMMARY_DAY_LIMIT.
+var ROOM_LIMIT = 50;
+var DAY_LIMIT = 31;
+// Bus channel of the occupancy changes, see OCCUPANCY_CHANNEL.
+var OCCUPANCY_CHANNEL = 'hotel_room_summary';
+
+function parseSummary(value) {
+    return value ? JSON.parse(value) : [];
+}
+
 
 var MyWidget = FieldText.extend({
+    // A single delegated handler serves every free cell, including the
+    // ones appended while scrolling.
+    events: _.extend({}, FieldText.prototype.events, {
+        'click .table_free': '_onFreeCellClick',
+    }),
 
 	    init: function () {
         this._super.apply(this, arguments);
@@ -18,8 +35,8 @@ var MyWidget = FieldText.extend({
             this.tagName = 'span';
         }
         this.set({
-            summary_header: py.eval(this.recordData.summary_header),
-            room_summary: py.eval(this.recordData.room_summary ),
+            summary_header: parseSummary(this.recordData.summary_header),
+            room_summary: parseSummary(this.recordData.room_summary),
         });
     },
     start: function() {
@@ -30,25 +47,37 @@ var MyWidget = FieldText.extend({
         if (! this.get("summary_header") || ! this.get("room_summary"))
                return
 
+        this.changed_room_ids = [];
+        this._patchChangedRooms = _.debounce(this._patchChangedRooms.bind(this), 300);
+        bus.add_channel(OCCUPANCY_CHANNEL);
+        bus.on('notification', this, this._onNotification);
+        bus.start_polling();
+
         this.renderElement();
         this.view_loading();
      },
 
+     destroy: function () {
+        bus.off('notification', this, this._onNotification);
+        this._super.apply(this, arguments);
+     },
+
      view_loading: function(r) {
          return this.load_form(r);
      },
 
      load_form: function(data) {
-         var self = this
-         this.$el.find(".table_free").bind("click", function(event){
-            self.do_action({
-                     type: 'ir.actions.act_window',
-                     res_model: "quick.room.reservation",
-                     views: [[false, 'form']],
-                     target: 'new',
-                     context: {"room_id": $(this).attr("data"), 'date': $(this).attr("date"), 'default_adults': 1},
-             });
-         });
+         var header = this.get('summary_header')[0] || {};
+         this.page = {
+             params: header.params || {},
+             total: header.total || 0,
+             total_days: header.total_days || 0,
+             loaded_rooms: this.get('room_summary').length,
+             loaded_days: Math.max((header.header || []).length - 1, 0),
+             loading: false,
+         };
+         this.$('.o_room_summary').on('scroll',
+             _.throttle(this._onScroll.bind(this), 200));
      },
 
      renderElement: function() {
@@ -62,13 +91,183 @@ var MyWidget = FieldText.extend({
         reset: function (record, event) {
         var res = this._super(record, event);
         this.set({
-            "summary_header": py.eval(this.recordData.summary_header),
-            "room_summary":py.eval(this.recordData.room_summary)
+            "summary_header": parseSummary(this.recordData.summary_header),
+            "room_summary": parseSummary(this.recordData.room_summary)
         });
         this.renderElement();
         this.view_loading();
         return res;
     },
+
+    /**
+     * Fetch one page of the summary from the server.
+     *
+     * @private
+     * @param {Object} kwargs page position, merged with the filters
+     * @returns {Deferred}
+     */
+    _fetchPage: function (kwargs) {
+        var self = this;
+        this.page.loading = true;
+        return this._rpc({
+            model: 'room.reservation.summary',
+            method: 'get_summary_page',
+            kwargs: _.extend({context: session.user_context},
+                             this.page.params, kwargs),
+        }).always(function () {
+            self.page.loading = false;
+        });
+    },
+
+    /**
+     * Append the next rooms, for the days already displayed.
+     *
+     * @private
+     */
+    _loadMoreRooms: function () {
+        var self = this;
+        var page = this.page;
+        if (page.loading || page.loaded_rooms >= page.total) {
+            return;
+        }
+        this._fetchPage({
+            offset: page.loaded_rooms,
+            limit: ROOM_LIMIT,
+            day_offset: 0,
+            day_limit: page.loaded_days,
+        }).then(function (result) {
+            self.$('tbody').append(QWeb.render('RoomSummary.Rows', {
+                rooms: result.rooms,
+            }));
+            page.loaded_rooms += result.rooms.length;
+            page.total = result.total;
+        });
+    },
+
+    /**
+     * Append the next days, for the rooms already displayed.
+     *
+     * @private
+     */
+    _loadMoreDays: function () {
+        var self = this;
+        var page = this.page;
+        if (page.loading || page.loaded_days >= page.total_days) {
+            return;
+        }
+        this._fetchPage({
+            offset: 0,
+            limit: page.loaded_rooms,
+            day_offset: page.loaded_days,
+            day_limit: DAY_LIMIT,
+        }).then(function (result) {
+            self.$('.o_room_summary_header').append(
+                QWeb.render('RoomSummary.HeaderCells', {header: result.header}));
+            _.each(result.rooms, function (room) {
+                self.$('tr[data-room-id="' + room.id + '"]').append(
+                    QWeb.render('RoomSummary.Cells', {values: room.value}));
+            });
+            page.loaded_days += result.header.length;
+        });
+    },
+
+    /**
+     * Reload the cells of the displayed rooms whose occupancy changed,
+     * leaving the rest of the grid untouched.
+     *
+     * @private
+     */
+    _patchChangedRooms: function () {
+        var self = this;
+        var room_ids = this.changed_room_ids;
+        this.changed_room_ids = [];
+        if (!room_ids.length || !this.page.loaded_days) {
+            return;
+        }
+        this._rpc({
+            model: 'room.reservation.summary',
+            method: 'get_summary_page',
+            kwargs: _.extend({context: session.user_context}, this.page.params, {
+                offset: 0,
+                limit: room_ids.length,
+                day_offset: 0,
+                day_limit: this.page.loaded_days,
+                room_ids: room_ids,
+            }),
+        }).then(function (result) {
+            _.each(result.rooms, function (room) {
+                var $row = self.$('tr[data-room-id="' + room.id + '"]');
+                $row.children('td:not(:first)').remove();
+                $row.append(QWeb.render('RoomSummary.Cells', {values: room.value}));
+            });
+        });
+    },
+
+    //--------------------------------------------------------------------------
+    // Handlers
+    //--------------------------------------------------------------------------
+
+    /**
+     * Queue the displayed rooms touched by an occupancy change published
+     * on the bus, the patch is debounced to group bursts of changes.
+     *
+     * @private
+     * @param {Array} notifications
+     */
+    _onNotification: function (notifications) {
+        var self = this;
+        if (!this.page) {
+            return;
+        }
+        var date_from = (this.page.params.date_from || '').slice(0, 10);
+        var date_to = (this.page.params.date_to || '').slice(0, 10);
+        _.each(notifications, function (notification) {
+            if (notification[0] !== OCCUPANCY_CHANNEL) {
+                return;
+            }
+            _.each(notification[1].changes, function (change) {
+                var overlaps = change.date_to.slice(0, 10) >= date_from &&
+                               change.date_from.slice(0, 10) <= date_to;
+                if (overlaps && self.$('tr[data-room-id="' + change.room_id + '"]').length &&
+                        !_.contains(self.changed_room_ids, change.room_id)) {
+                    self.changed_room_ids.push(change.room_id);
+                }
+            });
+        });
+        if (this.changed_room_ids.length) {
+            this._patchChangedRooms();
+        }
+    },
+
+    /**
+     * @private
+     * @param {MouseEvent} event
+     */
+    _onFreeCellClick: function (event) {
+        var $cell = $(event.currentTarget);
+        this.do_action({
+            type: 'ir.actions.act_window',
+            res_model: "quick.room.reservation",
+            views: [[false, 'form']],
+            target: 'new',
+            context: {"room_id": $cell.attr("data"), 'date': $cell.attr("date"), 'default_adults': 1},
+        });
+    },
+    /**
+     * Load further rooms or days when the view is scrolled near its end.
+     *
+     * @private
+     * @param {Event} event
+     */
+    _onScroll: function (event) {
+        var el = event.currentTarget;
+        if (el.scrollTop + el.clientHeight >= el.scrollHeight - 50) {
+            this._loadMoreRooms();
+        }
+        if (el.scrollLeft + el.clientWidth >= el.scrollWidth - 50) {
+            this._loadMoreDays();
+        }
+    },
 });
 
 registry.add(
@@ -1,8 +1,15 @@
 # -*- coding: utf-8 -*-
 # See LICENSE file for full copyright and licensing details.
 
+import base64
+import json
+from unittest.mock import patch
+
+from psycopg2 import OperationalError
+
 from odoo.tests import common
-from datetime import datetime
+from odoo.tools import mute_logger
+from datetime import datetime, timedelta
 from odoo.exceptions import ValidationError
 
 
@@ -17,25 +24,23 @@ class TestReservation(common.TransactionCase):
         self.hotel_room_reserv_obj = self.env['hotel.room.reservation.line']
         self.reserv_summary_obj = self.env['room.reservation.summary']
         self.quick_room_reserv_obj = self.env['quick.room.reservation']
-        self.reserv_line = self.env.\
-            ref('hotel_reservation.hotel_reservation_0')
         self.room_type = self.env.ref('hotel.hotel_room_type_1')
-        self.room = self.env.ref('hotel.hotel_room_0')
         self.warehouse = self.env.ref('stock.warehouse0')
         self.partner = self.env.ref('base.res_partner_2')
         self.pricelist = self.env.ref('product.list0')
         self.floor = self.env.ref('hotel.hotel_floor_ground0')
         self.manager = self.env.ref('base.user_root')
+        self.room = self.hotel_room_obj.create({
+            'name': 'Room 101',
+            'categ_id': self.room_type.id,
+            'floor_id': self.floor.id,
+            'max_adult': 2,
+            'max_child': 1,
+            'capacity': 4,
+        })
 
         cur_date = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
 
-        self.hotel_reserv_line = self.hotel_reserv_line_obj.\
-            create({'name': 'R/00001',
-                    'line_id': self.reserv_line.id,
-                    'reserve': [(6, 0, [self.room.id])],
-                    'categ_id': self.room_type.id,
-                    })
-
         self.hotel_reserv = self.hotel_reserv_obj.\
             create({'reservation_no': 'R/00002',
                     'date_order': cur_date,
@@ -47,8 +52,13 @@ class TestReservation(common.TransactionCase):
                     'adults': 1,
                     'state': 'draft',
                     'children': 1,
-                    'reservation_line': [(6, 0, [self.room.id])],
+                    'reservation_line': [(0, 0, {
+                        'name': 'R/00001',
+                        'reserve': [(6, 0, [self.room.id])],
+                        'categ_id': self.room_type.id,
+                    })],
                     })
+        self.hotel_reserv_line = self.hotel_reserv.reservation_line
 
         self.reserv_summary = self.reserv_summary_obj.\
             create({'name': 'Room Reservation Summary',
@@ -76,16 +86,14 @@ class TestReservation(common.TransactionCase):
                     })
 
         self.hotel_room = self.hotel_room_obj.\
-            create({'product_id': self.room.id,
+            create({'name': 'Room 102',
+                    'categ_id': self.room_type.id,
                     'floor_id': self.floor.id,
                     'max_adult': 2,
                     'max_child': 1,
                     'capacity': 4,
                     'status': 'available',
                     'product_manager': self.manager.id,
-                    'room_reservation_line_ids': [(6, 0,
-                                                   [self.hotel_room_reserv.id]
-                                                   )],
                     })
 
     def test_hotel_room_unlink(self):
@@ -113,6 +121,11 @@ class TestReservation(common.TransactionCase):
 
     def test_get_room_summary(self):
         self.reserv_summary.get_room_summary()
+        header = json.loads(self.reserv_summary.summary_header)
+        rooms = json.loads(self.reserv_summary.room_summary)
+        for room in rooms:
+            self.assertEqual(len(room['value']),
+                             len(header[0]['header']) - 1)
 
     def test_check_reservation_rooms(self):
         for rec in self.hotel_reserv.reservation_line:
@@ -159,12 +172,60 @@ class TestReservation(common.TransactionCase):
         with self.assertRaises(ValidationError):
             self.hotel_reserv.create_folio()
 
+    def test_create_folio_fiscal_position(self):
+        tax_obj = self.env['account.tax']
+        tax = tax_obj.create({'name': 'Hotel Tax', 'amount': 10.0,
+                              'type_tax_use': 'sale'})
+        export_tax = tax_obj.create({'name': 'Hotel Export Tax',
+                                     'amount': 0.0, 'type_tax_use': 'sale'})
+        fpos = self.env['account.fiscal.position'].create({
+            'name': 'Hotel Export',
+            'tax_ids': [(0, 0, {'tax_src_id': tax.id,
+                                'tax_dest_id': export_tax.id})],
+        })
+        self.partner.property_account_position_id = fpos
+        self.room.product_id.write({'taxes_id': [(6, 0, tax.ids)]})
+        self.hotel_reserv.write({'checkin': '2099-01-10 12:00:00',
+                                 'checkout': '2099-01-12 10:00:00'})
+        self.hotel_reserv.create_folio()
+        folio = self.hotel_reserv.folio_id
+        self.assertEqual(folio.fiscal_position_id, fpos)
+        self.assertEqual(folio.room_lines.tax_id, export_tax)
+
     def test_onchange_check_dates(self):
         self.hotel_reserv.onchange_check_dates()
 
     def test_confirmed_reservation(self):
         self.hotel_reserv.confirmed_reservation()
 
+    def test_confirmed_reservation_overlap(self):
+        vals = {'checkin': '2099-04-01 12:00:00',
+                'checkout': '2099-04-03 10:00:00'}
+        self.hotel_reserv.write(vals)
+        other = self.hotel_reserv_obj.create(dict(
+            vals,
+            date_order=self.hotel_reserv.date_order,
+            warehouse_id=self.warehouse.id,
+            partner_id=self.partner.id,
+            pricelist_id=self.pricelist.id,
+            adults=1,
+            reservation_line=[(0, 0, {
+                'name': 'R/00003',
+                'reserve': [(6, 0, [self.room.id])],
+                'categ_id': self.room_type.id,
+            })]))
+        self.hotel_reserv.confirmed_reservation()
+        with self.assertRaises(ValidationError):
+            other.confirmed_reservation()
+
+    def test_lock_rooms(self):
+        self.hotel_reserv_obj._lock_rooms(self.hotel_room.ids)
+        # The rooms stay locked until the confirming transaction ends.
+        with self.registry.cursor() as cr, mute_logger('odoo.sql_db'):
+            with self.assertRaises(OperationalError):
+                cr.execute('SELECT id FROM hotel_room WHERE id = %s '
+                           'FOR UPDATE NOWAIT', (self.hotel_room.id,))
+
     def test_cancel_reservation(self):
         self.hotel_reserv.cancel_reservation()
         self.assertEqual(self.hotel_reserv.state == 'cancel', True)
@@ -174,3 +235,206 @@ class TestReservation(common.TransactionCase):
 
     def test_unlink(self):
         self.hotel_reserv_line.unlink()
+
+    def test_get_available_rooms(self):
+        cur_date = self.hotel_room_reserv.check_in
+        rooms = self.hotel_room_obj.get_available_rooms(cur_date, cur_date)
+        self.assertNotIn(self.room, rooms)
+        rooms = self.hotel_room_obj.get_available_rooms(
+            '2099-01-01 12:00:00', '2099-01-02 12:00:00', self.room_type.id)
+        self.assertTrue(all(room.categ_id == self.room_type
+                            for room in rooms))
+
+    def test_get_overlap_dates(self):
+        self.assertEqual(self.hotel_reserv._get_overlap_dates([]), [])
+        self.hotel_reserv.confirmed_reservation()
+        overlap = self.hotel_reserv._get_overlap_dates(
+            self.hotel_reserv.reservation_line.mapped('reserve').ids)
+        self.assertTrue(overlap)
+
+    def test_availability_matrix(self):
+        matrix = self.hotel_room_obj.availability_matrix(
+            '2099-01-01', '2099-01-10', categ_ids=[self.room_type.id])
+        self.assertEqual(len(matrix['dates']), 10)
+        for room in matrix['rooms']:
+            self.assertEqual(len(room['row']), 10)
+            self.assertEqual(room['categ_id'], self.room_type.id)
+
+    def test_get_summary_page(self):
+        summary = self.reserv_summary
+        page = summary.get_summary_page(summary.date_from, summary.date_to,
+                                        limit=1, categ_id=self.room_type.id)
+        self.assertLessEqual(len(page['rooms']), 1)
+        self.assertEqual(len(page['header']), page['total_days'])
+
+    def test_occupancy_change_notification(self):
+        bus_obj = self.env['bus.bus']
+        domain = [('channel', '=', json.dumps('hotel_room_summary'))]
+        count = bus_obj.search_count(domain)
+        self.hotel_room_reserv.write({'check_out': '2099-01-02 12:00:00'})
+        self.assertEqual(bus_obj.search_count(domain), count + 1)
+        self.hotel_room_reserv.write({'state': 'assigned'})
+        self.assertEqual(bus_obj.search_count(domain), count + 2)
+
+    def test_occupancy_day_sync(self):
+        day_obj = self.env['hotel.room.occupancy.day']
+        domain = [('room_id', '=', self.room.id),
+                  ('date', '>=', '2099-01-01'),
+                  ('date', '<=', '2099-01-31')]
+        self.hotel_room_reserv.write({'check_in': '2099-01-01 10:00:00',
+                                      'check_out': '2099-01-03 10:00:00',
+                                      'state': 'assigned'})
+        days = day_obj.search(domain)
+        self.assertEqual(days.mapped('date'), ['2099-01-01', '2099-01-02'])
+        self.assertEqual(set(days.mapped('state')), {'reserved'})
+        day_obj.rebuild('2099-01-01', '2099-01-31')
+        self.assertEqual(day_obj.search(domain).mapped('date'),
+                         ['2099-01-01', '2099-01-02'])
+        self.hotel_room_reserv.unlink()
+        self.assertFalse(day_obj.search(domain))
+
+    def test_occupancy_day_timezone(self):
+        day_obj = self.env['hotel.room.occupancy.day']
+        company = (self.room.company_id or
+                   self.env.ref('base.main_company'))
+        company.partner_id.tz = 'Europe/Belgrade'
+        company.additional_hours = 0
+        # 23:30 UTC is already the next day in Belgrade.
+        self.hotel_room_reserv.write({'check_in': '2099-01-01 23:30:00',
+                                      'check_out': '2099-01-03 10:00:00',
+                                      'state': 'assigned'})
+        domain = [('room_id', '=', self.room.id),
+                  ('date', '>=', '2099-01-01'),
+                  ('date', '<=', '2099-01-31')]
+        self.assertEqual(day_obj.search(domain).mapped('date'),
+                         ['2099-01-02', '2099-01-03'])
+        summary = self.reserv_summary_obj.get_summary_page(
+            '2099-01-01 12:00:00', '2099-01-03 12:00:00',
+            room_ids=self.room.ids)
+        self.assertEqual([cell['state'] for cell in
+                          summary['rooms'][0]['value']],
+                         ['Free', 'Reserved', 'Reserved'])
+        # The days follow the company settings.
+        company.partner_id.tz = 'America/New_York'
+        self.assertEqual(day_obj.search(domain).mapped('date'),
+                         ['2099-01-01', '2099-01-02', '2099-01-03'])
+        company.additional_hours = 12
+        self.assertEqual(day_obj.search(domain).mapped('date'),
+                         ['2099-01-01', '2099-01-02'])
+        summary = self.reserv_summary_obj.get_summary_page(
+            '2099-01-01 12:00:00', '2099-01-03 12:00:00',
+            room_ids=self.room.ids)
+        self.assertEqual([cell['state'] for cell in
+                          summary['rooms'][0]['value']],
+                         ['Reserved', 'Reserved', 'Free'])
+
+    def test_room_status_events(self):
+        event_obj = self.env['hotel.room.status.event']
+        self.hotel_room_reserv.write({'check_in': '2000-01-01 10:00:00',
+                                      'check_out': '2099-01-03 10:00:00'})
+        events = event_obj.search([('room_id', '=', self.room.id)])
+        self.assertIn('2099-01-03 10:00:01', events.mapped('date'))
+        event_obj.process_due_events()
+        self.assertEqual(self.room.status, 'occupied')
+        self.assertEqual(event_obj.search([('room_id', '=', self.room.id)]
+                                          ).mapped('date'),
+                         ['2099-01-03 10:00:01'])
+
+    def test_reservation_reminder_batch(self):
+        mail_obj = self.env['mail.mail']
+        checkin = datetime.now() + timedelta(days=1, hours=1)
+        self.hotel_reserv.write({
+            'checkin': checkin.strftime('%Y-%m-%d %H:%M:%S'),
+            'checkout': (checkin + timedelta(days=2)).strftime(
+                '%Y-%m-%d %H:%M:%S'),
+            'state': 'confirm'})
+        count = mail_obj.search_count([])
+        self.hotel_reserv_obj.reservation_reminder_24hrs()
+        self.assertTrue(self.hotel_reserv.reminder_sent)
+        self.assertEqual(mail_obj.search_count([]), count + 1)
+        self.hotel_reserv_obj.reservation_reminder_24hrs()
+        self.assertEqual(mail_obj.search_count([]), count + 1)
+
+    def test_reservation_reminder_attachments(self):
+        checkin = datetime.now() + timedelta(days=1, hours=1)
+        self.hotel_reserv.write({
+            'checkin': checkin.strftime('%Y-%m-%d %H:%M:%S'),
+            'checkout': (checkin + timedelta(days=2)).strftime(
+                '%Y-%m-%d %H:%M:%S'),
+            'state': 'confirm'})
+        template_class = type(self.env['mail.template'])
+        generate_email = template_class.generate_email
+        report = base64.b64encode(b'%PDF-1.4')
+
+        def generate_with_report(template, res_ids, fields=None):
+            values = generate_email(template, res_ids, fields=fields)
+            for mail_vals in values.values():
+                mail_vals['attachments'] = [('Reservation.pdf', report)]
+            return values
+
+        with patch.object(template_class, 'generate_email',
+                          generate_with_report):
+            self.hotel_reserv_obj.reservation_reminder_24hrs()
+        mail = self.env['mail.mail'].search([], order='id desc', limit=1)
+        self.assertEqual(mail.attachment_ids.mapped('name'),
+                         ['Reservation.pdf'])
+        self.assertEqual(mail.attachment_ids.datas, report)
+
+    def test_create_block_reservation(self):
+        reservation = self.hotel_reserv_obj.create_block_reservation({
+            'partner_id': self.partner.id,
+            'pricelist_id': self.pricelist.id,
+            'warehouse_id': self.warehouse.id,
+            'checkin': '2099-03-01 12:00:00',
+            'checkout': '2099-03-03 10:00:00',
+            'adults': 1,
+        }, {self.room_type.id: 1})
+        self.assertEqual(reservation.state, 'confirm')
+        lines = self.hotel_room_reserv_obj.search(
+            [('reservation_id', '=', reservation.id)])
+        self.assertEqual(len(lines), 1)
+        self.assertEqual(lines.room_id.categ_id, self.room_type)
+        self.assertEqual(lines.state, 'assigned')
+        with self.assertRaises(ValidationError):
+            self.hotel_reserv_obj.create_block_reservation({
+                'partner_id': self.partner.id,
+                'pricelist_id': self.pricelist.id,
+                'warehouse_id': self.warehouse.id,
+                'checkin': '2099-03-01 12:00:00',
+                'checkout': '2099-03-03 10:00:00',
+                'adults': 1,
+            }, {self.room_type.id: 10000})
+
+    def test_cancel_reservations(self):
+        self.hotel_room_reserv.write({'reservation_id': self.hotel_reserv.id})
+        domain = [('id', '=', self.hotel_reserv.id)]
+        self.assertEqual(self.hotel_reserv_obj.cancel_reservations(domain), 1)
+        self.assertEqual(self.hotel_reserv.state, 'cancel')
+        self.assertFalse(self.hotel_room_reserv_obj.search(
+            [('reservation_id', '=', self.hotel_reserv.id)]))
+        self.assertEqual(self.hotel_reserv_obj.cancel_reservations(domain), 0)
+
+    def test_cancel_reservations_server_action(self):
+        other = self.hotel_reserv.copy()
+        action = self.env.ref('hotel_reservation.action_cancel_reservations')
+        # The list always sends its search domain, only the ticked rows
+        # are cancelled.
+        action.with_context(active_model='hotel.reservation',
+                            active_ids=self.hotel_reserv.ids,
+                            active_id=self.hotel_reserv.id,
+                            active_domain=[('state', '=', 'draft')]).run()
+        self.assertEqual(self.hotel_reserv.state, 'cancel')
+        self.assertEqual(other.state, 'draft')
+
+    def test_create_occupancy_lines(self):
+        self.assertFalse(self.hotel_room.room_reservation_line_ids)
+        lines = self.hotel_room_reserv_obj._create_occupancy_lines([{
+            'room_id': self.hotel_room.id,
+            'check_in': '2099-03-01 12:00:00',
+            'check_out': '2099-03-03 10:00:00',
+            'state': 'assigned',
+            'reservation_id': self.hotel_reserv.id,
+        }])
+        # The rooms read before the insert see the new lines.
+        self.assertEqual(self.hotel_room.room_reservation_line_ids, lines)
+        self.assertEqual(lines.status, self.hotel_reserv.state)
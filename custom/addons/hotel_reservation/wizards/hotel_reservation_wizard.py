@@ -1,6 +1,6 @@
 # See LICENSE file for full copyright and licensing details.
 
-from odoo import api, fields, models
+from odoo import api, fields, models, _
 
 
 class HotelReservationWizard(models.TransientModel):
@@ -67,3 +67,64 @@ class MakeFolioWizard(models.TransientModel):
             'view_id': False,
             'type': 'ir.actions.act_window'
         }
+
+
+class BlockReservationWizard(models.TransientModel):
+    _name = 'hotel.block.reservation.wizard'
+    _description = 'Block Reservation'
+
+    partner_id = fields.Many2one('res.partner', 'Guest Name', required=True)
+    warehouse_id = fields.Many2one('stock.warehouse', 'Hotel', required=True,
+                                   default=1)
+    pricelist_id = fields.Many2one('product.pricelist', 'Scheme',
+                                   required=True)
+    checkin = fields.Datetime('Expected-Date-Arrival', required=True)
+    checkout = fields.Datetime('Expected-Date-Departure', required=True)
+    adults = fields.Integer('Adults', required=True, default=1)
+    children = fields.Integer('Children')
+    line_ids = fields.One2many('hotel.block.reservation.wizard.line',
+                               'wizard_id', 'Rooms')
+
+    @api.onchange('partner_id')
+    def onchange_partner_id(self):
+        self.pricelist_id = self.partner_id.property_product_pricelist
+
+    @api.multi
+    def create_block_reservation(self):
+        self.ensure_one()
+        room_counts = {}
+        for line in self.line_ids:
+            room_counts[line.categ_id.id] = (room_counts.get(line.categ_id.id,
+                                                             0) +
+                                             line.room_count)
+        addr = self.partner_id.address_get(['invoice', 'delivery',
+                                            'contact'])
+        reservation = self.env['hotel.reservation'].create_block_reservation({
+            'partner_id': self.partner_id.id,
+            'partner_invoice_id': addr['invoice'],
+            'partner_order_id': addr['contact'],
+            'partner_shipping_id': addr['delivery'],
+            'pricelist_id': self.pricelist_id.id,
+            'warehouse_id': self.warehouse_id.id,
+            'checkin': self.checkin,
+            'checkout': self.checkout,
+            'adults': self.adults,
+            'children': self.children,
+        }, room_counts)
+        return {
+            'name': _('Reservation'),
+            'view_type': 'form',
+            'view_mode': 'form',
+            'res_model': 'hotel.reservation',
+            'res_id': reservation.id,
+            'type': 'ir.actions.act_window'
+        }
+
+
+class BlockReservationWizardLine(models.TransientModel):
+    _name = 'hotel.block.reservation.wizard.line'
+    _description = 'Block Reservation Rooms'
+
+    wizard_id = fields.Many2one('hotel.block.reservation.wizard')
+    categ_id = fields.Many2one('hotel.room.type', 'Room Type', required=True)
+    room_count = fields.Integer('Number Of Rooms', required=True, default=1)
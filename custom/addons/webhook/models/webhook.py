@@ -236,7 +236,8 @@ class Webhook(models.Model):
         data_record = data['records']
         data_record = data_record[1:-1]
         data_record = json.loads(data_record)
-        hotel_room = self.env['hotel.room'].search([("broj_sobe", '=', data_record['broj_sobe'])])
+        room_obj = self.env['hotel.room']
+        hotel_room = room_obj.browse(room_obj.id_by_broj_sobe(data_record['broj_sobe']))
         print(data_record['do_not_disturb'])
         print(data_record['gost_status'])
         print(data_record['poziv_osoblju'])